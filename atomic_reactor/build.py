@@ -111,6 +111,19 @@ class BuildResult(object):
     def is_image_available(self):
         return self._image_id and self._image_id is not self.REMOTE_IMAGE
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # REMOTE_IMAGE sentinel wouldn't be the same object once unpickled
+        if self._image_id is self.REMOTE_IMAGE:
+            state['_image_id'] = None
+            state['_is_remote'] = True
+        return state
+
+    def __setstate__(self, state):
+        if state.pop('_is_remote', False):
+            state['_image_id'] = self.REMOTE_IMAGE
+        self.__dict__.update(state)
+
 
 class InsideBuilder(LastLogger, BuilderStateMachine):
     """
@@ -33,12 +33,14 @@ DOCKERFILE_REACTOR_TARBALL_NAME = "atomic-reactor.tar.gz"
 
 class BuildImageBuilder(object):
     def __init__(self, reactor_tarball_path=None, reactor_local_path=None,
-                 reactor_remote_path=None, use_official_reactor_git=False):
+                 reactor_remote_path=None, use_official_reactor_git=False,
+                 git_cache_dir=None):
         self.tasker = DockerTasker()
         self.reactor_tarball_path = reactor_tarball_path
         self.reactor_local_path = reactor_local_path
         self.reactor_remote_path = reactor_remote_path
         self.use_official_reactor_git = use_official_reactor_git
+        self.git_cache_dir = git_cache_dir
         if not self.reactor_tarball_path and \
            not self.reactor_local_path and \
            not self.reactor_remote_path and \
@@ -105,7 +107,7 @@ class BuildImageBuilder(object):
             if self.use_official_reactor_git:
                 self.reactor_remote_path = REACTOR_GIT_URL
 
-            g = LazyGit(self.reactor_remote_path, tmpdir=tmpdir)
+            g = LazyGit(self.reactor_remote_path, tmpdir=tmpdir, cache_dir=self.git_cache_dir)
             local_reactor_git_path = g.git_path
 
         cwd = os.getcwd()
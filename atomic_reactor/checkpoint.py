@@ -0,0 +1,315 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Checkpoints of build phases
+
+After every phase (pre-build, build-step, pre-publish and post-build
+plugins) state of the workflow is stored in checkpoint directory. When the
+same build is started again with the same checkpoint directory, phases which
+were completed with the same inputs are not run again: their state is
+restored instead. Pre-build phase is skipped only together with build-step,
+files it leaves in build directory are not stored. Exit plugins always run.
+
+Inputs of a phase are the source, the image name, configuration of the phase
+plugins and inputs of all previous phases.
+"""
+
+from __future__ import unicode_literals
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+from six.moves import cPickle as pickle
+
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILENAME = 'checkpoint.pickle'
+# exported images are preserved in this subdirectory
+FILES_DIRNAME = 'files'
+# bump when format of stored state changes
+CHECKPOINT_VERSION = 1
+# version 2 is readable by both python 2 and python 3
+PICKLE_PROTOCOL = 2
+
+# phase name -> workflow attribute with configuration of its plugins
+PHASES = (
+    ('prebuild', 'prebuild_plugins_conf'),
+    ('buildstep', 'buildstep_plugins_conf'),
+    ('prepublish', 'prepublish_plugins_conf'),
+    ('postbuild', 'postbuild_plugins_conf'),
+)
+# workflow attributes stored after every phase
+WORKFLOW_ATTRIBUTES = (
+    'prebuild_results',
+    'buildstep_result',
+    'prepub_results',
+    'postbuild_results',
+    'build_result',
+    'plugin_workspace',
+    'plugins_timestamps',
+    'plugins_durations',
+    'plugins_errors',
+    'exported_image_sequence',
+    'tag_conf',
+    'push_conf',
+    'files',
+    'image_components',
+    'pulled_base_images',
+    'built_image_inspect',
+    'layer_sizes',
+)
+
+
+def _ensure_dir(path):
+    try:
+        os.makedirs(path)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+
+
+class Checkpoint(object):
+    """
+    states of the workflow after completed phases
+    """
+
+    def __init__(self, checkpoint_dir):
+        """
+        :param checkpoint_dir: str, directory for checkpoint and preserved files
+        """
+        self.checkpoint_dir = checkpoint_dir
+        self.path = os.path.join(checkpoint_dir, CHECKPOINT_FILENAME)
+        self.files_dir = os.path.join(checkpoint_dir, FILES_DIRNAME)
+        # list of dicts: phase name, digest of its inputs, pickled state
+        self.phases = []
+
+    def load(self):
+        """
+        read checkpoint of previous run, if there is any usable one
+        """
+        self.phases = []
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+        except (IOError, OSError) as ex:
+            if ex.errno != errno.ENOENT:
+                logger.warning("can't read checkpoint '%s': %r", self.path, ex)
+            return
+        except Exception as ex:
+            logger.warning("ignoring broken checkpoint '%s': %r", self.path, ex)
+            return
+
+        if data.get('version') != CHECKPOINT_VERSION:
+            logger.warning("ignoring checkpoint '%s' of version %s", self.path,
+                           data.get('version'))
+            return
+
+        self.phases = data['phases']
+        logger.info("loaded checkpoint with completed phases: %s",
+                    ', '.join(phase['name'] for phase in self.phases))
+
+    def _save(self):
+        _ensure_dir(self.checkpoint_dir)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'version': CHECKPOINT_VERSION, 'phases': self.phases}, f,
+                        PICKLE_PROTOCOL)
+        os.rename(tmp_path, self.path)
+
+    def clear(self):
+        """
+        remove checkpoint and preserved files
+        """
+        self.phases = []
+        for path in (self.path, self.path + '.tmp'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        shutil.rmtree(self.files_dir, ignore_errors=True)
+
+    def get_inputs_digest(self, workflow, phase_name, previous_digest):
+        """
+        :return: str, digest of everything which influences result of the phase
+        """
+        source = workflow.source
+        plugins_conf = getattr(workflow, dict(PHASES)[phase_name])
+        inputs = {
+            'previous': previous_digest,
+            'phase': phase_name,
+            'image': workflow.image,
+            'source': {
+                'provider': source.provider,
+                'uri': source.uri,
+                'dockerfile_path': source.dockerfile_path,
+                'provider_params': source.provider_params,
+                'commit_id': getattr(source, 'commit_id', None),
+            },
+            'plugins': plugins_conf,
+        }
+        # plugin arguments are not necessarily JSON serializable
+        serialized = json.dumps(inputs, sort_keys=True, default=repr)
+        return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+    def _preserve_file(self, path):
+        """
+        keep file produced by the build, it would be removed with build's tmpdir
+
+        :return: str, path to preserved file
+        """
+        if os.path.dirname(os.path.abspath(path)) == self.files_dir:
+            return path
+
+        _ensure_dir(self.files_dir)
+        preserved = os.path.join(self.files_dir, os.path.basename(path))
+        if os.path.exists(preserved):
+            os.remove(preserved)
+        try:
+            os.link(path, preserved)
+        except OSError:
+            # different filesystem
+            shutil.copy2(path, preserved)
+        return preserved
+
+    def _get_state(self, workflow):
+        state = dict((attr, getattr(workflow, attr)) for attr in WORKFLOW_ATTRIBUTES)
+
+        exported = []
+        for image in workflow.exported_image_sequence:
+            image = dict(image)
+            if image.get('path') and os.path.exists(image['path']):
+                image['path'] = self._preserve_file(image['path'])
+            exported.append(image)
+        state['exported_image_sequence'] = exported
+
+        builder = workflow.builder
+        state['builder'] = {
+            'image_id': builder.image_id,
+            'is_built': getattr(builder, 'is_built', False),
+            'base_image': builder.base_image,
+            'df_path': None,
+            'dockerfile': None,
+        }
+        try:
+            df_path = builder.df_path
+        except AttributeError:
+            # Dockerfile has not been generated yet
+            df_path = None
+        if df_path and os.path.isfile(df_path):
+            state['builder']['df_path'] = os.path.relpath(df_path, workflow.source.path)
+            with open(df_path, 'rb') as df:
+                state['builder']['dockerfile'] = df.read()
+        return state
+
+    def record(self, workflow, phase_name):
+        """
+        store state of workflow after the phase was completed
+
+        :param workflow: DockerBuildWorkflow instance
+        :param phase_name: str, name of completed phase
+        """
+        completed = [phase['name'] for phase in self.phases] + [phase_name]
+        expected = [name for name, _ in PHASES][:len(completed)]
+        if completed != expected:
+            # some previous phase wasn't stored, this one can't be restored
+            return
+
+        previous_digest = self.phases[-1]['digest'] if self.phases else None
+        digest = self.get_inputs_digest(workflow, phase_name, previous_digest)
+        try:
+            state = pickle.dumps(self._get_state(workflow), PICKLE_PROTOCOL)
+        except Exception as ex:
+            logger.warning("can't store state after %s phase, later builds will run it: %r",
+                           phase_name, ex)
+            return
+
+        self.phases.append({'name': phase_name, 'digest': digest, 'state': state})
+        try:
+            self._save()
+        except (IOError, OSError) as ex:
+            logger.warning("can't write checkpoint '%s': %r", self.path, ex)
+            self.phases.pop()
+            return
+        logger.info("stored checkpoint after %s phase", phase_name)
+
+    def _is_state_usable(self, workflow, phase_name, state):
+        for image in state['exported_image_sequence']:
+            if image.get('path') and not os.path.exists(image['path']):
+                logger.info("exported image '%s' is gone, running %s phase again",
+                            image['path'], phase_name)
+                return False
+
+        image_id = state['builder']['image_id']
+        if state['builder']['is_built'] and image_id:
+            if not workflow.builder.tasker.image_exists(image_id):
+                logger.info("built image %s is gone, running %s phase again",
+                            image_id, phase_name)
+                return False
+        return True
+
+    def restore(self, workflow):
+        """
+        restore state of workflow after the last phase which doesn't have to
+        run again
+
+        :param workflow: DockerBuildWorkflow instance with builder
+        :return: set of str, names of phases which don't have to run
+        """
+        skipped = set()
+        restored_state = None
+        previous_digest = None
+        for phase, (phase_name, _) in zip(self.phases, PHASES):
+            digest = self.get_inputs_digest(workflow, phase_name, previous_digest)
+            if phase['name'] != phase_name or phase['digest'] != digest:
+                logger.info("inputs of %s phase changed, running it again", phase_name)
+                break
+
+            state = pickle.loads(phase['state'])
+            if not self._is_state_usable(workflow, phase_name, state):
+                break
+
+            skipped.add(phase_name)
+            restored_state = state
+            previous_digest = digest
+
+        if skipped == set(['prebuild']):
+            # only the Dockerfile is stored, other files pre-build plugins
+            # left in build directory (repo files, artifacts, help page) are
+            # missing in the new clone, yet the build step needs them
+            logger.info("build-step phase runs again, running pre-build phase again too")
+            skipped = set()
+            restored_state = None
+
+        # stored phases which will run again are not valid anymore
+        del self.phases[len(skipped):]
+        if restored_state is None:
+            return skipped
+
+        builder_state = restored_state.pop('builder')
+        for attr, value in restored_state.items():
+            setattr(workflow, attr, value)
+
+        builder = workflow.builder
+        if builder_state['dockerfile'] is not None:
+            # Dockerfile as changed (or created) by pre-build plugins
+            df_path = os.path.join(workflow.source.path, builder_state['df_path'])
+            with open(df_path, 'wb') as df:
+                df.write(builder_state['dockerfile'])
+            builder.set_df_path(df_path)
+        builder.image_id = builder_state['image_id']
+        builder.is_built = builder_state['is_built']
+        builder.base_image = builder_state['base_image']
+
+        logger.info("restored state of build after phases: %s",
+                    ', '.join(name for name, _ in PHASES if name in skipped))
+        return skipped
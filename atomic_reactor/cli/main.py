@@ -11,26 +11,28 @@ import argparse
 import logging
 import os
 import sys
-import pkg_resources
 import locale
 
 from atomic_reactor import set_logging
-from atomic_reactor.api import (build_image_here, build_image_in_privileged_container,
-                                build_image_using_hosts_docker)
 from atomic_reactor.constants import CONTAINER_BUILD_JSON_PATH, DESCRIPTION, PROG
-from atomic_reactor.buildimage import BuildImageBuilder
-from atomic_reactor.inner import build_inside, BuildResults
-from atomic_reactor.util import process_substitutions
+from atomic_reactor.version import __version__
+
+# modules implementing commands import docker, requests, jsonschema and all
+# plugins with their dependencies; they are imported only when their command
+# is run, so e.g. --version or --help stay fast
 
 
 logger = logging.getLogger('atomic_reactor')
 
 
 def cli_create_build_image(args):
+    from atomic_reactor.buildimage import BuildImageBuilder
+
     b = BuildImageBuilder(reactor_tarball_path=args.reactor_tarball_path,
                           reactor_local_path=args.reactor_local_path,
                           reactor_remote_path=args.reactor_remote_git,
-                          use_official_reactor_git=args.reactor_latest)
+                          use_official_reactor_git=args.reactor_latest,
+                          git_cache_dir=args.git_cache_dir)
     try:
         b.create_image(args.dockerfile_dir_path, args.image, use_cache=args.use_cache)
     except RuntimeError:
@@ -40,6 +42,11 @@ def cli_create_build_image(args):
 
 
 def cli_build_image(args):
+    from atomic_reactor.api import (build_image_here, build_image_in_privileged_container,
+                                    build_image_using_hosts_docker)
+    from atomic_reactor.inner import BuildResults
+    from atomic_reactor.util import process_substitutions
+
     if args.plugin_files:
         args.plugin_files = [os.path.abspath(f) for f in args.plugin_files]
     if args.source__provider == 'json':
@@ -91,8 +98,36 @@ def construct_kwargs(**kwargs):
 
 
 def cli_inside_build(args):
+    from atomic_reactor.inner import build_inside
+
+    profile_plugins = args.profile_plugins
+    if profile_plugins is not None and not profile_plugins:
+        # no plugin specified, profile all of them
+        profile_plugins = ['*']
     build_inside(input_method=args.input, input_args=args.input_arg,
-                 substitutions=args.substitute)
+                 substitutions=args.substitute, profile_plugins=profile_plugins)
+
+
+def cli_daemon(args):
+    from atomic_reactor.daemon import ReactorDaemon
+
+    daemon = ReactorDaemon(args.socket, max_builds=args.max_builds,
+                           plugin_files=[os.path.abspath(f) for f in args.plugin_files or []])
+    daemon.serve_forever()
+
+
+def cli_submit_build(args):
+    from atomic_reactor.daemon import submit_build
+    from atomic_reactor.util import process_substitutions
+
+    with open(args.json_path) as json_fp:
+        build_json = json.load(json_fp)
+    if args.substitute:
+        process_substitutions(build_json, args.substitute)
+    result = submit_build(args.socket, build_json)
+    if not result.get('success'):
+        logger.error("build failed: %s", result)
+        sys.exit(1)
 
 
 class CLI(object):
@@ -105,19 +140,16 @@ class CLI(object):
         self.build_parser = None
         self.bi_parser = None
         self.ib_parser = None
+        self.daemon_parser = None
+        self.submit_parser = None
 
         locale.setlocale(locale.LC_ALL, '')
 
     def set_arguments(self):
-        try:
-            version = pkg_resources.get_distribution("atomic_reactor").version
-        except pkg_resources.DistributionNotFound:
-            version = "GIT"
-
         exclusive_group = self.parser.add_mutually_exclusive_group()
         exclusive_group.add_argument("-q", "--quiet", action="store_true")
         exclusive_group.add_argument("-v", "--verbose", action="store_true")
-        exclusive_group.add_argument("-V", "--version", action="version", version=version)
+        exclusive_group.add_argument("-V", "--version", action="version", version=__version__)
 
         subparsers = self.parser.add_subparsers(help='commands')
 
@@ -163,6 +195,9 @@ class CLI(object):
                                     "setup.py)")
         reactor_source.add_argument("--reactor-tarball-path", action='store',
                                     help="path to distribution tarball with Atomic Reactor")
+        self.bi_parser.add_argument("--git-cache-dir", action='store',
+                                    help="directory with mirrors of git repos, Atomic Reactor "
+                                    "git repo is cloned using mirror kept there")
         self.bi_parser.add_argument("dockerfile_dir_path", action="store",
                                     metavar="DOCKERFILE_DIR_PATH",
                                     help="path to directory with Dockerfile")
@@ -193,8 +228,40 @@ class CLI(object):
         self.ib_parser.add_argument("--substitute", action='append',
                                     help="substitute values in build json (key=value, or "
                                          "plugin_type.plugin_name.key=value)")
+        self.ib_parser.add_argument("--profile-plugins", action='store', nargs='*',
+                                    metavar="PLUGIN",
+                                    help="run these plugins (all if none given) under "
+                                    "cProfile and tracemalloc")
         self.ib_parser.set_defaults(func=cli_inside_build)
 
+        # DAEMON
+
+        self.daemon_parser = subparsers.add_parser(
+            'daemon',
+            usage="%s [OPTIONS] daemon" % PROG,
+            description="Load all plugins and schemas once and run builds submitted "
+                        "over Unix socket, each of them in separate worker process.")
+        self.daemon_parser.add_argument("--socket", action='store', required=True,
+                                        help="path to Unix socket to listen on")
+        self.daemon_parser.add_argument("--max-builds", action='store', type=int, default=1,
+                                        help="number of builds which may run at the same time")
+        self.daemon_parser.add_argument("--plugin-files", action='store', nargs="+",
+                                        help="list of files where plugins live")
+        self.daemon_parser.set_defaults(func=cli_daemon)
+
+        self.submit_parser = subparsers.add_parser(
+            'submit-build',
+            usage="%s [OPTIONS] submit-build" % PROG,
+            description="Run build on running daemon and wait until it finishes.")
+        self.submit_parser.add_argument("--socket", action='store', required=True,
+                                        help="path to Unix socket daemon listens on")
+        self.submit_parser.add_argument("json_path", action='store', metavar="PATH",
+                                        help="path to the build json")
+        self.submit_parser.add_argument("--substitute", action='append',
+                                        help="substitute values in build json (key=value, or "
+                                             "plugin_type.plugin_name.key=value)")
+        self.submit_parser.set_defaults(func=cli_submit_build)
+
     def generate_source_types_subparsers(self):
         build_subparsers = self.build_parser.add_subparsers(help='select source provider to use',
                                                             dest='source__provider')
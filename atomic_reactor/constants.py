@@ -14,6 +14,7 @@ FLATPAK_FILENAME = 'flatpak.json'
 BUILD_JSON = 'build.json'
 BUILD_JSON_ENV = 'BUILD_JSON'
 RESULTS_JSON = 'results.json'
+TRACE_JSON = 'trace.json'
 
 CONTAINER_SHARE_PATH = '/run/share/'
 CONTAINER_SHARE_SOURCE_SUBDIR = 'source'
@@ -64,6 +65,11 @@ TOOLS_USED = (
 
 DEFAULT_DOWNLOAD_BLOCK_SIZE = 10 * 1024 * 1024  # 10Mb
 
+# files are checksummed in blocks of this size
+CHECKSUM_BLOCK_SIZE = 1024 * 1024  # 1Mb
+# number of blocks read ahead for every checksum computed in a thread
+CHECKSUM_QUEUED_BLOCKS = 8
+
 TAG_NAME_REGEX = r'^[\w][\w.-]{0,127}$'
 
 IMAGE_TYPE_DOCKER_ARCHIVE = 'docker-archive'
@@ -102,11 +108,45 @@ HTTP_BACKOFF_FACTOR = 5
 HTTP_CLIENT_STATUS_RETRY = (408, 500, 502, 503, 504)
 # requests timeout in seconds
 HTTP_REQUEST_TIMEOUT = 600
+# lifetime in seconds of registry bearer token which doesn't specify it
+REGISTRY_TOKEN_DEFAULT_EXPIRATION = 60
+# how many seconds before its expiration registry bearer token is refreshed
+REGISTRY_TOKEN_EXPIRATION_MARGIN = 10
+# max bytes of manifests and blobs kept in memory by manifest cache
+MANIFEST_CACHE_MEMORY_SIZE = 32 * 1024 * 1024  # 32Mb
+# max bytes of manifests and blobs kept on disk by manifest cache
+MANIFEST_CACHE_DISK_SIZE = 256 * 1024 * 1024  # 256Mb
 # max retries for git clone
 GIT_MAX_RETRIES = 3
 # how many seconds should wait before another try of git clone
 GIT_BACKOFF_FACTOR = 5
 
+# log lines kept in memory, when there are more, all are stored compressed in a file
+LOG_MEMORY_LINES = 10000
+# number of last log lines (and decoded log items) always kept in memory
+LOG_TAIL_LINES = 1000
+
+# number of threads compressing exported image
+COMPRESS_THREADS = 1
+
+# how to get files of path source into build directory
+COPY_METHOD_COPY = 'copy'
+COPY_METHOD_HARDLINK = 'hardlink'
+COPY_METHOD_REFLINK = 'reflink'
+COPY_METHODS = (COPY_METHOD_COPY, COPY_METHOD_HARDLINK, COPY_METHOD_REFLINK)
+# files modified in place by many plugins, these are never hardlinked; plugins
+# writing other files in build directory call util.break_hardlink() first
+COPY_NO_HARDLINK_FILES = (DOCKERFILE_FILENAME, FLATPAK_FILENAME)
+# number of threads copying files
+COPY_TREE_WORKERS = 8
+
+# number of registries talked to concurrently
+REGISTRY_WORKERS = 4
+# number of blobs mounted between repositories of registry concurrently
+BLOB_MOUNT_WORKERS = 8
+# number of manifests deleted from registry concurrently
+MANIFEST_DELETE_WORKERS = 8
+
 
 # Media types
 MEDIA_TYPE_DOCKER_V1 = "application/json"
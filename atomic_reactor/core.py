@@ -31,6 +31,7 @@ import requests
 import time
 import docker
 import atomic_reactor.util
+from atomic_reactor import trace
 from docker.errors import APIError
 from functools import wraps
 
@@ -39,7 +40,7 @@ from atomic_reactor.constants import CONTAINER_SHARE_PATH, CONTAINER_SHARE_SOURC
         DOCKER_CLIENT_STATUS_RETRY
 from atomic_reactor.source import get_source_instance_for
 from atomic_reactor.util import (
-    ImageName, clone_git_repo, figure_out_build_file, Dockercfg)
+    ImageName, clone_git_repo, figure_out_build_file, Dockercfg, BuildContextStream)
 
 from requests.packages.urllib3.exceptions import InsecureRequestWarning, ProtocolError
 
@@ -257,7 +258,16 @@ class WrappedDocker(object):
         if callable(orig_attr):
             @wraps(orig_attr)
             def hooked(*args, **kwargs):
-                return retry(orig_attr, *args, retry=self.retry_times, **kwargs)
+                docker_span = trace.start_span(attr, 'docker')
+                try:
+                    result = retry(orig_attr, *args, retry=self.retry_times, **kwargs)
+                except Exception as ex:
+                    docker_span.finish(ex)
+                    raise
+                if isinstance(result, bytes):
+                    docker_span.args['bytes_received'] = len(result)
+                # span of streaming call ends once the stream is consumed
+                return trace.trace_stream(result, docker_span)
             return hooked
         else:
             return orig_attr
@@ -323,28 +333,36 @@ class DockerTasker(LastLogger):
 
             return cmd_result
 
-    def build_image_from_path(self, path, image, stream=False, use_cache=False, remove_im=True):
+    def build_image_from_path(self, path, image, stream=False, use_cache=False, remove_im=True,
+                              gzip=False):
         """
         build image from provided path and tag it
 
         this operation is asynchronous and you should consume returned generator in order to wait
         for build to finish
 
+        build context is streamed to docker daemon while it's being archived
+
         :param path: str
         :param image: ImageName, name of the resulting image
         :param stream: bool, True returns generator, False returns str
         :param use_cache: bool, True if you want to use cache
         :param remove_im: bool, remove intermediate containers produced during docker build
+        :param gzip: bool, compress build context
         :return: generator
         """
         logger.info("building image '%s' from path '%s'", image, path)
+        context = BuildContextStream(path, gzip=gzip)
+        encoding = 'gzip' if gzip else None
         try:
-            response = self.d.build(path=path, tag=image.to_str(), stream=stream,
+            response = self.d.build(fileobj=context, custom_context=True, encoding=encoding,
+                                    tag=image.to_str(), stream=stream,
                                     nocache=not use_cache, decode=True,
                                     rm=remove_im, forcerm=True, pull=False)  # returns generator
         except TypeError:
             # because changing api is fun
-            response = self.d.build(path=path, tag=image.to_str(), stream=stream,
+            response = self.d.build(fileobj=context, custom_context=True, encoding=encoding,
+                                    tag=image.to_str(), stream=stream,
                                     nocache=not use_cache, decode=True,
                                     rm=remove_im, forcerm=True,)  # returns generator
         return response
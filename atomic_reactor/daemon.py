@@ -0,0 +1,308 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Warm build daemon
+
+Daemon imports all plugins and compiles JSON schemas once and then accepts
+build JSONs over a Unix socket. Every build runs in its own forked worker:
+it starts with everything the daemon has already loaded, yet it can't
+influence the daemon or other builds.
+
+Client sends one build JSON per connection, terminated by newline. Daemon
+replies, once the build is finished, with JSON object terminated by newline:
+
+    {"pid": 1234, "exit_code": 0, "success": true}
+"""
+
+from __future__ import unicode_literals
+
+import errno
+import fcntl
+import json
+import logging
+import os
+import select
+import socket
+import threading
+from collections import deque
+
+from atomic_reactor.inner import DockerBuildWorkflow
+from atomic_reactor.plugin import PluginsRunner
+from atomic_reactor.util import get_schema_validator
+
+
+logger = logging.getLogger(__name__)
+
+# plugins of these types are loaded when daemon starts
+WARM_PLUGIN_CLASSES = ('InputPlugin', 'PreBuildPlugin', 'BuildStepPlugin',
+                       'PrePublishPlugin', 'PostBuildPlugin', 'ExitPlugin')
+# schemas validated by plugins, compiled when daemon starts
+WARM_SCHEMAS = ('schemas/config.json', 'schemas/fetch-artifacts-nvr.json',
+                'schemas/fetch-artifacts-url.json')
+# how often (in seconds) daemon checks whether it should stop
+ACCEPT_TIMEOUT = 1
+# how long (in seconds) daemon waits for client to send build JSON
+REQUEST_TIMEOUT = 10
+LISTEN_BACKLOG = 16
+
+
+def warm_up(plugin_files=None):
+    """
+    load plugins and schemas, so builds don't have to
+
+    :param plugin_files: list of str, load plugins also from these files
+    """
+    for class_name in WARM_PLUGIN_CLASSES:
+        runner = PluginsRunner(class_name, [], plugin_files=plugin_files or [])
+        logger.debug("loaded %d plugins of type %s", len(runner.plugin_classes), class_name)
+
+    for schema in WARM_SCHEMAS:
+        get_schema_validator(schema)
+
+
+def _read_message(sock):
+    stream = sock.makefile('rb')
+    try:
+        line = stream.readline()
+    finally:
+        stream.close()
+    return json.loads(line.decode('utf-8'))
+
+
+def _send_message(sock, message):
+    sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+
+def _build_in_worker(build_json):
+    """
+    run build in forked worker
+
+    :param build_json: dict, arguments for DockerBuildWorkflow
+    :return: int, exit code of the worker
+    """
+    try:
+        workflow = DockerBuildWorkflow(**build_json)
+        build_result = workflow.build_docker_image()
+    except Exception:
+        logger.exception("build failed")
+        return 1
+
+    if not build_result or build_result.is_failed():
+        logger.error("no image built")
+        return 1
+
+    logger.info("build has finished successfully")
+    return 0
+
+
+class ReactorDaemon(object):
+    """
+    accepts builds over Unix socket and runs each of them in forked worker
+
+    Daemon is single threaded: the loop in serve_forever() accepts builds,
+    forks workers and collects their exit codes, so no other thread can hold
+    a lock at the moment a worker is forked.
+    """
+
+    def __init__(self, socket_path, max_builds=1, plugin_files=None):
+        """
+        :param socket_path: str, path to Unix socket to listen on
+        :param max_builds: int, number of builds which may run at the same time;
+            other requests wait for a free slot
+        :param plugin_files: list of str, load plugins also from these files
+        """
+        self.socket_path = socket_path
+        self.max_builds = max_builds
+        self.plugin_files = plugin_files or []
+        self._stopped = threading.Event()
+        self._socket = None
+        # builds waiting for a free slot: (connection, build json)
+        self._pending = deque()
+        # running builds: read end of worker's pipe -> (pid, connection)
+        self._workers = {}
+
+    def bind(self):
+        try:
+            # stale socket of previous daemon
+            os.unlink(self.socket_path)
+        except OSError as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.socket_path)
+        self._socket.listen(LISTEN_BACKLOG)
+        logger.info("listening on '%s', running at most %d builds at once",
+                    self.socket_path, self.max_builds)
+
+    def serve_forever(self):
+        warm_up(self.plugin_files)
+        if self._socket is None:
+            self.bind()
+
+        try:
+            while not self._stopped.is_set():
+                self._start_builds()
+                readable = self._wait(self._socket)
+                if self._socket in readable:
+                    self._accept()
+                self._reap_workers(readable)
+        finally:
+            self._socket.close()
+            self._socket = None
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+        # builds which were already accepted are finished
+        while self._pending or self._workers:
+            self._start_builds()
+            self._reap_workers(self._wait())
+
+    def shutdown(self):
+        """
+        stop accepting builds; serve_forever() returns within ACCEPT_TIMEOUT
+        once accepted builds are finished
+        """
+        self._stopped.set()
+
+    def _wait(self, *sockets):
+        """
+        wait until a connection arrives or a worker exits
+
+        :return: list, readable sockets and pipes of workers
+        """
+        try:
+            readable, _, _ = select.select(list(sockets) + list(self._workers), [], [],
+                                           ACCEPT_TIMEOUT)
+        except (OSError, select.error) as ex:
+            if ex.args[0] != errno.EINTR:
+                raise
+            return []
+        return readable
+
+    def _accept(self):
+        conn, _ = self._socket.accept()
+        # slow client must not block the daemon for long
+        conn.settimeout(REQUEST_TIMEOUT)
+        try:
+            build_json = _read_message(conn)
+        except ValueError as ex:
+            logger.error("invalid build json: %s", ex)
+            self._reply(conn, {'error': 'invalid build json: %s' % ex, 'success': False})
+            return
+        except (IOError, OSError, socket.error) as ex:
+            logger.warning("connection to client failed: %r", ex)
+            conn.close()
+            return
+
+        self._pending.append((conn, build_json))
+
+    def _reply(self, conn, message):
+        try:
+            _send_message(conn, message)
+        except (IOError, OSError, socket.error) as ex:
+            logger.warning("connection to client failed: %r", ex)
+        finally:
+            conn.close()
+
+    def _start_builds(self):
+        while self._pending and len(self._workers) < self.max_builds:
+            conn, build_json = self._pending.popleft()
+            try:
+                pid, pipe = self.start_build(build_json)
+            except OSError as ex:
+                logger.error("failed to start worker: %r", ex)
+                self._reply(conn, {'error': 'failed to start worker: %s' % ex,
+                                   'success': False})
+                continue
+            self._workers[pipe] = (pid, conn)
+
+    def _reap_workers(self, readable):
+        for pipe in [fd for fd in readable if fd in self._workers]:
+            pid, conn = self._workers.pop(pipe)
+            os.close(pipe)
+            exit_code = self.wait_build(pid)
+            self._reply(conn, {'pid': pid, 'exit_code': exit_code,
+                               'success': exit_code == 0})
+
+    def _close_in_worker(self):
+        if self._socket is not None:
+            self._socket.close()
+        for conn, _ in self._pending:
+            conn.close()
+        for pipe, (_, conn) in self._workers.items():
+            os.close(pipe)
+            conn.close()
+
+    def start_build(self, build_json):
+        """
+        run build in forked worker
+
+        Worker keeps the write end of a pipe open until it exits, so the
+        daemon can wait for it along with new connections.
+
+        :param build_json: dict, arguments for DockerBuildWorkflow
+        :return: tuple, pid of the worker and read end of its pipe
+        """
+        build_json.setdefault('plugin_files', self.plugin_files)
+        pipe, worker_pipe = os.pipe()
+        # processes started by the build must not keep the pipe open
+        fcntl.fcntl(worker_pipe, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        try:
+            pid = os.fork()
+        except OSError:
+            os.close(pipe)
+            os.close(worker_pipe)
+            raise
+
+        if pid == 0:
+            exit_code = 1
+            try:
+                os.close(pipe)
+                self._close_in_worker()
+                exit_code = _build_in_worker(build_json)
+            finally:
+                os._exit(exit_code)
+
+        os.close(worker_pipe)
+        logger.info("build running in worker %d", pid)
+        return pid, pipe
+
+    def wait_build(self, pid):
+        """
+        wait for worker to exit
+
+        :param pid: int, pid of the worker
+        :return: int, exit code of the worker, negative signal number if killed
+        """
+        _, status = os.waitpid(pid, 0)
+        if os.WIFEXITED(status):
+            exit_code = os.WEXITSTATUS(status)
+        else:
+            exit_code = -os.WTERMSIG(status)
+        logger.info("worker %d finished with exit code %d", pid, exit_code)
+        return exit_code
+
+
+def submit_build(socket_path, build_json):
+    """
+    send build to daemon and wait until it is finished
+
+    :param socket_path: str, path to Unix socket daemon listens on
+    :param build_json: dict, arguments for DockerBuildWorkflow
+    :return: dict, reply of daemon
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        _send_message(sock, build_json)
+        return _read_message(sock)
+    finally:
+        sock.close()
@@ -15,7 +15,9 @@ import tempfile
 import signal
 import docker
 
+from atomic_reactor import trace
 from atomic_reactor.build import InsideBuilder
+from atomic_reactor.checkpoint import Checkpoint
 from atomic_reactor.plugin import (
     AutoRebuildCanceledException,
     BuildCanceledException,
@@ -29,7 +31,7 @@ from atomic_reactor.plugin import (
 )
 from atomic_reactor.source import get_source_instance_for
 from atomic_reactor.constants import INSPECT_ROOTFS, INSPECT_ROOTFS_LAYERS
-from atomic_reactor.util import ImageName
+from atomic_reactor.util import ImageName, DockerfileParserCache, manifest_cache
 from atomic_reactor.build import BuildResult
 from atomic_reactor import get_logging_encoding
 
@@ -271,7 +273,9 @@ class DockerBuildWorkflow(object):
     def __init__(self, source, image, prebuild_plugins=None, prepublish_plugins=None,
                  postbuild_plugins=None, exit_plugins=None, plugin_files=None,
                  openshift_build_selflink=None, client_version=None,
-                 buildstep_plugins=None, **kwargs):
+                 buildstep_plugins=None, plugin_workers=None, trace_path=None,
+                 profile_plugins=None, profile_dir=None, checkpoint_dir=None,
+                 manifest_cache_dir=None, **kwargs):
         """
         :param source: dict, where/how to get source code to put in image
         :param image: str, tag for built image ([registry/]image_name[:tag])
@@ -283,6 +287,18 @@ class DockerBuildWorkflow(object):
             on openshift) without the actual hostname/IP address
         :param client_version: str, osbs-client version used to render build json
         :param buildstep_plugins: dict, arguments for build-step plugins
+        :param plugin_workers: int, number of pre-build and exit plugins which
+            may run at the same time (plugins run one by one by default)
+        :param trace_path: str, write trace of the build into this file
+        :param profile_plugins: list of str, keys of plugins to run under profiler,
+            '*' profiles all plugins
+        :param profile_dir: str, directory for profiler output (temporary
+            directory is created when needed if not set)
+        :param checkpoint_dir: str, store state of the build after every phase
+            here; when the build runs again with the same checkpoint_dir,
+            phases already completed with the same inputs are skipped
+        :param manifest_cache_dir: str, keep manifests and blobs downloaded
+            from registries by digest also in this directory
         """
         self.source = get_source_instance_for(source, tmpdir=tempfile.mkdtemp())
         self.image = image
@@ -306,6 +322,21 @@ class DockerBuildWorkflow(object):
         self.build_canceled = False
         self.plugin_failed = False
         self.plugin_files = plugin_files
+        self.plugin_workers = plugin_workers
+
+        # spans of plugins, docker API calls and HTTP requests made during build
+        self.tracer = trace.TraceRecorder()
+        self.trace_path = trace_path
+
+        self.profile_plugins = profile_plugins
+        self.profile_dir = profile_dir
+        # paths to files created by profiler
+        self.profile_outputs = []
+
+        self.checkpoint = Checkpoint(checkpoint_dir) if checkpoint_dir else None
+
+        if manifest_cache_dir:
+            manifest_cache.directory = manifest_cache_dir
 
         self.kwargs = kwargs
 
@@ -316,6 +347,9 @@ class DockerBuildWorkflow(object):
 
         self.pulled_base_images = set()
 
+        # Dockerfiles parsed by util.df_parser, shared by all plugins
+        self.df_parser_cache = DockerfileParserCache()
+
         # When an image is exported into tarball, it can then be processed by various plugins.
         #  Each plugin that transforms the image should save it as a new file and append it to
         #  the end of exported_image_sequence. Other plugins should then operate with last
@@ -362,6 +396,30 @@ class DockerBuildWorkflow(object):
                 raise KeyError("Unprocessed base image Dockerfile cannot be inspected")
         return self._base_image_inspect
 
+    def save_trace(self):
+        """
+        stop recording spans and write them into trace_path, if requested
+        """
+        if trace.get_recorder() is self.tracer:
+            trace.set_recorder(None)
+
+        if not self.trace_path:
+            return
+
+        try:
+            self.tracer.save(self.trace_path)
+        except (IOError, OSError) as ex:
+            logger.warning("failed to write trace into '%s': %r", self.trace_path, ex)
+
+    def save_checkpoint(self, phase):
+        """
+        store state after completed phase, if checkpoints are requested
+
+        :param phase: str, name of the phase, see checkpoint.PHASES
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.record(self, phase)
+
     def throw_canceled_build_exception(self, *args, **kwargs):
         self.build_canceled = True
         raise BuildCanceledException("Build was canceled")
@@ -372,71 +430,94 @@ class DockerBuildWorkflow(object):
 
         :return: BuildResult
         """
+        trace.set_recorder(self.tracer)
         self.builder = InsideBuilder(self.source, self.image)
         try:
             signal.signal(signal.SIGTERM, self.throw_canceled_build_exception)
-            # time to run pre-build plugins, so they can access cloned repo
-            logger.info("running pre-build plugins")
-            prebuild_runner = PreBuildPluginsRunner(self.builder.tasker, self,
-                                                    self.prebuild_plugins_conf,
-                                                    plugin_files=self.plugin_files)
-            try:
-                prebuild_runner.run()
-            except PluginFailedException as ex:
-                logger.error("one or more prebuild plugins failed: %s", ex)
-                raise
-            except AutoRebuildCanceledException as ex:
-                logger.info(str(ex))
-                self.autorebuild_canceled = True
-                raise
-
-            logger.info("running buildstep plugins")
-            buildstep_runner = BuildStepPluginsRunner(self.builder.tasker, self,
-                                                      self.buildstep_plugins_conf,
-                                                      plugin_files=self.plugin_files)
-            try:
-                self.build_result = buildstep_runner.run()
-
-                if self.build_result.is_failed():
-                    raise PluginFailedException(self.build_result.fail_reason)
-            except PluginFailedException as ex:
-                self.builder.is_built = False
-                logger.error('buildstep plugin failed: %s', ex)
-                raise
-
-            self.builder.is_built = True
-            if self.build_result.is_image_available():
-                self.builder.image_id = self.build_result.image_id
-
-            # run prepublish plugins
-            prepublish_runner = PrePublishPluginsRunner(self.builder.tasker, self,
-                                                        self.prepublish_plugins_conf,
-                                                        plugin_files=self.plugin_files)
-            try:
-                prepublish_runner.run()
-            except PluginFailedException as ex:
-                logger.error("one or more prepublish plugins failed: %s", ex)
-                raise
-
-            if self.build_result.is_image_available():
-                self.built_image_inspect = self.builder.inspect_built_image()
-                history = self.builder.tasker.d.history(self.builder.image_id)
-                diff_ids = self.built_image_inspect[INSPECT_ROOTFS][INSPECT_ROOTFS_LAYERS]
-
-                # diff_ids is ordered oldest first
-                # history is ordered newest first
-                # We want layer_sizes to be ordered oldest first
-                self.layer_sizes = [{"diff_id": diff_id, "size": layer['Size']}
-                                    for (diff_id, layer) in zip(diff_ids, reversed(history))]
-
-            postbuild_runner = PostBuildPluginsRunner(self.builder.tasker, self,
-                                                      self.postbuild_plugins_conf,
-                                                      plugin_files=self.plugin_files)
-            try:
-                postbuild_runner.run()
-            except PluginFailedException as ex:
-                logger.error("one or more postbuild plugins failed: %s", ex)
-                raise
+            completed_phases = set()
+            if self.checkpoint is not None:
+                self.checkpoint.load()
+                completed_phases = self.checkpoint.restore(self)
+
+            if 'prebuild' in completed_phases:
+                logger.info("pre-build plugins already finished, skipping them")
+            else:
+                # time to run pre-build plugins, so they can access cloned repo
+                logger.info("running pre-build plugins")
+                prebuild_runner = PreBuildPluginsRunner(self.builder.tasker, self,
+                                                        self.prebuild_plugins_conf,
+                                                        plugin_files=self.plugin_files,
+                                                        max_workers=self.plugin_workers)
+                try:
+                    prebuild_runner.run()
+                except PluginFailedException as ex:
+                    logger.error("one or more prebuild plugins failed: %s", ex)
+                    raise
+                except AutoRebuildCanceledException as ex:
+                    logger.info(str(ex))
+                    self.autorebuild_canceled = True
+                    raise
+                self.save_checkpoint('prebuild')
+
+            if 'buildstep' in completed_phases:
+                logger.info("image already built, skipping buildstep plugins")
+            else:
+                logger.info("running buildstep plugins")
+                buildstep_runner = BuildStepPluginsRunner(self.builder.tasker, self,
+                                                          self.buildstep_plugins_conf,
+                                                          plugin_files=self.plugin_files)
+                try:
+                    self.build_result = buildstep_runner.run()
+
+                    if self.build_result.is_failed():
+                        raise PluginFailedException(self.build_result.fail_reason)
+                except PluginFailedException as ex:
+                    self.builder.is_built = False
+                    logger.error('buildstep plugin failed: %s', ex)
+                    raise
+
+                self.builder.is_built = True
+                if self.build_result.is_image_available():
+                    self.builder.image_id = self.build_result.image_id
+                self.save_checkpoint('buildstep')
+
+            if 'prepublish' in completed_phases:
+                logger.info("prepublish plugins already finished, skipping them")
+            else:
+                # run prepublish plugins
+                prepublish_runner = PrePublishPluginsRunner(self.builder.tasker, self,
+                                                            self.prepublish_plugins_conf,
+                                                            plugin_files=self.plugin_files)
+                try:
+                    prepublish_runner.run()
+                except PluginFailedException as ex:
+                    logger.error("one or more prepublish plugins failed: %s", ex)
+                    raise
+
+                if self.build_result.is_image_available():
+                    self.built_image_inspect = self.builder.inspect_built_image()
+                    history = self.builder.tasker.d.history(self.builder.image_id)
+                    diff_ids = self.built_image_inspect[INSPECT_ROOTFS][INSPECT_ROOTFS_LAYERS]
+
+                    # diff_ids is ordered oldest first
+                    # history is ordered newest first
+                    # We want layer_sizes to be ordered oldest first
+                    self.layer_sizes = [{"diff_id": diff_id, "size": layer['Size']}
+                                        for (diff_id, layer) in zip(diff_ids, reversed(history))]
+                self.save_checkpoint('prepublish')
+
+            if 'postbuild' in completed_phases:
+                logger.info("postbuild plugins already finished, skipping them")
+            else:
+                postbuild_runner = PostBuildPluginsRunner(self.builder.tasker, self,
+                                                          self.postbuild_plugins_conf,
+                                                          plugin_files=self.plugin_files)
+                try:
+                    postbuild_runner.run()
+                except PluginFailedException as ex:
+                    logger.error("one or more postbuild plugins failed: %s", ex)
+                    raise
+                self.save_checkpoint('postbuild')
 
             return self.build_result
         except Exception as ex:
@@ -447,7 +528,8 @@ class DockerBuildWorkflow(object):
             signal.signal(signal.SIGTERM, lambda *args: None)
             exit_runner = ExitPluginsRunner(self.builder.tasker, self,
                                             self.exit_plugins_conf,
-                                            plugin_files=self.plugin_files)
+                                            plugin_files=self.plugin_files,
+                                            max_workers=self.plugin_workers)
             try:
                 exit_runner.run(keep_going=True)
             except PluginFailedException as ex:
@@ -455,13 +537,21 @@ class DockerBuildWorkflow(object):
                 raise
             finally:
                 self.source.remove_tmpdir()
+                self.save_trace()
+
+            if self.checkpoint is not None and not self.build_process_failed:
+                # nothing to resume
+                self.checkpoint.clear()
 
             signal.signal(signal.SIGTERM, signal.SIG_DFL)
 
 
-def build_inside(input_method, input_args=None, substitutions=None):
+def build_inside(input_method, input_args=None, substitutions=None, profile_plugins=None):
     """
     use requested input plugin to load configuration and then initiate build
+
+    :param profile_plugins: list of str, keys of plugins to run under profiler,
+        '*' profiles all plugins
     """
     def process_keyvals(keyvals):
         """ ["key=val", "x=y"] -> {"key": "val", "x": "y"} """
@@ -493,6 +583,8 @@ def build_inside(input_method, input_args=None, substitutions=None):
     if not build_json:
         raise RuntimeError("No valid build json!")
     # TODO: validate json
+    if profile_plugins:
+        build_json['profile_plugins'] = profile_plugins
     dbw = DockerBuildWorkflow(**build_json)
     build_result = dbw.build_docker_image()
     if not build_result or build_result.is_failed():
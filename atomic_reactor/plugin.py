@@ -17,8 +17,13 @@ import traceback
 import imp
 import datetime
 import inspect
+import tempfile
 import time
+from multiprocessing.pool import ThreadPool
 
+from six.moves import queue
+
+from atomic_reactor import profiling, trace
 from atomic_reactor.build import BuildResult
 from atomic_reactor.util import process_substitutions
 from dockerfile_parse import DockerfileParser
@@ -58,6 +63,13 @@ class Plugin(object):
     key = None
     # by default, if plugin fails (raises exc), execution continues
     is_allowed_to_fail = True
+    # names of data the plugin reads and writes: workflow attributes
+    # (e.g. 'files', 'base_image'), 'df_dir' for files in build directory
+    # or keys of other plugins, meaning their results and workspace; plugins
+    # which declare these may be run concurrently with other plugins they
+    # don't conflict with
+    reads = None
+    writes = None
 
     def __init__(self, *args, **kwargs):
         """
@@ -106,6 +118,104 @@ class BuildPlugin(Plugin):
         super(BuildPlugin, self).__init__(*args, **kwargs)
 
 
+class PluginRegistry(object):
+    """
+    process-wide cache of plugin modules
+
+    Every plugin file is imported at most once per process, no matter how
+    many runners ask for it. A module is imported again only when the
+    modification time of its file changes.
+    """
+
+    def __init__(self):
+        # path -> (mtime, module or None if import failed)
+        self._modules = {}
+        # (path, mtime, plugin class) -> {key: plugin class}
+        self._classes = {}
+
+    def clear(self):
+        """
+        forget all cached modules; they will be imported again on next use
+        """
+        self._modules.clear()
+        self._classes.clear()
+
+    def load_module(self, path):
+        """
+        import plugin module from file, reusing the cached one when possible
+
+        :param path: str, path to python file
+        :return: module or None if it can't be imported
+        """
+        try:
+            mtime = os.path.getmtime(path)
+        except (IOError, OSError) as ex:
+            logger.warning("can't load module '%s': %r", path, ex)
+            return None
+
+        cached = self._modules.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        logger.debug("load file '%s'", path)
+        module_name = os.path.basename(path).rsplit('.', 1)[0]
+        try:
+            module = imp.load_source(module_name, path)
+        except (IOError, OSError, ImportError, SyntaxError) as ex:
+            logger.warning("can't load module '%s': %r", path, ex)
+            module = None
+
+        self._modules[path] = (mtime, module)
+        return module
+
+    def _find_plugin_classes(self, module, plugin_class):
+        plugin_classes = {}
+        for name in dir(module):
+            binding = getattr(module, name, None)
+            try:
+                # if you try to compare binding and PostBuildPlugin, python won't match them
+                # if you call this script directly b/c:
+                # ! <class 'plugins.plugin_rpmqa.PostBuildRPMqaPlugin'> <= <class
+                # '__main__.PostBuildPlugin'>
+                # but
+                # <class 'plugins.plugin_rpmqa.PostBuildRPMqaPlugin'> <= <class
+                # 'atomic_reactor.plugin.PostBuildPlugin'>
+                is_sub = issubclass(binding, plugin_class)
+            except TypeError:
+                is_sub = False
+            if binding and is_sub and plugin_class.__name__ != binding.__name__:
+                plugin_classes[binding.key] = binding
+        return plugin_classes
+
+    def get_plugin_classes(self, files, plugin_class):
+        """
+        get plugins of given type from the files
+
+        :param files: list of str, paths to python files with plugins
+        :param plugin_class: class, base class of requested plugins (e.g. PreBuildPlugin)
+        :return: dict, plugin key -> plugin class
+        """
+        plugin_classes = {}
+        for f in files:
+            module = self.load_module(f)
+            if module is None:
+                continue
+
+            mtime = self._modules[f][0]
+            cache_key = (f, mtime, plugin_class)
+            try:
+                found = self._classes[cache_key]
+            except KeyError:
+                found = self._find_plugin_classes(module, plugin_class)
+                self._classes[cache_key] = found
+
+            plugin_classes.update(found)
+        return plugin_classes
+
+
+plugin_registry = PluginRegistry()
+
+
 class PluginsRunner(object):
 
     def __init__(self, plugin_class_name, plugins_conf, *args, **kwargs):
@@ -114,10 +224,13 @@ class PluginsRunner(object):
 
         :param plugin_class_name: str, name of plugin class to filter (e.g. 'PreBuildPlugin')
         :param plugins_conf: dict, configuration for plugins
+        :param plugin_files: list of str, load plugins also from these files
+        :param max_workers: int, number of plugins which may run at the same time
         """
         self.plugins_results = getattr(self, "plugins_results", {})
         self.plugins_conf = plugins_conf or []
         self.plugin_files = kwargs.get("plugin_files", [])
+        self.max_workers = kwargs.get("max_workers") or 1
         self.plugin_classes = self.load_plugins(plugin_class_name)
 
     def load_plugins(self, plugin_class_name):
@@ -134,31 +247,7 @@ class PluginsRunner(object):
             logger.debug("loading additional plugins from files '%s'", self.plugin_files)
             files += self.plugin_files
         plugin_class = globals()[plugin_class_name]
-        plugin_classes = {}
-        for f in files:
-            logger.debug("load file '%s'", f)
-            module_name = os.path.basename(f).rsplit('.', 1)[0]
-            try:
-                f_module = imp.load_source(module_name, f)
-            except (IOError, OSError, ImportError, SyntaxError) as ex:
-                logger.warning("can't load module '%s': %r", f, ex)
-                continue
-            for name in dir(f_module):
-                binding = getattr(f_module, name, None)
-                try:
-                    # if you try to compare binding and PostBuildPlugin, python won't match them
-                    # if you call this script directly b/c:
-                    # ! <class 'plugins.plugin_rpmqa.PostBuildRPMqaPlugin'> <= <class
-                    # '__main__.PostBuildPlugin'>
-                    # but
-                    # <class 'plugins.plugin_rpmqa.PostBuildRPMqaPlugin'> <= <class
-                    # 'atomic_reactor.plugin.PostBuildPlugin'>
-                    is_sub = issubclass(binding, plugin_class)
-                except TypeError:
-                    is_sub = False
-                if binding and is_sub and plugin_class.__name__ != binding.__name__:
-                    plugin_classes[binding.key] = binding
-        return plugin_classes
+        return plugin_registry.get_plugin_classes(files, plugin_class)
 
     def create_instance_from_plugin(self, plugin_class, plugin_conf):
         """
@@ -180,6 +269,136 @@ class PluginsRunner(object):
     def save_plugin_duration(self, plugin, duration):
         pass
 
+    def _plugins_conflict(self, plugin_class, other_class):
+        """
+        check whether two plugins must not run at the same time
+
+        Plugins conflict unless both declare what they read and write and
+        neither of them reads or writes anything the other one writes. Result
+        of each plugin is treated as written under its key.
+        """
+        for cls in (plugin_class, other_class):
+            if cls.reads is None or cls.writes is None:
+                return True
+
+        reads = set(plugin_class.reads)
+        writes = set(plugin_class.writes) | set([plugin_class.key])
+        other_reads = set(other_class.reads)
+        other_writes = set(other_class.writes) | set([other_class.key])
+        return bool(writes & (other_reads | other_writes) or other_writes & reads)
+
+    def _resolve_plugin_request(self, plugin_request, keep_going):
+        """
+        find plugin class for plugin request
+
+        :param plugin_request: dict, item of plugins_conf
+        :param keep_going: bool, whether to keep going after unexpected failure
+        :return: tuple (plugin name, plugin class, plugin configuration,
+                 whether plugin is allowed to fail, whether plugin should be
+                 profiled) or None when plugin should be skipped
+        """
+        try:
+            plugin_name = plugin_request['name']
+        except (TypeError, KeyError):
+            msg = "invalid plugin request, no key 'name': %s" % plugin_request
+            exc = None if keep_going else PluginFailedException(msg)
+            self.on_plugin_failed('?', exc)
+            logger.error(msg)
+            if keep_going:
+                return None
+
+            raise exc
+
+        plugin_conf = plugin_request.get("args", {})
+        try:
+            plugin_class = self.plugin_classes[plugin_name]
+        except KeyError:
+            if plugin_request.get('required', True):
+                msg = ("no such plugin: '%s', did you set "
+                       "the correct plugin type?") % plugin_name
+                exc = None if keep_going else PluginFailedException(msg)
+                self.on_plugin_failed(plugin_name, exc)
+                logger.error(msg)
+                if keep_going:
+                    return None
+
+                raise exc
+            else:
+                # This plugin is marked as not being required
+                logger.warning("plugin '%s' requested but not available",
+                               plugin_name)
+                return None
+        try:
+            plugin_is_allowed_to_fail = plugin_request['is_allowed_to_fail']
+        except (TypeError, KeyError):
+            plugin_is_allowed_to_fail = getattr(plugin_class, "is_allowed_to_fail", True)
+
+        plugin_is_profiled = self.is_plugin_profiled(plugin_name, plugin_request)
+
+        return (plugin_name, plugin_class, plugin_conf, plugin_is_allowed_to_fail,
+                plugin_is_profiled)
+
+    def is_plugin_profiled(self, plugin_name, plugin_request):
+        """
+        should plugin be run under profiler?
+
+        :param plugin_name: str, plugin key
+        :param plugin_request: dict, item of plugins_conf
+        :return: bool
+        """
+        return False
+
+    def profile_plugin(self, plugin_name):
+        """
+        :param plugin_name: str, plugin key
+        :return: context manager profiling the plugin
+        """
+        raise NotImplementedError()
+
+    def _run_plugin_instance(self, plugin_name, plugin_instance, plugin_is_profiled,
+                             parent_span=None):
+        with trace.span(plugin_name, 'plugin', parent=parent_span):
+            if not plugin_is_profiled:
+                return plugin_instance.run()
+
+            with self.profile_plugin(plugin_name):
+                return plugin_instance.run()
+
+    def _handle_plugin_exception(self, plugin_class, ex, plugin_is_allowed_to_fail, keep_going,
+                                 failed_msgs):
+        """
+        log exception raised by plugin, raise PluginFailedException if it is fatal
+        """
+        msg = "plugin '%s' raised an exception: %r" % (plugin_class.key, ex)
+        if not plugin_is_allowed_to_fail:
+            self.on_plugin_failed(plugin_class.key, ex)
+
+        if plugin_is_allowed_to_fail or keep_going:
+            logger.warning(msg)
+            logger.info("error is not fatal, continuing...")
+            if not plugin_is_allowed_to_fail:
+                failed_msgs.append(msg)
+        else:
+            logger.error(msg)
+            raise PluginFailedException(msg)
+
+    def _record_plugin_duration(self, plugin_name, plugin_class, start_time, finish_time):
+        try:
+            if start_time:
+                duration = finish_time - start_time
+                seconds = duration.total_seconds()
+                logger.debug("plugin '%s' finished in %ds", plugin_name, seconds)
+                self.save_plugin_duration(plugin_class.key, seconds)
+        except Exception:
+            logger.exception("failed to save plugin duration")
+
+    def _raise_failed_msgs(self, failed_msgs):
+        if len(failed_msgs) == 1:
+            raise PluginFailedException(failed_msgs[0])
+        elif len(failed_msgs) > 1:
+            raise PluginFailedException("Multiple plugins raised an exception: " +
+                                        str(failed_msgs))
+
     def run(self, keep_going=False, buildstep_phase=False):
         """
         run all requested plugins
@@ -190,46 +409,24 @@ class PluginsRunner(object):
                                 not be executed after a plugin completes
                                 (only used for build-step plugins)
         """
+        with trace.span(self.__class__.__name__, 'phase') as phase_span:
+            if self.max_workers > 1 and not buildstep_phase:
+                return self._run_concurrently(keep_going, phase_span)
+
+            return self._run_sequentially(keep_going, buildstep_phase)
+
+    def _run_sequentially(self, keep_going, buildstep_phase):
         failed_msgs = []
         plugin_successful = False
         plugin_response = None
         for plugin_request in self.plugins_conf:
             plugin_successful = False
-            try:
-                plugin_name = plugin_request['name']
-            except (TypeError, KeyError):
-                msg = "invalid plugin request, no key 'name': %s" % plugin_request
-                exc = None if keep_going else PluginFailedException(msg)
-                self.on_plugin_failed('?', exc)
-                logger.error(msg)
-                if keep_going:
-                    continue
-
-                raise exc
+            resolved = self._resolve_plugin_request(plugin_request, keep_going)
+            if resolved is None:
+                continue
 
-            plugin_conf = plugin_request.get("args", {})
-            try:
-                plugin_class = self.plugin_classes[plugin_name]
-            except KeyError:
-                if plugin_request.get('required', True):
-                    msg = ("no such plugin: '%s', did you set "
-                           "the correct plugin type?") % plugin_name
-                    exc = None if keep_going else PluginFailedException(msg)
-                    self.on_plugin_failed(plugin_name, exc)
-                    logger.error(msg)
-                    if keep_going:
-                        continue
-
-                    raise exc
-                else:
-                    # This plugin is marked as not being required
-                    logger.warning("plugin '%s' requested but not available",
-                                   plugin_name)
-                    continue
-            try:
-                plugin_is_allowed_to_fail = plugin_request['is_allowed_to_fail']
-            except (TypeError, KeyError):
-                plugin_is_allowed_to_fail = getattr(plugin_class, "is_allowed_to_fail", True)
+            (plugin_name, plugin_class, plugin_conf, plugin_is_allowed_to_fail,
+             plugin_is_profiled) = resolved
 
             logger.debug("running plugin '%s'", plugin_name)
             start_time = datetime.datetime.now()
@@ -239,7 +436,8 @@ class PluginsRunner(object):
             try:
                 plugin_instance = self.create_instance_from_plugin(plugin_class, plugin_conf)
                 self.save_plugin_timestamp(plugin_class.key, start_time)
-                plugin_response = plugin_instance.run()
+                plugin_response = self._run_plugin_instance(plugin_name, plugin_instance,
+                                                            plugin_is_profiled)
                 plugin_successful = True
                 if buildstep_phase:
                     assert isinstance(plugin_response, BuildResult)
@@ -267,31 +465,13 @@ class PluginsRunner(object):
                 if not buildstep_phase:
                     raise
             except Exception as ex:
-                msg = "plugin '%s' raised an exception: %r" % (plugin_class.key, ex)
                 logger.debug(traceback.format_exc())
-                if not plugin_is_allowed_to_fail:
-                    self.on_plugin_failed(plugin_class.key, ex)
-
-                if plugin_is_allowed_to_fail or keep_going:
-                    logger.warning(msg)
-                    logger.info("error is not fatal, continuing...")
-                    if not plugin_is_allowed_to_fail:
-                        failed_msgs.append(msg)
-                else:
-                    logger.error(msg)
-                    raise PluginFailedException(msg)
-
+                self._handle_plugin_exception(plugin_class, ex, plugin_is_allowed_to_fail,
+                                              keep_going, failed_msgs)
                 plugin_response = ex
 
-            try:
-                if start_time:
-                    finish_time = datetime.datetime.now()
-                    duration = finish_time - start_time
-                    seconds = duration.total_seconds()
-                    logger.debug("plugin '%s' finished in %ds", plugin_name, seconds)
-                    self.save_plugin_duration(plugin_class.key, seconds)
-            except Exception:
-                logger.exception("failed to save plugin duration")
+            self._record_plugin_duration(plugin_name, plugin_class, start_time,
+                                         datetime.datetime.now())
 
             if not skip_response:
                 self.plugins_results[plugin_class.key] = plugin_response
@@ -301,11 +481,7 @@ class PluginsRunner(object):
                              'after first successful plugin')
                 break
 
-        if len(failed_msgs) == 1:
-            raise PluginFailedException(failed_msgs[0])
-        elif len(failed_msgs) > 1:
-            raise PluginFailedException("Multiple plugins raised an exception: " +
-                                        str(failed_msgs))
+        self._raise_failed_msgs(failed_msgs)
 
         if not plugin_successful and buildstep_phase and not plugin_response:
             self.on_plugin_failed("BuildStepPlugin", "No appropriate build step")
@@ -313,6 +489,110 @@ class PluginsRunner(object):
 
         return self.plugins_results
 
+    def _run_plugin_in_thread(self, index, request, outcomes, phase_span):
+        plugin_name, plugin_class, plugin_conf, _, plugin_is_profiled = request
+        start_time = datetime.datetime.now()
+        plugin_response = None
+        exc = None
+        exc_traceback = None
+        try:
+            plugin_instance = self.create_instance_from_plugin(plugin_class, plugin_conf)
+            self.save_plugin_timestamp(plugin_class.key, start_time)
+            # phase span was opened in the main thread
+            plugin_response = self._run_plugin_instance(plugin_name, plugin_instance,
+                                                        plugin_is_profiled,
+                                                        parent_span=phase_span)
+        except BaseException as ex:
+            # main thread waits for the outcome, it has to be posted whatever
+            # the plugin raised (SystemExit, KeyboardInterrupt, ...)
+            exc = ex
+            exc_traceback = traceback.format_exc()
+
+        outcomes.put((index, plugin_response, exc, exc_traceback,
+                      start_time, datetime.datetime.now()))
+
+    def _run_concurrently(self, keep_going, phase_span):
+        """
+        run requested plugins on a pool of max_workers threads
+
+        Plugin is started once all plugins requested before it, which it
+        conflicts with, are finished. Plugins which don't declare what they
+        read and write therefore run alone, in the requested order.
+        """
+        requests = []
+        for plugin_request in self.plugins_conf:
+            resolved = self._resolve_plugin_request(plugin_request, keep_going)
+            if resolved is not None:
+                requests.append(resolved)
+
+        dependencies = []
+        for index, (_, plugin_class, _, _, _) in enumerate(requests):
+            dependencies.append(set(
+                earlier for earlier in range(index)
+                if self._plugins_conflict(plugin_class, requests[earlier][1])
+            ))
+
+        failed_msgs = []
+        waiting = list(range(len(requests)))
+        finished = set()
+        running = 0
+        fatal_exc = None
+        outcomes = queue.Queue()
+        pool = ThreadPool(self.max_workers)
+        try:
+            while waiting or running:
+                if fatal_exc is None:
+                    for index in [i for i in waiting if dependencies[i] <= finished]:
+                        logger.debug("running plugin '%s'", requests[index][0])
+                        waiting.remove(index)
+                        running += 1
+                        pool.apply_async(trace.bind(self._run_plugin_in_thread),
+                                         (index, requests[index], outcomes, phase_span))
+
+                if not running:
+                    # fatal failure, don't start any other plugin
+                    break
+
+                (index, plugin_response, exc, exc_traceback,
+                 start_time, finish_time) = outcomes.get()
+                running -= 1
+                finished.add(index)
+
+                plugin_name, plugin_class, _, plugin_is_allowed_to_fail, _ = requests[index]
+                if exc is not None and not isinstance(exc, Exception):
+                    # not a plugin failure, propagate it as if plugin ran
+                    # in this thread
+                    logger.debug(exc_traceback)
+                    raise exc
+                if isinstance(exc, AutoRebuildCanceledException):
+                    fatal_exc = exc
+                    continue
+                elif isinstance(exc, InappropriateBuildStepError):
+                    logger.debug('Build step %s is not appropriate', plugin_class.key)
+                    fatal_exc = exc
+                    continue
+                elif exc is not None:
+                    logger.debug(exc_traceback)
+                    try:
+                        self._handle_plugin_exception(plugin_class, exc,
+                                                      plugin_is_allowed_to_fail,
+                                                      keep_going, failed_msgs)
+                    except PluginFailedException as ex:
+                        fatal_exc = ex
+                        continue
+                    plugin_response = exc
+
+                self._record_plugin_duration(plugin_name, plugin_class, start_time, finish_time)
+                self.plugins_results[plugin_class.key] = plugin_response
+        finally:
+            pool.close()
+
+        if fatal_exc is not None:
+            raise fatal_exc
+
+        self._raise_failed_msgs(failed_msgs)
+        return self.plugins_results
+
 
 class BuildPluginsRunner(PluginsRunner):
     def __init__(self, dt, workflow, plugin_class_name, plugins_conf, *args, **kwargs):
@@ -339,6 +619,19 @@ class BuildPluginsRunner(PluginsRunner):
     def save_plugin_duration(self, plugin, duration):
         self.workflow.plugins_durations[plugin] = duration
 
+    def is_plugin_profiled(self, plugin_name, plugin_request):
+        profile_plugins = self.workflow.profile_plugins or []
+        profiled = (plugin_request.get('profile', False) or
+                    plugin_name in profile_plugins or
+                    '*' in profile_plugins)
+        if profiled and self.workflow.profile_dir is None:
+            self.workflow.profile_dir = tempfile.mkdtemp(prefix='atomic-reactor-profile-')
+        return bool(profiled)
+
+    def profile_plugin(self, plugin_name):
+        return profiling.profile(plugin_name, self.workflow.profile_dir,
+                                 self.workflow.profile_outputs)
+
     def _translate_special_values(self, obj_to_translate):
         """
         you may want to write plugins for values which are not known before build:
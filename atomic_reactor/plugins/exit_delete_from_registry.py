@@ -12,8 +12,10 @@ from copy import deepcopy
 import requests
 
 from atomic_reactor.plugin import ExitPlugin, PluginFailedException
-from atomic_reactor.util import RegistrySession, registry_hostname
-from atomic_reactor.constants import PLUGIN_GROUP_MANIFESTS_KEY
+from atomic_reactor.util import (registry_session_pool, registry_hostname, map_in_threads,
+                                 map_registries)
+from atomic_reactor.constants import (PLUGIN_GROUP_MANIFESTS_KEY, REGISTRY_WORKERS,
+                                      MANIFEST_DELETE_WORKERS)
 from requests.exceptions import HTTPError, RetryError, Timeout
 
 
@@ -25,7 +27,8 @@ class DeleteFromRegistryPlugin(ExitPlugin):
     key = "delete_from_registry"
     is_allowed_to_fail = False
 
-    def __init__(self, tasker, workflow, registries):
+    def __init__(self, tasker, workflow, registries, registry_workers=REGISTRY_WORKERS,
+                 delete_workers=MANIFEST_DELETE_WORKERS):
         """
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
@@ -34,10 +37,15 @@ class DeleteFromRegistryPlugin(ExitPlugin):
                            Params:
                             * "secret" optional string - path to the secret, which stores
                               login and password for remote registry
+        :param registry_workers: int, max number of registries processed concurrently
+        :param delete_workers: int, max number of manifests deleted concurrently
+                               from one registry
         """
         super(DeleteFromRegistryPlugin, self).__init__(tasker, workflow)
 
         self.registries = deepcopy(registries)
+        self.registry_workers = registry_workers
+        self.delete_workers = delete_workers
 
     def request_delete(self, session, url, manifest):
         try:
@@ -60,6 +68,25 @@ class DeleteFromRegistryPlugin(ExitPlugin):
 
         return False
 
+    def request_deletes(self, session, deletes):
+        """
+        delete manifests concurrently
+
+        :param session: RegistrySession
+        :param deletes: list of (repo, digest) tuples
+        :return: set, digests which were deleted
+        """
+        registry_noschema = registry_hostname(session.registry)
+
+        def delete(repo_digest):
+            repo, digest = repo_digest
+            url = self.make_url(repo, digest)
+            manifest = self.make_manifest(registry_noschema, repo, digest)
+            return self.request_delete(session, url, manifest)
+
+        results = map_in_threads(delete, deletes, self.delete_workers)
+        return set(digest for (_, digest), deleted in zip(deletes, results) if deleted)
+
     def make_manifest(self, registry, repo, digest):
         return "{registry}/{repo}@{digest}".format(**vars())
 
@@ -74,9 +101,9 @@ class DeleteFromRegistryPlugin(ExitPlugin):
         return None
 
     def handle_registry(self, session, push_conf_registry, deleted_digests):
-        registry_noschema = registry_hostname(session.registry)
         deleted = False
 
+        deletes = []
         for tag, digests in push_conf_registry.digests.items():
             digest = digests.default
             if digest in deleted_digests:
@@ -86,26 +113,25 @@ class DeleteFromRegistryPlugin(ExitPlugin):
                 deleted = True
                 continue
 
+            if digest in set(d for _, d in deletes):
+                continue
+
             repo = tag.split(':')[0]
-            url = self.make_url(repo, digest)
-            manifest = self.make_manifest(registry_noschema, repo, digest)
+            deletes.append((repo, digest))
 
-            if self.request_delete(session, url, manifest):
-                deleted_digests.add(digest)
-                deleted = True
+        deleted_now = self.request_deletes(session, deletes)
+        deleted_digests.update(deleted_now)
 
-        return deleted
+        return deleted or bool(deleted_now)
 
     def delete_manifest_lists(self, session, registry_noschema, deleted_digests):
         manifest_list_digests = self.workflow.postbuild_results.get(PLUGIN_GROUP_MANIFESTS_KEY)
         if not manifest_list_digests:
             return
 
-        for repo, digest in manifest_list_digests.items():
-            url = self.make_url(repo, digest.default)
-            manifest = self.make_manifest(registry_noschema, repo, digest.default)
-            self.request_delete(session, url, manifest)
-            deleted_digests.add(digest.default)
+        deletes = [(repo, digest.default) for repo, digest in manifest_list_digests.items()]
+        self.request_deletes(session, deletes)
+        deleted_digests.update(digest for _, digest in deletes)
 
     def get_worker_digests(self):
         """
@@ -141,28 +167,53 @@ class DeleteFromRegistryPlugin(ExitPlugin):
         # Remove manifest list first to avoid broken lists in case an error occurs
         self.delete_manifest_lists(session, registry_noschema, deleted_digests)
 
-        digests = worker_digests[registry_noschema]
-        for digest in digests:
+        deletes = []
+        for digest in worker_digests[registry_noschema]:
             if digest['digest'] in deleted_digests:
                 # Manifest schema version 2 uses the same digest
                 # for all tags
                 self.log.info('digest already deleted %s', digest['digest'])
-                return True
+                continue
 
-            url = self.make_url(digest['repository'], digest['digest'])
-            manifest = self.make_manifest(registry_noschema, digest['repository'],
-                                          digest['digest'])
+            repo_digest = (digest['repository'], digest['digest'])
+            if repo_digest not in deletes:
+                deletes.append(repo_digest)
 
-            if self.request_delete(session, url, manifest):
-                deleted_digests.add(digest['digest'])
+        deleted_digests.update(self.request_deletes(session, deletes))
 
         return True
 
-    def run(self):
+    def delete_from_registry(self, session, push_conf_registry, worker_digests):
+        """
+        delete images from registry of session
+
+        :return: set, digests deleted from the registry
+        """
         deleted_digests = set()
 
+        # orchestrator builds use worker_digests
+        orchestrator_delete = self.handle_worker_digests(session, worker_digests,
+                                                         deleted_digests)
+
+        if not push_conf_registry:
+            # only warn if we're not running in the orchestrator
+            if not orchestrator_delete:
+                self.log.warning("requested deleting image from %s but we haven't pushed there",
+                                 registry_hostname(session.registry))
+            return deleted_digests
+
+        # worker node and manifests use push_conf_registry
+        if self.handle_registry(session, push_conf_registry, deleted_digests):
+            # delete these temp registries
+            self.workflow.push_conf.remove_docker_registry(push_conf_registry)
+
+        return deleted_digests
+
+    def run(self):
         worker_digests = self.get_worker_digests()
 
+        sessions = {}
+        push_conf_registries = {}
         for registry, registry_conf in self.registries.items():
             registry_noschema = registry_hostname(registry)
 
@@ -182,22 +233,18 @@ class DeleteFromRegistryPlugin(ExitPlugin):
 
             secret_path = registry_conf.get('secret')
 
-            session = RegistrySession(registry, insecure=insecure, dockercfg_path=secret_path)
+            sessions[registry] = registry_session_pool.get(registry, insecure=insecure,
+                                                           dockercfg_path=secret_path)
+            push_conf_registries[registry] = push_conf_registry
 
-            # orchestrator builds use worker_digests
-            orchestrator_delete = self.handle_worker_digests(session, worker_digests,
-                                                             deleted_digests)
-
-            if not push_conf_registry:
-                # only warn if we're not running in the orchestrator
-                if not orchestrator_delete:
-                    self.log.warning("requested deleting image from %s but we haven't pushed there",
-                                     registry_noschema)
-                continue
-
-            # worker node and manifests use push_conf_registry
-            if self.handle_registry(session, push_conf_registry, deleted_digests):
-                # delete these temp registries
-                self.workflow.push_conf.remove_docker_registry(push_conf_registry)
+        # registries are independent, all of them are processed concurrently
+        results = map_registries(
+            lambda registry: self.delete_from_registry(sessions[registry],
+                                                       push_conf_registries[registry],
+                                                       worker_digests),
+            list(self.registries), self.registry_workers)
 
+        deleted_digests = set()
+        for digests in results:
+            deleted_digests.update(digests)
         return deleted_digests
@@ -50,7 +50,7 @@ from atomic_reactor.util import (get_version_of_tools, get_checksums,
                                  get_docker_architecture, df_parser,
                                  are_plugins_in_order,
                                  get_image_upload_filename,
-                                 get_digests_map_from_annotations)
+                                 get_digests_map_from_annotations, write_log_lines)
 from atomic_reactor.koji_util import (create_koji_session, tag_koji_build,
                                       Output, KojiUploadLogger)
 from atomic_reactor.rpm_util import parse_rpm_output, rpm_qf_args
@@ -294,7 +294,7 @@ class KojiPromotePlugin(ExitPlugin):
         docker_logs = NamedTemporaryFile(prefix="docker-%s" % self.build_id,
                                          suffix=".log",
                                          mode='wb')
-        docker_logs.write("\n".join(self.workflow.build_result.logs).encode('utf-8'))
+        write_log_lines(docker_logs, self.workflow.build_result.logs)
         docker_logs.flush()
         output.append(Output(file=docker_logs,
                              metadata=self.get_output_metadata(docker_logs.name,
@@ -7,7 +7,8 @@ of the BSD license. See the LICENSE file for details.
 """
 
 import json
-from atomic_reactor.constants import CONTAINER_RESULTS_JSON_PATH
+import os
+from atomic_reactor.constants import CONTAINER_RESULTS_JSON_PATH, TRACE_JSON
 from atomic_reactor.inner import BuildResultsEncoder
 from atomic_reactor.plugin import ExitPlugin
 
@@ -39,3 +40,7 @@ class StoreLogsToFilePlugin(ExitPlugin):
 
         with open(file_path, 'w') as results_json_fd:
             json.dump(results, results_json_fd, cls=BuildResultsEncoder)
+
+        # trace is written once all exit plugins finish
+        if not self.workflow.trace_path:
+            self.workflow.trace_path = os.path.join(os.path.dirname(file_path), TRACE_JSON)
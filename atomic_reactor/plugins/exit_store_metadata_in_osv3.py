@@ -150,6 +150,7 @@ class StoreMetadataInOSv3Plugin(ExitPlugin):
             "errors": self.workflow.plugins_errors,
             "timestamps": self.workflow.plugins_timestamps,
             "durations": self.workflow.plugins_durations,
+            "trace": self.workflow.tracer.summary(),
         }
 
     def make_labels(self):
@@ -16,9 +16,10 @@ except ImportError:
 import os
 
 from atomic_reactor.constants import (EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE,
-                                      IMAGE_TYPE_DOCKER_ARCHIVE)
+                                      IMAGE_TYPE_DOCKER_ARCHIVE, COMPRESS_THREADS)
 from atomic_reactor.plugin import PostBuildPlugin
-from atomic_reactor.util import get_exported_image_metadata, human_size
+from atomic_reactor.util import (get_exported_image_metadata, hashing_writer, human_size,
+                                 ParallelGzipWriter, ParallelXzWriter, zstandard)
 
 
 class CompressPlugin(PostBuildPlugin):
@@ -28,49 +29,89 @@ class CompressPlugin(PostBuildPlugin):
             "name": "compress",
             "args": {
                     "method": "gzip",
-                    "load_exported_image": true
+                    "load_exported_image": true,
+                    "threads": 4
             }
     }]
 
-    Currently supported compression methods are gzip and lzma; gzip is default.
+    Currently supported compression methods are gzip, lzma and zstd (requires
+    zstandard module); gzip is default. Compression level can be set by `level`.
     By default, the plugin doesn't work on exported image, you have to explicitly
     ask for it by using `load_exported_image: true`.
+    With `threads` greater than 1, image is split into blocks compressed
+    concurrently; result is still readable by regular gzip and xz tools.
     """
     key = 'compress'
     is_allowed_to_fail = False
 
     # TODO: add remove_former_image?
-    def __init__(self, tasker, workflow, load_exported_image=False, method='gzip'):
+    def __init__(self, tasker, workflow, load_exported_image=False, method='gzip',
+                 threads=COMPRESS_THREADS, level=None):
         """
         :param tasker: DockerTasker instance
         :param workflow: DockerBuildWorkflow instance
         :param load_exported_image: bool, when running squash plugin with `dont_load=True`,
                                     you may load the exported tar with this switch
+        :param method: str, compression method, gzip, lzma or zstd
+        :param threads: int, number of compressing threads
+        :param level: int, compression level, default depends on method
         """
         super(CompressPlugin, self).__init__(tasker, workflow)
         self.load_exported_image = load_exported_image
         self.method = method
+        self.threads = threads
+        self.level = level
         self.uncompressed_size = 0
 
+    def _get_level(self, default):
+        # level 0 is valid, it means no (or fastest) compression
+        return self.level if self.level is not None else default
+
     def _compress_image_stream(self, stream):
         outfile = os.path.join(self.workflow.source.workdir,
                                EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE)
         if self.method == 'gzip':
             outfile = outfile.format('gz')
-            fp = gzip.open(outfile, 'wb', compresslevel=6)
         elif self.method == 'lzma':
             outfile = outfile.format('xz')
-            fp = lzma.open(outfile, 'wb')
+        elif self.method == 'zstd':
+            if zstandard is None:
+                raise RuntimeError('zstd compression requires zstandard module')
+            outfile = outfile.format('zst')
         else:
             raise RuntimeError('Unsupported compression format {0}'.format(self.method))
 
         _chunk_size = 1024**2  # 1 MB chunk size for reading/writing
-        self.log.info('compressing image %s to %s using %s method',
-                      self.workflow.image, outfile, self.method)
-        data = stream.read(_chunk_size)
-        while data != b'':
-            fp.write(data)
-            data = stream.read(_chunk_size)
+        self.log.info('compressing image %s to %s using %s method (%d threads)',
+                      self.workflow.image, outfile, self.method, self.threads)
+        # checksums of compressed image are computed while it's written
+        with hashing_writer(outfile) as writer:
+            if self.method == 'zstd':
+                # zstd does its own multi-threading
+                compressor = zstandard.ZstdCompressor(
+                    level=self._get_level(3), threads=self.threads if self.threads > 1 else 0)
+                self.uncompressed_size, _ = compressor.copy_stream(
+                    stream, writer, read_size=_chunk_size, write_size=_chunk_size)
+                return outfile
+
+            if self.threads > 1:
+                if self.method == 'gzip':
+                    fp = ParallelGzipWriter(writer, compresslevel=self._get_level(6),
+                                            threads=self.threads)
+                else:
+                    fp = ParallelXzWriter(writer, preset=self.level, threads=self.threads)
+            elif self.method == 'gzip':
+                fp = gzip.GzipFile(mode='wb', compresslevel=self._get_level(6), fileobj=writer)
+            else:
+                fp = lzma.LZMAFile(writer, 'wb', preset=self.level)
+
+            try:
+                data = stream.read(_chunk_size)
+                while data != b'':
+                    fp.write(data)
+                    data = stream.read(_chunk_size)
+            finally:
+                fp.close()
 
         self.uncompressed_size = stream.tell()
 
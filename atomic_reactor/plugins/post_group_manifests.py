@@ -14,13 +14,17 @@ it for all existing image tags.
 from __future__ import unicode_literals
 import json
 import requests
+import threading
 
 from atomic_reactor.plugin import PostBuildPlugin, PluginFailedException
-from atomic_reactor.util import (RegistrySession, registry_hostname, ManifestDigest,
-                                 get_manifest_media_type)
+from atomic_reactor.util import (registry_session_pool, registry_hostname, ManifestDigest,
+                                 get_manifest_media_type, manifest_cache, is_digest,
+                                 cached_response, cache_response, map_in_threads,
+                                 map_registries)
 from atomic_reactor.constants import (PLUGIN_GROUP_MANIFESTS_KEY, MEDIA_TYPE_DOCKER_V2_SCHEMA2,
                                       MEDIA_TYPE_DOCKER_V2_MANIFEST_LIST, MEDIA_TYPE_OCI_V1,
-                                      MEDIA_TYPE_OCI_V1_INDEX)
+                                      MEDIA_TYPE_OCI_V1_INDEX, BLOB_MOUNT_WORKERS,
+                                      REGISTRY_WORKERS)
 
 
 # The plugin requires that the worker builds have already pushed their images into
@@ -41,7 +45,8 @@ class GroupManifestsPlugin(PostBuildPlugin):
         MEDIA_TYPE_OCI_V1_INDEX
     ]
 
-    def __init__(self, tasker, workflow, registries, group=True, goarch=None):
+    def __init__(self, tasker, workflow, registries, group=True, goarch=None,
+                 blob_workers=BLOB_MOUNT_WORKERS, registry_workers=REGISTRY_WORKERS):
         """
         constructor
 
@@ -55,6 +60,8 @@ class GroupManifestsPlugin(PostBuildPlugin):
         :param group: bool, if true, create a manifest list; otherwise only add tags to
                       amd64 image manifest
         :param goarch: dict, keys are platform, values are go language platform names
+        :param blob_workers: int, max number of blobs mounted concurrently
+        :param registry_workers: int, max number of registries processed concurrently
         """
         # call parent constructor
         super(GroupManifestsPlugin, self).__init__(tasker, workflow)
@@ -62,6 +69,11 @@ class GroupManifestsPlugin(PostBuildPlugin):
         self.goarch = goarch or {}
         self.registries = registries
         self.worker_registries = {}
+        self.blob_workers = blob_workers
+        self.registry_workers = registry_workers
+        # (registry, repository, digest) -> whether blob is present in repository
+        self._blobs_present = {}
+        self._blobs_lock = threading.Lock()
 
     def get_manifest(self, session, repository, ref):
         """
@@ -74,30 +86,60 @@ class GroupManifestsPlugin(PostBuildPlugin):
         }
 
         url = '/v2/{}/manifests/{}'.format(repository, ref)
-        response = session.get(url, headers=headers)
-        response.raise_for_status()
+        cached = None
+        if is_digest(ref):
+            cached = manifest_cache.get(session.registry, repository, ref, headers['Accept'])
+        if cached is not None:
+            content, content_type = cached
+            response = cached_response(url, content, content_type, ref)
+        else:
+            response = session.get(url, headers=headers)
+            response.raise_for_status()
+            if is_digest(ref):
+                cache_response(session.registry, repository, ref, headers['Accept'], response)
+
         return (response.content,
                 response.headers['Docker-Content-Digest'],
                 response.headers['Content-Type'],
                 int(response.headers['Content-Length']))
 
+    def is_blob_present(self, session, digest, repository):
+        """
+        Checks whether blob is in repository, answer is remembered for later calls.
+        """
+        key = (session.registry, repository, digest)
+        with self._blobs_lock:
+            present = self._blobs_present.get(key)
+        if present is None:
+            url = "/v2/{}/blobs/{}".format(repository, digest)
+            result = session.head(url)
+            if result.status_code == requests.codes.NOT_FOUND:
+                present = False
+            else:
+                result.raise_for_status()
+                present = True
+            with self._blobs_lock:
+                self._blobs_present[key] = present
+        return present
+
     def link_blob_into_repository(self, session, digest, source_repo, target_repo):
         """
         Links ("mounts" in Docker Registry terminology) a blob from one repository in a
         registry into another repository in the same registry.
         """
+        with self._blobs_lock:
+            if self._blobs_present.get((session.registry, target_repo, digest)):
+                return
+
         self.log.debug("%s: Linking blob %s from %s to %s",
                        session.registry, digest, source_repo, target_repo)
 
         # Check that it exists in the source repository
-        url = "/v2/{}/blobs/{}".format(source_repo, digest)
-        result = session.head(url)
-        if result.status_code == requests.codes.NOT_FOUND:
+        if not self.is_blob_present(session, digest, source_repo):
             self.log.debug("%s: blob %s, not present in %s, skipping",
                            session.registry, digest, source_repo)
             # Assume we don't need to copy it - maybe it's a foreign layer
             return
-        result.raise_for_status()
 
         url = "/v2/{}/blobs/uploads/?mount={}&from={}".format(target_repo, digest, source_repo)
         result = session.post(url, data='')
@@ -108,15 +150,26 @@ class GroupManifestsPlugin(PostBuildPlugin):
             # we're starting an upload - but we've checked that above
             raise RuntimeError("Blob mount had unexpected status {}".format(result.status_code))
 
-    def link_manifest_references_into_repository(self, session, manifest, media_type,
-                                                 source_repo, target_repo):
+        with self._blobs_lock:
+            self._blobs_present[(session.registry, target_repo, digest)] = True
+
+    def link_blobs_into_repositories(self, session, mounts):
         """
-        Links all the blobs referenced by the manifest from source_repo into target_repo.
+        Links blobs concurrently, mounts is an iterable of (digest, source_repo, target_repo).
+        Every distinct mount is done only once.
+        """
+        mounts = sorted(set(mount for mount in mounts if mount[1] != mount[2]))
+        # check every source blob once before its mounts to different repositories
+        sources = sorted(set((digest, source_repo) for digest, source_repo, _ in mounts))
+        map_in_threads(lambda source: self.is_blob_present(session, *source),
+                       sources, self.blob_workers)
+        map_in_threads(lambda mount: self.link_blob_into_repository(session, *mount),
+                       mounts, self.blob_workers)
+
+    def get_manifest_references(self, manifest, media_type):
+        """
+        Returns digests of all the blobs referenced by the manifest.
         """
-
-        if source_repo == target_repo:
-            return
-
         parsed = json.loads(manifest.decode('utf-8'))
 
         references = []
@@ -129,8 +182,20 @@ class GroupManifestsPlugin(PostBuildPlugin):
             # we never copy a manifest list as a whole between repositories
             raise RuntimeError("Unhandled media-type {}".format(media_type))
 
-        for digest in references:
-            self.link_blob_into_repository(session, digest, source_repo, target_repo)
+        return references
+
+    def link_manifest_references_into_repository(self, session, manifest, media_type,
+                                                 source_repo, target_repo):
+        """
+        Links all the blobs referenced by the manifest from source_repo into target_repo.
+        """
+
+        if source_repo == target_repo:
+            return
+
+        references = self.get_manifest_references(manifest, media_type)
+        self.link_blobs_into_repositories(session, [(digest, source_repo, target_repo)
+                                                    for digest in references])
 
     def store_manifest_in_repository(self, session, manifest, media_type,
                                      source_repo, target_repo, digest=None, tag=None):
@@ -192,11 +257,11 @@ class GroupManifestsPlugin(PostBuildPlugin):
                 ],
         }, indent=4)
 
-    def group_manifests_and_tag(self, session, worker_digests):
+    def group_manifests_and_tag(self, session, worker_digests, push_conf_registry):
         """
         Creates a manifest list or OCI image index that groups the different manifests
         in worker_digests, then tags the result with with all the configured tags found
-        in workflow.tag_conf.
+        in workflow.tag_conf. Digest of the result is stored in push_conf_registry.
         """
         self.log.info("%s: Creating manifest list", session.registry)
 
@@ -227,11 +292,26 @@ class GroupManifestsPlugin(PostBuildPlugin):
         # Now push the manifest list to the registry once per each tag
         self.log.info("%s: Tagging manifest list", session.registry)
 
+        # Link blobs of all the manifests into all the target repositories at once
+        target_repos = [image.to_str(registry=False, tag=False)
+                        for image in self.workflow.tag_conf.images]
+        self.link_blobs_into_repositories(session, [
+            (digest, manifest['repository'], target_repo)
+            for target_repo in target_repos
+            for manifest in manifests
+            for digest in self.get_manifest_references(manifest['content'],
+                                                       manifest['media_type'])
+        ])
+
+        stored = set()
         for image in self.workflow.tag_conf.images:
             target_repo = image.to_str(registry=False, tag=False)
             # We have to call store_manifest_in_repository directly for each
             # referenced manifest, since they potentially come from different repos
             for manifest in manifests:
+                if (target_repo, manifest['digest']) in stored:
+                    continue
+                stored.add((target_repo, manifest['digest']))
                 self.store_manifest_in_repository(session,
                                                   manifest['content'],
                                                   manifest['media_type'],
@@ -252,18 +332,16 @@ class GroupManifestsPlugin(PostBuildPlugin):
             digest = ManifestDigest(v2_list=digest_str)
 
         # And store the manifest list in the push_conf
-        push_conf_registry = self.workflow.push_conf.add_docker_registry(session.registry,
-                                                                         insecure=session.insecure)
         for image in self.workflow.tag_conf.images:
             push_conf_registry.digests[image.tag] = digest
 
         self.log.info("%s: Manifest list digest is %s", session.registry, digest_str)
         return registry_image.get_repo(explicit_namespace=False), digest
 
-    def tag_manifest_into_registry(self, session, worker_digest):
+    def tag_manifest_into_registry(self, session, worker_digest, push_conf_registry):
         """
         Tags the manifest identified by worker_digest into session.registry with all the
-        configured tags found in workflow.tag_conf.
+        configured tags found in workflow.tag_conf. Tags are recorded in push_conf_registry.
         """
         self.log.info("%s: Tagging manifest", session.registry)
 
@@ -279,8 +357,13 @@ class GroupManifestsPlugin(PostBuildPlugin):
             raise RuntimeError("Unexpected media type found in worker repository: {}"
                                .format(media_type))
 
-        push_conf_registry = self.workflow.push_conf.add_docker_registry(session.registry,
-                                                                         insecure=session.insecure)
+        references = self.get_manifest_references(image_manifest, media_type)
+        self.link_blobs_into_repositories(session, [
+            (reference, source_repo, image.to_str(registry=False, tag=False))
+            for image in self.workflow.tag_conf.images
+            for reference in references
+        ])
+
         for image in self.workflow.tag_conf.images:
             target_repo = image.to_str(registry=False, tag=False)
             self.store_manifest_in_repository(session, image_manifest, media_type,
@@ -342,23 +425,43 @@ class GroupManifestsPlugin(PostBuildPlugin):
         insecure = registry_conf.get('insecure', False)
         secret_path = registry_conf.get('secret')
 
-        return RegistrySession(registry, insecure=insecure, dockercfg_path=secret_path)
+        return registry_session_pool.get(registry, insecure=insecure, dockercfg_path=secret_path)
 
     def run(self):
-        digests = dict()
-        for registry, source in self.sort_annotations().items():
+        sources = self.sort_annotations()
+
+        if not self.group:
+            for registry, source in sources.items():
+                sources[registry] = [digest for platform, digest in source.items()
+                                     if self.goarch.get(platform, platform) == 'amd64']
+                if not sources[registry]:
+                    raise ValueError('failed to find an x86_64 platform')
+
+        # push_conf registries are added in order, registries are processed concurrently
+        registries = list(sources)
+        sessions = {}
+        push_conf_registries = {}
+        for registry in registries:
             session = self.get_registry_session(registry)
+            sessions[registry] = session
+            push_conf_registries[registry] = self.workflow.push_conf.add_docker_registry(
+                session.registry, insecure=session.insecure)
 
+        def process_registry(registry):
+            session = sessions[registry]
             if self.group:
-                repo, digest = self.group_manifests_and_tag(session, source)
+                return self.group_manifests_and_tag(session, sources[registry],
+                                                    push_conf_registries[registry])
+
+            for digest in sources[registry]:
+                self.tag_manifest_into_registry(session, digest,
+                                                push_conf_registries[registry])
+
+        results = map_registries(process_registry, registries, self.registry_workers)
+
+        digests = dict()
+        if self.group:
+            for repo, digest in results:
                 self.log.debug("repo: %s digest: %s", repo, digest)
                 digests[repo] = digest
-            else:
-                found = False
-                for platform, digest in source.items():
-                    if self.goarch.get(platform, platform) == 'amd64':
-                        self.tag_manifest_into_registry(session, digest)
-                        found = True
-                if not found:
-                    raise ValueError('failed to find an x86_64 platform')
         return digests
@@ -20,7 +20,7 @@ from atomic_reactor.plugins.post_rpmqa import PostBuildRPMqaPlugin
 from atomic_reactor.constants import PROG, PLUGIN_KOJI_UPLOAD_PLUGIN_KEY
 from atomic_reactor.util import (get_version_of_tools, get_checksums,
                                  get_build_json, get_docker_architecture,
-                                 get_image_upload_filename)
+                                 get_image_upload_filename, write_log_lines)
 from atomic_reactor.koji_util import create_koji_session
 from atomic_reactor.rpm_util import parse_rpm_output, rpm_qf_args
 from osbs.conf import Configuration
@@ -265,13 +265,27 @@ class KojiUploadPlugin(PostBuildPlugin):
         build_logs = NamedTemporaryFile(prefix="buildstep-%s" % self.build_id,
                                          suffix=".log",
                                          mode='wb')
-        build_logs.write("\n".join(self.workflow.build_result.logs).encode('utf-8'))
+        write_log_lines(build_logs, self.workflow.build_result.logs)
         build_logs.flush()
         filename = "{platform}-build.log".format(platform=self.platform)
-        return [Output(file=build_logs,
+        logs = [Output(file=build_logs,
                        metadata=self.get_output_metadata(build_logs.name,
                                                          filename))]
 
+        # profiles of plugins which have already run
+        try:
+            for path in self.workflow.profile_outputs:
+                filename = "{platform}-{name}".format(platform=self.platform,
+                                                      name=os.path.basename(path))
+                metadata = self.get_output_metadata(path, filename)
+                logs.append(Output(file=open(path, 'rb'), metadata=metadata))
+        except Exception:
+            for log in logs:
+                log.file.close()
+            raise
+
+        return logs
+
     def get_image_components(self):
         """
         Re-package the output of the rpmqa plugin into the format required
@@ -386,8 +400,6 @@ class KojiUploadPlugin(PostBuildPlugin):
             return Output(file=logfile, metadata=metadata)
 
         arch = os.uname()[4]
-        output_files = [add_log_type(add_buildroot_id(metadata), arch)
-                        for metadata in self.get_logs()]
 
         # Parent of squashed built image is base image
         image_id = self.workflow.builder.image_id
@@ -407,12 +419,13 @@ class KojiUploadPlugin(PostBuildPlugin):
         digests = self.get_digests()
         repositories = self.get_repositories(digests)
         tags = set(image.tag for image in self.workflow.tag_conf.images)
+        components = self.get_image_components()
         metadata, output = self.get_image_output()
 
         metadata.update({
             'arch': arch,
             'type': 'docker-image',
-            'components': self.get_image_components(),
+            'components': components,
             'extra': {
                 'image': {
                     'arch': arch,
@@ -431,6 +444,15 @@ class KojiUploadPlugin(PostBuildPlugin):
         if not config:
             del metadata['extra']['docker']['config']
 
+        # Logs are opened last, once nothing else can fail, so that run()
+        # is always able to close them
+        try:
+            output_files = [add_log_type(add_buildroot_id(metadata), arch)
+                            for metadata in self.get_logs()]
+        except Exception:
+            output.file.close()
+            raise
+
         # Add the 'docker save' image to the output
         image = add_buildroot_id(output)
         output_files.append(image)
@@ -43,11 +43,13 @@ from __future__ import print_function, unicode_literals
 import tempfile
 from tempfile import NamedTemporaryFile
 import os
-import subprocess
+import shutil
 
-from atomic_reactor.constants import PLUGIN_PULP_SYNC_KEY, PLUGIN_PULP_PUSH_KEY
+from atomic_reactor.constants import (PLUGIN_PULP_SYNC_KEY, PLUGIN_PULP_PUSH_KEY,
+                                      DEFAULT_DOWNLOAD_BLOCK_SIZE, COMPRESS_THREADS)
 from atomic_reactor.plugin import PostBuildPlugin
-from atomic_reactor.util import ImageName, are_plugins_in_order
+from atomic_reactor.util import (ImageName, are_plugins_in_order, zstd_decompress, filter_tar,
+                                 ParallelGzipWriter)
 from atomic_reactor.pulp_util import PulpHandler
 
 
@@ -57,7 +59,8 @@ class PulpPushPlugin(PostBuildPlugin):
 
     def __init__(self, tasker, workflow, pulp_registry_name, load_squashed_image=None,
                  load_exported_image=None, image_names=None, pulp_secret_path=None,
-                 username=None, password=None, dockpulp_loglevel=None, publish=True):
+                 username=None, password=None, dockpulp_loglevel=None, publish=True,
+                 threads=COMPRESS_THREADS):
         """
         constructor
 
@@ -72,6 +75,7 @@ class PulpPushPlugin(PostBuildPlugin):
         :param username: pulp username, used in preference to certificate and key
         :param password: pulp password, used in preference to certificate and key
         :param publish: Bool, whether to publish to crane or not
+        :param threads: int, number of threads compressing image for upload
         """
         # call parent constructor
         super(PulpPushPlugin, self).__init__(tasker, workflow)
@@ -88,6 +92,7 @@ class PulpPushPlugin(PostBuildPlugin):
         self.pulp_secret_path = pulp_secret_path
         self.username = username
         self.password = password
+        self.threads = threads
 
         self.publish = publish and not are_plugins_in_order(self.workflow.postbuild_plugins_conf,
                                                             self.key, PLUGIN_PULP_SYNC_KEY)
@@ -98,6 +103,27 @@ class PulpPushPlugin(PostBuildPlugin):
                                         username=self.username, password=self.password,
                                         dockpulp_loglevel=self.dockpulp_loglevel)
 
+    def repack_tar(self, filename, outfile, remove_layers=()):
+        """
+        write gzip compressed copy of image tar without some of its layers
+
+        :param filename: str, path to image tar, may be compressed
+        :param outfile: file object opened for writing bytes
+        :param remove_layers: list of str, paths of layer.tar files to leave out
+        """
+        self.log.debug("repacking %s without %s", filename, remove_layers)
+        # nothing uses checksums of the repacked tar, dockpulp computes its own
+        compressor = ParallelGzipWriter(outfile, threads=self.threads)
+        try:
+            removed = filter_tar(filename, compressor, exclude=remove_layers)
+        finally:
+            compressor.close()
+        outfile.flush()
+        missing = set(remove_layers) - set(removed)
+        if missing:
+            raise RuntimeError("layers not found in %s: %s" % (filename, sorted(missing)))
+        self.log.debug("repacked tar: %d bytes", outfile.tell())
+
     def push_tar(self, filename, image_names=None, repo_prefix="redhat-"):
         # Find out how to tag this image.
         self.log.info("image names: %s", [str(image_name) for image_name in image_names])
@@ -117,17 +143,11 @@ class PulpPushPlugin(PostBuildPlugin):
             # Strip existing layers from the tar and repack it
             remove_layers = [str(os.path.join(x, 'layer.tar')) for x in existing_imageids]
 
-            commands = {'.xz': 'xzcat', '.gz': 'zcat', '.bz2': 'bzcat', '.tar': 'cat'}
-            unpacker = commands.get(file_extension, None)
-            self.log.debug("using unpacker %s for extension %s", unpacker, file_extension)
-            if unpacker is None:
+            if file_extension not in ('.xz', '.gz', '.bz2', '.tar'):
                 raise Exception("Unknown tarball format: %s" % filename)
 
             with NamedTemporaryFile(prefix='strip_tar_', suffix='.gz') as outfile:
-                cmd = "set -o pipefail; {0} {1} | tar --delete {2} | gzip - > {3}".format(
-                    unpacker, filename, ' '.join(remove_layers), outfile.name)
-                self.log.debug("running %s", cmd)
-                subprocess.check_call(cmd, shell=True)
+                self.repack_tar(filename, outfile, remove_layers)
                 self.log.debug("uploading %s", outfile.name)
                 self.pulp_handler.upload(outfile.name)
         except:
@@ -136,10 +156,7 @@ class PulpPushPlugin(PostBuildPlugin):
                 if file_extension != '.tar':
                     raise RuntimeError("tar is already compressed")
                 with NamedTemporaryFile(prefix='full_tar_', suffix='.gz') as outfile:
-                    cmd = "set -o pipefail; cat {0} | gzip - > {1}".format(
-                        filename, outfile.name)
-                    self.log.debug("Compressing tar using '%s' command", cmd)
-                    subprocess.check_call(cmd, shell=True)
+                    self.repack_tar(filename, outfile)
                     self.log.debug("uploading %s", outfile.name)
                     self.pulp_handler.upload(outfile.name)
             except:
@@ -183,13 +200,24 @@ class PulpPushPlugin(PostBuildPlugin):
             if len(self.workflow.exported_image_sequence) == 0:
                 raise RuntimeError('no exported image to push to pulp')
             export_path = self.workflow.exported_image_sequence[-1].get("path")
-            top_layer, crane_repos = self.push_tar(export_path, image_names)
+            if export_path.endswith('.zst'):
+                # dockpulp can't read zstd compressed images
+                self.log.info("decompressing %s", export_path)
+                with tempfile.NamedTemporaryFile(prefix='docker-image-',
+                                                 suffix='.tar') as image_file:
+                    zstd_decompress(export_path, image_file)
+                    image_file.flush()
+                    top_layer, crane_repos = self.push_tar(image_file.name, image_names)
+            else:
+                top_layer, crane_repos = self.push_tar(export_path, image_names)
         else:
             # Work out image ID
             image = self.workflow.image
             self.log.info("fetching image %s from docker", image)
             with tempfile.NamedTemporaryFile(prefix='docker-image-', suffix='.tar') as image_file:
-                image_file.write(self.tasker.d.get_image(image).data)
+                # copy image in blocks, it may be larger than available memory
+                with self.tasker.d.get_image(image) as image_stream:
+                    shutil.copyfileobj(image_stream, image_file, DEFAULT_DOWNLOAD_BLOCK_SIZE)
                 # This file will be referenced by its filename, not file
                 # descriptor - must ensure contents are written to disk
                 image_file.flush()
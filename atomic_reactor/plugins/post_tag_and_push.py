@@ -10,10 +10,13 @@ from copy import deepcopy
 import re
 import subprocess
 
-from atomic_reactor.constants import IMAGE_TYPE_DOCKER_ARCHIVE, IMAGE_TYPE_OCI, IMAGE_TYPE_OCI_TAR
+from atomic_reactor.constants import (IMAGE_TYPE_DOCKER_ARCHIVE, IMAGE_TYPE_OCI,
+                                      IMAGE_TYPE_OCI_TAR, REGISTRY_WORKERS)
 from atomic_reactor.plugin import PostBuildPlugin
 from atomic_reactor.plugins.exit_remove_built_image import defer_removal
-from atomic_reactor.util import get_manifest_digests, get_config_from_registry, Dockercfg
+from atomic_reactor.util import (get_manifest_digests, get_config_from_registry, Dockercfg,
+                                 get_manifest_media_type, map_in_threads, query_registry,
+                                 registry_session_pool)
 
 
 __all__ = ('TagAndPushPlugin', )
@@ -27,7 +30,8 @@ class TagAndPushPlugin(PostBuildPlugin):
     key = "tag_and_push"
     is_allowed_to_fail = False
 
-    def __init__(self, tasker, workflow, registries):
+    def __init__(self, tasker, workflow, registries, oci_compression=None,
+                 registry_workers=REGISTRY_WORKERS):
         """
         constructor
 
@@ -40,11 +44,16 @@ class TagAndPushPlugin(PostBuildPlugin):
                               plain HTTP.
                             * "secret" optional string - path to the secret, which stores
                               email, login and password for remote registry
+        :param oci_compression: str, compression of layers of OCI images pushed by skopeo,
+                                e.g. "zstd"; skopeo default is used when not set
+        :param registry_workers: int, max number of registries pushed to concurrently
         """
         # call parent constructor
         super(TagAndPushPlugin, self).__init__(tasker, workflow)
 
         self.registries = deepcopy(registries)
+        self.oci_compression = oci_compression
+        self.registry_workers = registry_workers
 
     def need_skopeo_push(self):
         if len(self.workflow.exported_image_sequence) > 0:
@@ -74,6 +83,8 @@ class TagAndPushPlugin(PostBuildPlugin):
             cmd.append('--dest-tls-verify=false')
 
         if image['type'] == IMAGE_TYPE_OCI:
+            if self.oci_compression:
+                cmd += ['--dest-compress', '--dest-compress-format=' + self.oci_compression]
             source_img = 'oci:{path}:{ref_name}'.format(**image)
         elif image['type'] == IMAGE_TYPE_DOCKER_ARCHIVE:
             source_img = 'docker-archive://{path}'.format(**image)
@@ -96,59 +107,113 @@ class TagAndPushPlugin(PostBuildPlugin):
             e.cmd = log_cmd  # hide credentials
             raise
 
-    def run(self):
+    def push_image(self, registry_image, insecure, docker_push_secret):
+        if self.need_skopeo_push():
+            self.push_with_skopeo(registry_image, insecure, docker_push_secret)
+        else:
+            self.tasker.tag_and_push_image(self.workflow.builder.image_id,
+                                           registry_image, insecure=insecure,
+                                           force=True, dockercfg=docker_push_secret)
+            defer_removal(self.workflow, registry_image)
+
+    def tag_manifest(self, session, source_image, registry_image, digest, version):
+        """
+        tag manifest already pushed as source_image also as registry_image
+
+        Both images are in the same repository, so all blobs referenced by the
+        manifest are there and only the manifest itself is uploaded.
+        """
+        response = query_registry(session, source_image, digest=digest, version=version)
+        tag = registry_image.tag or 'latest'
+        self.log.info("%s: Tagging %s as %s", session.registry, digest, tag)
+
+        url = '/v2/{}/manifests/{}'.format(registry_image.get_repo(), tag)
+        headers = {'Content-Type': get_manifest_media_type(version)}
+        response = session.put(url, data=response.content, headers=headers)
+        response.raise_for_status()
+
+    def push_to_registry(self, registry, registry_conf, push_conf_registry):
+        """
+        push all images to registry
+
+        Image is pushed only once to every repository, other tags in that
+        repository are set by uploading the pushed manifest.
+
+        :return: list of ImageName, pushed images
+        """
         pushed_images = []
 
-        if not self.workflow.tag_conf.unique_images:
-            self.workflow.tag_conf.add_unique_image(self.workflow.image)
+        insecure = registry_conf.get('insecure', False)
+        docker_push_secret = registry_conf.get('secret', None)
+        self.log.info("Registry %s secret %s", registry, docker_push_secret)
+        session = registry_session_pool.get(registry, insecure=insecure,
+                                            dockercfg_path=docker_push_secret)
 
+        # repository -> (image, manifest digest, manifest version) of pushed image
+        pushed_manifests = {}
         config_manifest_digest = None
         config_manifest_type = None
         config_registry_image = None
+        for image in self.workflow.tag_conf.images:
+            registry_image = image.copy()
+            registry_image.registry = registry
+            repository = registry_image.get_repo()
+            if repository in pushed_manifests:
+                source_image, digest, version = pushed_manifests[repository]
+                self.tag_manifest(session, source_image, registry_image, digest, version)
+            else:
+                self.push_image(registry_image, insecure, docker_push_secret)
+
+            pushed_images.append(registry_image)
+
+            digests = get_manifest_digests(registry_image, registry,
+                                           insecure, docker_push_secret)
+            tag = registry_image.to_str(registry=False)
+            push_conf_registry.digests[tag] = digests
+
+            # schema 1 manifests are signed including tag, those can't be reused;
+            # True means the manifest exists but registry didn't report its digest
+            version = 'v2' if digests.v2 else 'oci'
+            if repository not in pushed_manifests and digests.get(version) not in (None, True):
+                pushed_manifests[repository] = (registry_image, digests[version], version)
+
+            if not config_manifest_digest and (digests.v2 or digests.oci):
+                if digests.v2:
+                    config_manifest_digest = digests.v2
+                    config_manifest_type = 'v2'
+                else:
+                    config_manifest_digest = digests.oci
+                    config_manifest_type = 'oci'
+                config_registry_image = registry_image
+
+        if config_manifest_digest:
+            push_conf_registry.config = get_config_from_registry(
+                config_registry_image, registry, config_manifest_digest, insecure,
+                docker_push_secret, config_manifest_type)
+        else:
+            self.log.info("V2 schema 2 or OCI manifest is not available to get config from")
+
+        return pushed_images
+
+    def run(self):
+        if not self.workflow.tag_conf.unique_images:
+            self.workflow.tag_conf.add_unique_image(self.workflow.image)
+
+        for image in self.workflow.tag_conf.images:
+            if image.registry:
+                raise RuntimeError("Image name must not contain registry: %r" % image.registry)
+
+        # registries are added in configured order, pushes run concurrently
+        pushes = []
         for registry, registry_conf in self.registries.items():
             insecure = registry_conf.get('insecure', False)
             push_conf_registry = \
                 self.workflow.push_conf.add_docker_registry(registry, insecure=insecure)
+            pushes.append((registry, registry_conf, push_conf_registry))
 
-            docker_push_secret = registry_conf.get('secret', None)
-            self.log.info("Registry %s secret %s", registry, docker_push_secret)
-
-            for image in self.workflow.tag_conf.images:
-                if image.registry:
-                    raise RuntimeError("Image name must not contain registry: %r" % image.registry)
-
-                registry_image = image.copy()
-                registry_image.registry = registry
-                if self.need_skopeo_push():
-                    self.push_with_skopeo(registry_image, insecure, docker_push_secret)
-                else:
-                    self.tasker.tag_and_push_image(self.workflow.builder.image_id,
-                                                   registry_image, insecure=insecure,
-                                                   force=True, dockercfg=docker_push_secret)
-                    defer_removal(self.workflow, registry_image)
-
-                pushed_images.append(registry_image)
-
-                digests = get_manifest_digests(registry_image, registry,
-                                               insecure, docker_push_secret)
-                tag = registry_image.to_str(registry=False)
-                push_conf_registry.digests[tag] = digests
-
-                if not config_manifest_digest and (digests.v2 or digests.oci):
-                    if digests.v2:
-                        config_manifest_digest = digests.v2
-                        config_manifest_type = 'v2'
-                    else:
-                        config_manifest_digest = digests.oci
-                        config_manifest_type = 'oci'
-                    config_registry_image = registry_image
-
-            if config_manifest_digest:
-                push_conf_registry.config = get_config_from_registry(
-                    config_registry_image, registry, config_manifest_digest, insecure,
-                    docker_push_secret, config_manifest_type)
-            else:
-                self.log.info("V2 schema 2 or OCI manifest is not available to get config from")
+        results = map_in_threads(lambda args: self.push_to_registry(*args), pushes,
+                                 self.registry_workers)
+        pushed_images = [image for images in results for image in images]
 
         self.log.info("All images were tagged and pushed")
         return pushed_images
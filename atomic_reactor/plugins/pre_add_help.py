@@ -23,7 +23,7 @@ from subprocess import check_output, CalledProcessError, STDOUT
 from datetime import datetime as dt
 from atomic_reactor import start_time as atomic_reactor_start_time
 from atomic_reactor.plugin import PreBuildPlugin
-from atomic_reactor.util import df_parser
+from atomic_reactor.util import break_hardlink, df_parser
 from atomic_reactor.util import get_preferred_label
 
 DEFAULT_HELP_FILENAME = "help.md"
@@ -72,6 +72,8 @@ class AddHelpPlugin(PreBuildPlugin):
         dockerfile = df_parser(self.workflow.builder.df_path, workflow=self.workflow)
         labels = dockerfile.labels
 
+        # help file and man page may be shared with source, don't modify them
+        break_hardlink(help_path)
         with open(help_path, 'r+') as help_file:
             lines = help_file.readlines()
 
@@ -90,6 +92,7 @@ class AddHelpPlugin(PreBuildPlugin):
                 self.log.info("added metadata to %s for generating nicer manpages", help_path)
 
         man_path = os.path.join(self.workflow.builder.df_dir, self.man_filename)
+        break_hardlink(man_path)
 
         go_md2man_cmd = ['go-md2man', '-in={}'.format(help_path), '-out={}'.format(man_path)]
 
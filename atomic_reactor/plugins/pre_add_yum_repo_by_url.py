@@ -93,6 +93,8 @@ class YumRepo(object):
 class AddYumRepoByUrlPlugin(PreBuildPlugin):
     key = "add_yum_repo_by_url"
     is_allowed_to_fail = False
+    reads = ()
+    writes = ('files',)
 
     def __init__(self, tasker, workflow, repourls, inject_proxy=None):
         """
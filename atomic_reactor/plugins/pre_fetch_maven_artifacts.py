@@ -67,6 +67,9 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
 
     key = 'fetch_maven_artifacts'
     is_allowed_to_fail = False
+    # request files are read from and artifacts downloaded into build directory
+    reads = ('df_dir',)
+    writes = ('df_dir',)
 
     NVR_REQUESTS_FILENAME = 'fetch-artifacts-koji.yaml'
     URL_REQUESTS_FILENAME = 'fetch-artifacts-url.yaml'
@@ -207,6 +210,7 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
             request = session.get(download.url, stream=True)
             request.raise_for_status()
 
+            util.break_hardlink(dest_path)
             with open(dest_path, 'wb') as f:
                 for chunk in request.iter_content(chunk_size=DEFAULT_DOWNLOAD_BLOCK_SIZE):
                     f.write(chunk)
@@ -26,7 +26,7 @@ from atomic_reactor.plugin import PreBuildPlugin
 from atomic_reactor.plugins.pre_resolve_module_compose import get_compose_info
 from atomic_reactor.plugins.build_orchestrate_build import override_build_kwarg
 from atomic_reactor.rpm_util import rpm_qf_args
-from atomic_reactor.util import render_yum_repo
+from atomic_reactor.util import break_hardlink, render_yum_repo
 
 DOCKERFILE_TEMPLATE = '''FROM {base_image}
 
@@ -140,6 +140,7 @@ class FlatpakCreateDockerfilePlugin(PreBuildPlugin):
         # Create the cleanup script
 
         cleanupscript = os.path.join(self.workflow.builder.df_dir, "cleanup.sh")
+        break_hardlink(cleanupscript)
         with open(cleanupscript, 'w') as f:
             for line in source.flatpak_json.get('cleanup-commands', []):
                 f.write(line)
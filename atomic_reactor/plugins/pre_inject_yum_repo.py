@@ -12,7 +12,7 @@ import os
 import re
 from atomic_reactor.constants import YUM_REPOS_DIR, RELATIVE_REPOS_PATH, INSPECT_CONFIG
 from atomic_reactor.plugin import PreBuildPlugin
-from atomic_reactor.util import df_parser
+from atomic_reactor.util import break_hardlink, df_parser
 
 
 logger = None
@@ -149,6 +149,7 @@ class InjectYumRepoPlugin(PreBuildPlugin):
                 repo_relative_path = os.path.join(RELATIVE_REPOS_PATH, repo_basename)
                 repo_host_path = os.path.join(host_repos_path, repo_basename)
                 self.log.info("writing repo to '%s'", repo_host_path)
+                break_hardlink(repo_host_path)
                 with open(repo_host_path, "wb") as fp:
                     fp.write(repo_content.encode("utf-8"))
                 self.log.debug("%s\n%s", repo, repo_content.strip())
@@ -21,6 +21,8 @@ from atomic_reactor.core import RetryGeneratorException
 class PullBaseImagePlugin(PreBuildPlugin):
     key = "pull_base_image"
     is_allowed_to_fail = False
+    reads = ()
+    writes = ('base_image', 'pulled_base_images')
 
     def __init__(self, tasker, workflow, parent_registry=None, parent_registry_insecure=False):
         """
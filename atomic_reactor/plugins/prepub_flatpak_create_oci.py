@@ -22,7 +22,7 @@ from atomic_reactor.constants import IMAGE_TYPE_OCI, IMAGE_TYPE_OCI_TAR
 from atomic_reactor.plugin import PrePublishPlugin
 from atomic_reactor.plugins.pre_flatpak_create_dockerfile import get_flatpak_source_info
 from atomic_reactor.rpm_util import parse_rpm_output
-from atomic_reactor.util import get_exported_image_metadata
+from atomic_reactor.util import get_exported_image_metadata, hashing_writer
 
 
 # Returns flatpak's name for the current arch
@@ -485,9 +485,10 @@ class FlatpakCreateOciPlugin(PrePublishPlugin):
         self.log.info('OCI image is available as %s', outfile)
 
         tarred_outfile = outfile + '.tar'
-        with tarfile.TarFile(tarred_outfile, "w") as tf:
-            for f in os.listdir(outfile):
-                tf.add(os.path.join(outfile, f), f)
+        with hashing_writer(tarred_outfile) as writer:
+            with tarfile.TarFile(fileobj=writer, mode="w") as tf:
+                for f in os.listdir(outfile):
+                    tf.add(os.path.join(outfile, f), f)
 
         metadata = get_exported_image_metadata(tarred_outfile, IMAGE_TYPE_OCI_TAR)
         metadata['ref_name'] = ref_name
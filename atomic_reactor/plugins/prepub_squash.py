@@ -15,7 +15,6 @@ from atomic_reactor.constants import EXPORTED_SQUASHED_IMAGE_NAME, IMAGE_TYPE_DO
 from atomic_reactor.plugin import PrePublishPlugin
 from atomic_reactor.plugins.exit_remove_built_image import defer_removal
 from atomic_reactor.util import get_exported_image_metadata
-from docker_squash.squash import Squash
 
 __all__ = ('PrePublishSquashPlugin', )
 
@@ -91,6 +90,9 @@ class PrePublishSquashPlugin(PrePublishPlugin):
         else:
             output_path = None
 
+        # docker_squash is slow to import, don't make builds which don't squash pay for it
+        from docker_squash.squash import Squash
+
         # Squash the image and output tarfile
         # If the parameter dont_load is set to True squashed image won't be
         # loaded in to Docker daemon. If it's set to False it will be loaded.
@@ -0,0 +1,95 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Profiling of plugins
+
+Plugin is run under cProfile, its statistics are stored as <plugin>.pstats
+(readable by pstats module, snakeviz, gprof2dot, ...). When tracemalloc is
+available (python 3), the biggest allocations made while the plugin was
+running are stored as <plugin>-allocations.txt.
+"""
+
+from __future__ import unicode_literals
+
+import cProfile
+import errno
+import io
+import logging
+import os
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2
+    tracemalloc = None
+
+
+logger = logging.getLogger(__name__)
+
+# number of allocation sites written into allocations file
+TOP_ALLOCATIONS = 50
+# number of frames stored for every allocation
+ALLOCATION_FRAMES = 10
+
+
+def _ensure_dir(path):
+    try:
+        os.makedirs(path)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+
+
+def _write_allocations(snapshot, path):
+    stats = snapshot.statistics('traceback')
+    with io.open(path, 'w', encoding='utf-8') as f:
+        for stat in stats[:TOP_ALLOCATIONS]:
+            f.write('%d KiB in %d blocks\n' % (stat.size // 1024, stat.count))
+            for line in stat.traceback.format():
+                f.write('%s\n' % line)
+            f.write('\n')
+
+
+@contextmanager
+def profile(name, output_dir, outputs):
+    """
+    profile the wrapped block
+
+    :param name: str, name used for output files, e.g. plugin key
+    :param output_dir: str, directory for output files
+    :param outputs: list, paths to created files are appended here
+    """
+    _ensure_dir(output_dir)
+
+    # tracemalloc is process-wide, only one block can be traced at a time
+    trace_memory = tracemalloc is not None and not tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.start(ALLOCATION_FRAMES)
+    elif tracemalloc is not None:
+        logger.debug("memory is already traced, not tracing allocations of %s", name)
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+
+        pstats_path = os.path.join(output_dir, '%s.pstats' % name)
+        profiler.dump_stats(pstats_path)
+        outputs.append(pstats_path)
+        logger.info("profile of %s stored in '%s'", name, pstats_path)
+
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            allocations_path = os.path.join(output_dir, '%s-allocations.txt' % name)
+            _write_allocations(snapshot, allocations_path)
+            outputs.append(allocations_path)
+            logger.info("allocations of %s stored in '%s'", name, allocations_path)
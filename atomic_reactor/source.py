@@ -21,6 +21,8 @@ except ImportError:
     from urllib.parse import urlparse
 
 from atomic_reactor import util
+from atomic_reactor.constants import (DOCKERFILE_FILENAME, FLATPAK_FILENAME,
+                                      COPY_METHOD_COPY, COPY_METHODS, COPY_NO_HARDLINK_FILES)
 
 
 logger = logging.getLogger(__name__)
@@ -77,7 +79,31 @@ class GitSource(Source):
         super(GitSource, self).__init__(provider, uri, dockerfile_path,
                                         provider_params, tmpdir)
         self.git_commit = self.provider_params.get('git_commit', None)
-        self.lg = util.LazyGit(self.uri, self.git_commit, self.source_path)
+        self.git_cache_dir = self.provider_params.get('git_cache_dir', None)
+        self.git_depth = self.provider_params.get('git_depth', None)
+        self.git_sparse_checkout = self.provider_params.get('git_sparse_checkout', False)
+        sparse_paths = None
+        if self.git_sparse_checkout:
+            build_file_dir = self._build_file_dir()
+            if build_file_dir:
+                sparse_paths = [build_file_dir]
+        self.lg = util.LazyGit(self.uri, self.git_commit, self.source_path,
+                               cache_dir=self.git_cache_dir, depth=self.git_depth,
+                               sparse_paths=sparse_paths)
+
+    def _build_file_dir(self):
+        """
+        directory with build file relative to root of the repo
+
+        :return: str, or None when it's the root of the repo
+        """
+        local_path = self.dockerfile_path or ''
+        if local_path.endswith(DOCKERFILE_FILENAME) or local_path.endswith(FLATPAK_FILENAME):
+            local_path = os.path.dirname(local_path)
+        local_path = os.path.normpath(local_path).strip('/')
+        if local_path in ('', '.') or local_path.startswith('..'):
+            return None
+        return local_path
 
     @property
     def commit_id(self):
@@ -102,22 +128,17 @@ class PathSource(Source):
         if not self.uri.startswith('file://'):
             self.uri = 'file://' + self.uri
         self.schemeless_path = self.uri[len('file://'):]
+        self.copy_method = self.provider_params.get('copy_method', COPY_METHOD_COPY)
+        if self.copy_method not in COPY_METHODS:
+            raise ValueError('"copy_method" must be one of {0}'.format(', '.join(COPY_METHODS)))
+        self._copied = False
         os.makedirs(self.source_path)
 
     def get(self):
-        # work around the weird behaviour of copytree, which requires the top dir
-        #  to *not* exist
-        for f in os.listdir(self.schemeless_path):
-            old = os.path.join(self.schemeless_path, f)
-            new = os.path.join(self.source_path, f)
-            if os.path.exists(new):
-                # this is the second invocation of this method; just break the loop
-                break
-            else:
-                if os.path.isdir(old):
-                    shutil.copytree(old, new)
-                else:
-                    shutil.copy2(old, new)
+        if not self._copied:
+            util.copy_tree(self.schemeless_path, self.source_path, method=self.copy_method,
+                           no_hardlink=COPY_NO_HARDLINK_FILES)
+            self._copied = True
         return self.source_path
 
 
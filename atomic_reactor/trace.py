@@ -0,0 +1,352 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Recording of build spans
+
+Spans cover plugin phases, plugins, docker API calls and HTTP requests. They
+are kept by TraceRecorder of the running build and can be exported in Chrome
+trace event format (loadable by chrome://tracing, Perfetto or converted to
+OpenTelemetry), each span carrying its own id and id of its parent.
+
+Recorder is active only in the thread running the build, so builds running
+in other threads of the same process keep their own spans. Threads started
+for the build get the recorder by running their target wrapped by bind().
+"""
+
+from __future__ import unicode_literals
+
+import itertools
+import json
+import logging
+import os
+import resource
+import threading
+import time
+import types
+from contextlib import contextmanager
+from functools import wraps
+
+
+logger = logging.getLogger(__name__)
+
+# recorder of the build running in the calling thread
+_local = threading.local()
+
+
+def get_peak_rss():
+    """
+    :return: int, peak resident set size of this process in KiB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Span(object):
+    def __init__(self, span_id, name, category, parent_id=None, args=None):
+        self.span_id = span_id
+        self.name = name
+        self.category = category
+        self.parent_id = parent_id
+        self.args = args or {}
+        self.thread_id = threading.current_thread().ident
+        self.start = time.time()
+        self.end = None
+
+    def finish(self, error=None):
+        """
+        mark span as ended
+
+        :param error: Exception, which ended the span, if any
+        """
+        if error is not None:
+            self.args['error'] = repr(error)
+        self.end = time.time()
+        self.args['peak_rss_kb'] = get_peak_rss()
+
+    @property
+    def duration(self):
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    def to_event(self, pid):
+        """
+        :return: dict, complete event in Chrome trace event format
+        """
+        args = dict(self.args)
+        args['span_id'] = self.span_id
+        args['parent_id'] = self.parent_id
+        return {
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': int(self.start * 1e6),
+            'dur': int((self.duration or 0) * 1e6),
+            'pid': pid,
+            'tid': self.thread_id,
+            'args': args,
+        }
+
+
+class TraceRecorder(object):
+    """
+    collects spans of a single build
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def current_span(self):
+        """
+        :return: Span, innermost open span of the calling thread, or None
+        """
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def start_span(self, name, category, parent=None, **args):
+        """
+        start span which is ended by its finish() method
+
+        Such span is not the current span of the calling thread, so it
+        may be ended later or in another thread.
+
+        :return: Span
+        """
+        if parent is None:
+            parent = self.current_span()
+
+        with self._lock:
+            span = Span(next(self._ids), name, category,
+                        parent_id=parent.span_id if parent else None, args=args)
+            self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name, category, parent=None, **args):
+        """
+        record a span around the wrapped block
+
+        :param name: str, span name
+        :param category: str, e.g. 'phase', 'plugin', 'docker', 'http'
+        :param parent: Span, parent span; defaults to innermost open span
+                       of the calling thread
+        :param args: additional data stored with the span
+        """
+        span = self.start_span(name, category, parent=parent, **args)
+
+        stack = self._stack()
+        stack.append(span)
+        try:
+            yield span
+        except Exception as ex:
+            span.finish(ex)
+            raise
+        else:
+            span.finish()
+        finally:
+            stack.pop()
+
+    def to_chrome_trace(self):
+        pid = os.getpid()
+        with self._lock:
+            events = [span.to_event(pid) for span in self.spans]
+        return {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+        }
+
+    def save(self, path):
+        """
+        write spans into file in Chrome trace event format
+
+        :param path: str, path to trace file
+        """
+        logger.info("writing trace of %d spans to '%s'", len(self.spans), path)
+        with open(path, 'w') as trace_file:
+            json.dump(self.to_chrome_trace(), trace_file)
+
+    def summary(self, slowest=5):
+        """
+        summarize recorded spans
+
+        :param slowest: int, how many of the slowest plugins to list
+        :return: dict, totals for each span category, peak RSS and slowest plugins
+        """
+        categories = {}
+        peak_rss = 0
+        with self._lock:
+            spans = [span for span in self.spans if span.end is not None]
+
+        for span in spans:
+            totals = categories.setdefault(span.category,
+                                           {'count': 0, 'duration': 0.0, 'bytes': 0})
+            totals['count'] += 1
+            totals['duration'] += span.duration
+            totals['bytes'] += (span.args.get('bytes_sent') or 0)
+            totals['bytes'] += (span.args.get('bytes_received') or 0)
+            peak_rss = max(peak_rss, span.args.get('peak_rss_kb', 0))
+
+        plugins = sorted((span for span in spans if span.category == 'plugin'),
+                         key=lambda span: span.duration, reverse=True)
+        return {
+            'categories': categories,
+            'peak_rss_kb': peak_rss,
+            'slowest_plugins': [{'name': span.name, 'duration': span.duration}
+                                for span in plugins[:slowest]],
+        }
+
+
+def get_recorder():
+    """
+    :return: TraceRecorder active in the calling thread, or None
+    """
+    return getattr(_local, 'recorder', None)
+
+
+def set_recorder(recorder):
+    """
+    make recorder receive all spans recorded in the calling thread
+
+    :param recorder: TraceRecorder instance or None to stop recording
+    """
+    _local.recorder = recorder
+
+
+def bind(func):
+    """
+    make func record spans with recorder active in the calling thread,
+    no matter which thread it runs in; spans are children of the span
+    current in the calling thread
+
+    :param func: callable, e.g. target of a thread started for the build
+    :return: callable
+    """
+    recorder = get_recorder()
+    parent = current_span()
+
+    @wraps(func)
+    def bound(*args, **kwargs):
+        previous = get_recorder()
+        set_recorder(recorder)
+        stack = recorder._stack() if recorder is not None and parent is not None else None
+        if stack is not None:
+            stack.append(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if stack is not None:
+                stack.remove(parent)
+            set_recorder(previous)
+    return bound
+
+
+def current_span():
+    recorder = get_recorder()
+    if recorder is None:
+        return None
+    return recorder.current_span()
+
+
+@contextmanager
+def span(name, category, parent=None, **args):
+    """
+    record a span with the active recorder
+
+    When no recorder is active, the yielded span is not stored anywhere.
+    """
+    recorder = get_recorder()
+    if recorder is None:
+        yield Span(None, name, category, args=args)
+        return
+
+    with recorder.span(name, category, parent=parent, **args) as new_span:
+        yield new_span
+
+
+def start_span(name, category, parent=None, **args):
+    """
+    start span with the active recorder, see TraceRecorder.start_span
+
+    When no recorder is active, the returned span is not stored anywhere.
+    """
+    recorder = get_recorder()
+    if recorder is None:
+        return Span(None, name, category, args=args)
+    return recorder.start_span(name, category, parent=parent, **args)
+
+
+class TracedStream(object):
+    """
+    file-like object which ends its span once closed
+    """
+
+    def __init__(self, stream, stream_span):
+        self._stream = stream
+        self._span = stream_span
+
+    def __getattr__(self, attr):
+        return getattr(self._stream, attr)
+
+    def read(self, *args, **kwargs):
+        data = self._stream.read(*args, **kwargs)
+        self._span.args['bytes_received'] = (self._span.args.get('bytes_received', 0) +
+                                             len(data or b''))
+        return data
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if self._span.end is None:
+                self._span.finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _traced_generator(stream, stream_span):
+    error = None
+    try:
+        for item in stream:
+            yield item
+    except Exception as ex:
+        error = ex
+        raise
+    finally:
+        # also when consumer stops early and the generator is closed
+        stream_span.finish(error)
+
+
+def trace_stream(stream, stream_span):
+    """
+    keep stream_span open until the stream is consumed
+
+    :param stream: generator or file-like object returned by streaming call
+    :param stream_span: Span, started span of the call
+    :return: stream wrapper, which ends the span once exhausted or closed;
+             stream itself, with span ended, when it isn't a stream
+    """
+    if isinstance(stream, types.GeneratorType):
+        return _traced_generator(stream, stream_span)
+    if hasattr(stream, 'read') and hasattr(stream, 'close'):
+        return TracedStream(stream, stream_span)
+
+    stream_span.finish()
+    return stream
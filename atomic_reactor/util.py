@@ -9,10 +9,11 @@ of the BSD license. See the LICENSE file for details.
 from __future__ import print_function, unicode_literals
 
 import hashlib
+import io
 import json
-import jsonschema
 import os
 import re
+import stat
 from pipes import quote
 import requests
 from requests.exceptions import ConnectionError, SSLError, HTTPError, RetryError, Timeout
@@ -20,16 +21,38 @@ from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util import Retry
 import shutil
 import subprocess
+import tarfile
 import tempfile
 import logging
 import uuid
 import yaml
 import codecs
+import errno
+import fcntl
 import string
+import struct
+import threading
 import time
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 
+import six
 from six.moves.urllib.parse import urlparse
 
+try:
+    # if we import "lzma" first, we get pyliblzma on Py2, but we want backports.lzma
+    #  so first try to import backports.lzma on Py2 and then 'lzma' on Py3
+    from backports import lzma
+except ImportError:
+    import lzma
+try:
+    import zstandard
+except ImportError:
+    # zstd compression is optional
+    zstandard = None
+
+from atomic_reactor import trace
 from atomic_reactor.constants import (DOCKERFILE_FILENAME, FLATPAK_FILENAME, TOOLS_USED,
                                       INSPECT_CONFIG,
                                       IMAGE_TYPE_DOCKER_ARCHIVE, IMAGE_TYPE_OCI, IMAGE_TYPE_OCI_TAR,
@@ -37,10 +60,17 @@ from atomic_reactor.constants import (DOCKERFILE_FILENAME, FLATPAK_FILENAME, TOO
                                       HTTP_CLIENT_STATUS_RETRY, HTTP_REQUEST_TIMEOUT,
                                       MEDIA_TYPE_DOCKER_V2_SCHEMA1, MEDIA_TYPE_DOCKER_V2_SCHEMA2,
                                       MEDIA_TYPE_DOCKER_V2_MANIFEST_LIST, MEDIA_TYPE_OCI_V1,
-                                      MEDIA_TYPE_OCI_V1_INDEX, GIT_MAX_RETRIES, GIT_BACKOFF_FACTOR)
-
+                                      MEDIA_TYPE_OCI_V1_INDEX, GIT_MAX_RETRIES, GIT_BACKOFF_FACTOR,
+                                      CHECKSUM_BLOCK_SIZE, CHECKSUM_QUEUED_BLOCKS,
+                                      REGISTRY_TOKEN_DEFAULT_EXPIRATION,
+                                      REGISTRY_TOKEN_EXPIRATION_MARGIN,
+                                      MANIFEST_CACHE_MEMORY_SIZE, MANIFEST_CACHE_DISK_SIZE,
+                                      COPY_METHOD_COPY, COPY_METHOD_HARDLINK,
+                                      COPY_METHOD_REFLINK, COPY_TREE_WORKERS,
+                                      LOG_MEMORY_LINES, LOG_TAIL_LINES, COMPRESS_THREADS)
+
+from docker.utils import exclude_paths
 from dockerfile_parse import DockerfileParser
-from pkg_resources import resource_stream
 
 from importlib import import_module
 from requests.utils import guess_json_utf
@@ -170,10 +200,111 @@ def figure_out_build_file(absolute_path, local_path=None):
     raise IOError("Dockerfile '%s' doesn't exist." % build_file_path)
 
 
+class LogBuffer(object):
+    """
+    iterable of log lines with bounded memory usage
+
+    Lines are kept in memory until there are more than memory_lines of
+    them; from then on, all lines are stored gzip-compressed in a temporary
+    file and only the last tail_lines lines stay in memory. Pickled buffer
+    holds only those last lines then, temporary file is not preserved.
+    """
+
+    def __init__(self, memory_lines=LOG_MEMORY_LINES, tail_lines=LOG_TAIL_LINES):
+        """
+        :param memory_lines: int, max number of lines kept in memory
+        :param tail_lines: int, number of last lines kept in memory once
+            lines are stored in file
+        """
+        self.memory_lines = memory_lines
+        self._lines = []
+        self._tail = deque(maxlen=tail_lines)
+        self._count = 0
+        self._spill_file = None
+        self._compressor = None
+
+    def _spill(self):
+        logger.debug("storing more than %d log lines in file", self.memory_lines)
+        self._spill_file = tempfile.NamedTemporaryFile(prefix='atomic-reactor-log-',
+                                                       suffix='.gz')
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for line in self._lines:
+            self._write(line)
+        self._lines = None
+
+    def _write(self, line):
+        data = self._compressor.compress((line + '\n').encode('utf-8'))
+        if data:
+            self._spill_file.write(data)
+
+    def append(self, line):
+        """
+        :param line: str, log line without newline
+        """
+        self._count += 1
+        self._tail.append(line)
+        if self._spill_file is not None:
+            self._write(line)
+            return
+
+        self._lines.append(line)
+        if len(self._lines) > self.memory_lines:
+            self._spill()
+
+    @property
+    def tail(self):
+        """
+        :return: list of str, last lines
+        """
+        return list(self._tail)
+
+    def __len__(self):
+        return self._count
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._spill_file is not None:
+            # neither temporary file nor compressor can be pickled
+            state.update(_lines=list(self._tail), _count=len(self._tail),
+                         _spill_file=None, _compressor=None)
+        return state
+
+    def __iter__(self):
+        if self._spill_file is None:
+            for line in list(self._lines):
+                yield line
+            return
+
+        # make everything compressed so far readable, stream stays open
+        self._spill_file.write(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        self._spill_file.flush()
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        partial = b''
+        with open(self._spill_file.name, 'rb') as f:
+            for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b''):
+                lines = (partial + decompressor.decompress(block)).split(b'\n')
+                partial = lines.pop()
+                for line in lines:
+                    yield line.decode('utf-8')
+
+
+def write_log_lines(fileobj, lines):
+    """
+    write log lines separated by newlines into file, one by one
+
+    :param fileobj: file-like object opened for writing bytes
+    :param lines: iterable of str, log lines without newlines
+    """
+    separator = b''
+    for line in lines:
+        fileobj.write(separator + line.encode('utf-8'))
+        separator = b'\n'
+
+
 class CommandResult(object):
     def __init__(self):
-        self._logs = []
-        self._parsed_logs = []
+        self._logs = LogBuffer()
+        self._parsed_logs = deque(maxlen=LOG_TAIL_LINES)
         self._error = None
         self._error_detail = None
 
@@ -205,10 +336,16 @@ class CommandResult(object):
 
     @property
     def parsed_logs(self):
-        return self._parsed_logs
+        """
+        :return: list, last decoded log items
+        """
+        return list(self._parsed_logs)
 
     @property
     def logs(self):
+        """
+        :return: LogBuffer, log lines
+        """
         return self._logs
 
     @property
@@ -238,7 +375,76 @@ def wait_for_command(logs_generator):
     return cr
 
 
-def clone_git_repo(git_url, target_dir, commit=None, retry_times=GIT_MAX_RETRIES):
+def _run_git_with_retries(cmd, retry_times, cwd=None):
+    """
+    run git command, retrying it with exponential backoff when it fails
+
+    :param cmd: list of str, git command
+    :param retry_times: int, number of retries
+    :param cwd: str, working directory of the command
+    """
+    retry_delay = GIT_BACKOFF_FACTOR
+    for counter in range(retry_times + 1):
+        try:
+            # we are using check_output, even though we aren't using
+            # the return value, but we will get 'output' in exception
+            subprocess.check_output(cmd, stderr=subprocess.STDOUT, cwd=cwd)
+            break
+        except subprocess.CalledProcessError as exc:
+            if counter != retry_times:
+                logger.info("retrying command '%s':\n '%s'", cmd, exc.output)
+                time.sleep(retry_delay * (2 ** counter))
+            else:
+                raise
+
+
+def update_git_mirror(git_url, cache_dir, retry_times=GIT_MAX_RETRIES):
+    """
+    create or update bare mirror of git repo in cache_dir
+
+    Mirror is locked while it's updated, so builds running at the same time
+    don't update it concurrently.
+
+    :param git_url: str, git repo to mirror
+    :param cache_dir: str, directory with mirrors
+    :param retry_times: int, number of retries for fetching from git_url
+    :return: str, path to the mirror
+    """
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # created by another build meanwhile
+            if not os.path.isdir(cache_dir):
+                raise
+
+    name = hashlib.sha256(git_url.encode('utf-8')).hexdigest()
+    mirror_path = os.path.join(cache_dir, name + '.git')
+    with open(os.path.join(cache_dir, name + '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.isdir(mirror_path):
+                logger.info("updating git mirror of '%s'", git_url)
+                _run_git_with_retries(["git", "fetch", "--prune", "origin"], retry_times,
+                                      cwd=mirror_path)
+            else:
+                logger.info("creating git mirror of '%s'", git_url)
+                tmp_path = mirror_path + '.tmp'
+                if os.path.exists(tmp_path):
+                    shutil.rmtree(tmp_path)
+                _run_git_with_retries(["git", "clone", "--mirror", git_url, tmp_path],
+                                      retry_times)
+                # clones borrow objects from the mirror, never remove them
+                subprocess.check_call(["git", "config", "gc.auto", "0"], cwd=tmp_path)
+                os.rename(tmp_path, mirror_path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    return mirror_path
+
+
+def clone_git_repo(git_url, target_dir, commit=None, retry_times=GIT_MAX_RETRIES,
+                   cache_dir=None, depth=None, sparse_paths=None):
     """
     clone provided git repo to target_dir, optionally checkout provided commit
 
@@ -246,34 +452,57 @@ def clone_git_repo(git_url, target_dir, commit=None, retry_times=GIT_MAX_RETRIES
     :param target_dir: str, filesystem path where the repo should be cloned
     :param commit: str, commit to checkout, SHA-1 or ref
     :param retry_times: int, number of retries for git clone
+    :param cache_dir: str, keep mirror of the repo in this directory and
+        clone objects from it, only objects missing there are downloaded
+    :param depth: int, clone only this many commits of history, history is
+        fetched completely when commit is not among them
+    :param sparse_paths: list of str, directories relative to root of the repo;
+        when set, only these and files in the root of the repo are checked out
     :return: str, commit ID of HEAD
     """
-    retry_delay = GIT_BACKOFF_FACTOR
-
     commit = commit or "master"
     logger.info("cloning git repo '%s'", git_url)
     logger.debug("url = '%s', dir = '%s', commit = '%s'",
                  git_url, target_dir, commit)
 
-    cmd = ["git", "clone", git_url, quote(target_dir)]
+    cmd = ["git", "clone"]
+    if cache_dir:
+        mirror_path = update_git_mirror(git_url, cache_dir, retry_times=retry_times)
+        cmd += ["--reference", mirror_path]
+    elif depth:
+        cmd += ["--depth", str(depth), "--no-single-branch"]
+    if sparse_paths:
+        cmd += ["--no-checkout"]
+    cmd += [git_url, quote(target_dir)]
 
     logger.debug("cloning '%s'", cmd)
-    for counter in range(retry_times + 1):
-        try:
-            # we are using check_output, even though we aren't using
-            # the return value, but we will get 'output' in exception
-            subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-            break
-        except subprocess.CalledProcessError as exc:
-            if counter != retry_times:
-                logger.info("retrying command '%s':\n '%s'", cmd, exc.output)
-                time.sleep(retry_delay * (2 ** counter))
-            else:
-                raise
+    _run_git_with_retries(cmd, retry_times)
+
+    if sparse_paths:
+        logger.debug("enabling sparse checkout of %s", sparse_paths)
+        subprocess.check_call(["git", "config", "core.sparseCheckout", "true"], cwd=target_dir)
+        # files in the root of the repo, and whole given directories
+        patterns = ["/*", "!/*/"]
+        patterns += ["/{}/".format(path.strip("/")) for path in sparse_paths]
+        info_dir = os.path.join(target_dir, ".git", "info")
+        if not os.path.isdir(info_dir):
+            os.mkdir(info_dir)
+        with open(os.path.join(info_dir, "sparse-checkout"), "w") as f:
+            f.write("\n".join(patterns) + "\n")
 
     cmd = ["git", "reset", "--hard", commit]
     logger.debug("checking out branch '%s'", cmd)
-    subprocess.check_call(cmd, cwd=target_dir)
+    if depth and not cache_dir:
+        try:
+            subprocess.check_output(cmd, cwd=target_dir, stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError:
+            logger.info("commit '%s' not found in shallow clone, fetching whole history",
+                        commit)
+            _run_git_with_retries(["git", "fetch", "--unshallow"], retry_times,
+                                  cwd=target_dir)
+            subprocess.check_call(cmd, cwd=target_dir)
+    else:
+        subprocess.check_call(cmd, cwd=target_dir)
     cmd = ["git", "rev-parse", "HEAD"]
     logger.debug("getting SHA-1 of provided ref '%s'", cmd)
     commit_id = subprocess.check_output(cmd, cwd=target_dir)
@@ -295,13 +524,26 @@ class LazyGit(object):
         lazy_git = LazyGit(git_url="...", tmpdir=tmp_dir)
         lazy_git.git_path
     """
-    def __init__(self, git_url, commit=None, tmpdir=None):
+    def __init__(self, git_url, commit=None, tmpdir=None, cache_dir=None, depth=None,
+                 sparse_paths=None):
+        """
+        :param git_url: str, git repo to clone
+        :param commit: str, commit to checkout, SHA-1 or ref
+        :param tmpdir: str, filesystem path where the repo should be cloned
+        :param cache_dir: str, directory with mirrors of git repos to clone from
+        :param depth: int, clone only this many commits of history
+        :param sparse_paths: list of str, check out only these directories
+            and files in the root of the repo
+        """
         self.git_url = git_url
         # provided commit ID/reference to check out
         self.commit = commit
         # commit ID of HEAD; we'll figure this out ourselves
         self._commit_id = None
         self.provided_tmpdir = tmpdir
+        self.cache_dir = cache_dir
+        self.depth = depth
+        self.sparse_paths = sparse_paths
         self._git_path = None
 
     @property
@@ -315,7 +557,9 @@ class LazyGit(object):
     @property
     def git_path(self):
         if self._git_path is None:
-            self._commit_id = clone_git_repo(self.git_url, self._tmpdir, self.commit)
+            self._commit_id = clone_git_repo(self.git_url, self._tmpdir, self.commit,
+                                             cache_dir=self.cache_dir, depth=self.depth,
+                                             sparse_paths=self.sparse_paths)
             self._git_path = self._tmpdir
         return self._git_path
 
@@ -329,6 +573,161 @@ class LazyGit(object):
                 shutil.rmtree(self.our_tmpdir)
 
 
+def map_in_threads(func, items, workers):
+    """
+    call func for each of items using given number of threads
+
+    :param func: callable taking one argument
+    :param items: list of arguments for func
+    :param workers: int, max number of threads
+    :return: list of results of func, in order of items;
+        first exception raised by func is re-raised
+    """
+    results = [None] * len(items)
+    errors = []
+    indexes = iter(range(len(items)))
+    lock = threading.Lock()
+
+    def work():
+        while not errors:
+            with lock:
+                index = next(indexes, None)
+            if index is None:
+                return
+            try:
+                results[index] = func(items[index])
+            except Exception as ex:
+                errors.append(ex)
+
+    threads = [threading.Thread(target=trace.bind(work))
+               for _ in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def map_registries(func, registries, workers):
+    """
+    call func for each of registries using given number of threads,
+    failure for one registry doesn't stop processing of the others
+
+    :param func: callable taking registry
+    :param registries: list of registries
+    :param workers: int, max number of threads
+    :return: list of results of func, in order of registries;
+        exception raised by func is re-raised when it failed for one registry,
+        RuntimeError describing all failures is raised when it failed for more
+    """
+    errors = {}
+
+    def call(registry):
+        try:
+            return func(registry)
+        except Exception as ex:
+            logger.error("processing registry %s failed: %r", registry, ex)
+            errors[registry] = ex
+
+    results = map_in_threads(call, registries, workers)
+    failed = [registry for registry in registries if registry in errors]
+    if len(failed) == 1:
+        raise errors[failed[0]]
+    if failed:
+        raise RuntimeError("processing registries failed: {}".format(
+            "; ".join("{}: {!r}".format(registry, errors[registry]) for registry in failed)))
+    return results
+
+
+def copy_tree(src, dst, method=COPY_METHOD_COPY, no_hardlink=(), workers=COPY_TREE_WORKERS):
+    """
+    copy content of directory src to directory dst, following symlinks
+
+    Files are copied by several threads. With COPY_METHOD_HARDLINK, files
+    are hardlinked except of those with name in no_hardlink, which are
+    expected to be modified in place; files which can't be hardlinked are
+    copied. With COPY_METHOD_REFLINK, tree is copied by `cp --reflink`,
+    falling back to copying when filesystem doesn't support it.
+
+    :param src: str, directory to copy
+    :param dst: str, target directory, created if it doesn't exist
+    :param method: str, one of COPY_METHODS
+    :param no_hardlink: collection of str, names of files to always copy
+    :param workers: int, number of threads copying files
+    """
+    if method == COPY_METHOD_REFLINK:
+        cmd = ['cp', '-R', '-L', '--preserve=mode,timestamps', '--reflink=always',
+               os.path.join(src, '.'), dst]
+        try:
+            subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+            return
+        except (OSError, subprocess.CalledProcessError) as exc:
+            logger.info("unable to reflink '%s', copying it: %s", src,
+                        getattr(exc, 'output', exc))
+            if os.path.exists(dst):
+                shutil.rmtree(dst)
+
+    dirs = []
+    files = []
+    for root, _, filenames in os.walk(src, followlinks=True):
+        target_root = os.path.normpath(os.path.join(dst, os.path.relpath(root, src)))
+        if not os.path.isdir(target_root):
+            os.makedirs(target_root)
+        dirs.append((root, target_root))
+        files.extend((os.path.join(root, name), os.path.join(target_root, name))
+                     for name in filenames)
+
+    def copy_file(paths):
+        src_file, dst_file = paths
+        if (method == COPY_METHOD_HARDLINK and
+                os.path.basename(src_file) not in no_hardlink and
+                not os.path.islink(src_file)):
+            try:
+                os.link(src_file, dst_file)
+                return
+            except OSError as exc:
+                if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+        shutil.copy2(src_file, dst_file)
+
+    map_in_threads(copy_file, files, workers)
+    for src_dir, dst_dir in reversed(dirs):
+        shutil.copystat(src_dir, dst_dir)
+
+
+def break_hardlink(path):
+    """
+    replace file by its private copy when it is hardlinked elsewhere
+
+    Files in build directory may be hardlinks to files outside of it (see
+    COPY_METHOD_HARDLINK), plugins call this before they write into an
+    existing file in build directory. Nothing happens when path doesn't
+    exist.
+
+    :param path: str, path to file
+    """
+    try:
+        st = os.lstat(path)
+    except OSError as exc:
+        if exc.errno == errno.ENOENT:
+            return
+        raise
+    if not stat.S_ISREG(st.st_mode) or st.st_nlink < 2:
+        return
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    prefix='.' + os.path.basename(path))
+    os.close(fd)
+    try:
+        shutil.copy2(path, tmp_path)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
 def escape_dollar(v):
     try:
         str_type = unicode
@@ -437,41 +836,470 @@ def _process_plugin_substitution(mapping, key_parts, value):
                            plugin_name, plugins_num)
 
 
+class ChecksumCache(object):
+    """
+    checksums of files computed in this process
+
+    Files are identified by device, inode, size and time of last
+    modification, so a checksum is computed again once the file changes.
+    Change time is left out on purpose: creating a hardlink updates it, yet
+    content of the file stays the same (all its links share the checksum).
+    """
+
+    def __init__(self):
+        # file identity -> {algorithm: hexdigest}
+        self._checksums = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _file_key(path):
+        st = os.stat(path)
+        # st_mtime_ns is not available in python 2
+        return (st.st_dev, st.st_ino, st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime))
+
+    def get(self, path):
+        """
+        :param path: str, path to file
+        :return: dict, algorithm -> hexdigest of checksums known for the file
+        """
+        key = self._file_key(path)
+        with self._lock:
+            return dict(self._checksums.get(key, {}))
+
+    def store(self, path, checksums):
+        """
+        remember checksums of the file in its current state
+
+        :param path: str, path to file
+        :param checksums: dict, algorithm -> hexdigest
+        """
+        key = self._file_key(path)
+        with self._lock:
+            self._checksums.setdefault(key, {}).update(checksums)
+
+    def clear(self):
+        with self._lock:
+            self._checksums.clear()
+
+
+checksum_cache = ChecksumCache()
+
+
+def _hash_blocks(hasher, blocks):
+    while True:
+        block = blocks.get()
+        if block is None:
+            return
+        hasher.update(block)
+
+
+def compute_checksums(path, algorithms):
+    """
+    read the file once and compute its checksums, each of them in a separate
+    thread (hashlib releases GIL while hashing bigger blocks)
+
+    :param path: str, path to file
+    :param algorithms: list of str, names of hashlib algorithms
+    :return: dict, algorithm -> hexdigest
+    """
+    hashers = dict((algorithm, hashlib.new(algorithm)) for algorithm in algorithms)
+    if len(hashers) == 1:
+        hasher, = hashers.values()
+        with open(path, mode='rb') as f:
+            for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b''):
+                hasher.update(block)
+        return dict((algorithm, hasher.hexdigest()) for algorithm, hasher in hashers.items())
+
+    queues = []
+    threads = []
+    for hasher in hashers.values():
+        blocks = six.moves.queue.Queue(maxsize=CHECKSUM_QUEUED_BLOCKS)
+        thread = threading.Thread(target=_hash_blocks, args=(hasher, blocks))
+        thread.daemon = True
+        thread.start()
+        queues.append(blocks)
+        threads.append(thread)
+
+    try:
+        with open(path, mode='rb') as f:
+            for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b''):
+                for blocks in queues:
+                    blocks.put(block)
+    finally:
+        for blocks in queues:
+            blocks.put(None)
+        for thread in threads:
+            thread.join()
+
+    return dict((algorithm, hasher.hexdigest()) for algorithm, hasher in hashers.items())
+
+
+class HashingWriter(object):
+    """
+    file-like object passing written data to another one, computing
+    checksums and size of the data on the way
+    """
+
+    def __init__(self, fileobj, algorithms=('md5', 'sha256')):
+        """
+        :param fileobj: file-like object opened for writing
+        :param algorithms: list of str, names of hashlib algorithms
+        """
+        self.fileobj = fileobj
+        self.hashers = dict((algorithm, hashlib.new(algorithm)) for algorithm in algorithms)
+        self.size = 0
+
+    @property
+    def name(self):
+        # gzip and tarfile take file name from the file object
+        return getattr(self.fileobj, 'name', '')
+
+    def write(self, data):
+        self.fileobj.write(data)
+        for hasher in self.hashers.values():
+            hasher.update(data)
+        self.size += len(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def hexdigests(self):
+        """
+        :return: dict, algorithm -> hexdigest of data written so far
+        """
+        return dict((algorithm, hasher.hexdigest())
+                    for algorithm, hasher in self.hashers.items())
+
+
+@contextmanager
+def hashing_writer(path, algorithms=('md5', 'sha256')):
+    """
+    open file for writing and compute checksums of everything written into it
+
+    Once the block succeeds, checksums are stored in checksum_cache, so
+    get_checksums() and get_exported_image_metadata() don't need to read the
+    file again.
+
+    :param path: str, path to file
+    :param algorithms: list of str, names of hashlib algorithms
+    :return: HashingWriter instance
+    """
+    with open(path, 'wb') as f:
+        writer = HashingWriter(f, algorithms)
+        yield writer
+    checksum_cache.store(path, writer.hexdigests())
+
+
+class ParallelCompressWriter(object):
+    """
+    file-like object compressing written data by several threads
+
+    Data is split into blocks which are compressed concurrently and
+    written to fileobj in order. Subclasses define the format.
+    """
+
+    # size of blocks of uncompressed data
+    block_size = 128 * 1024
+
+    def __init__(self, fileobj, threads=COMPRESS_THREADS):
+        """
+        :param fileobj: file-like object opened for writing bytes
+        :param threads: int, number of compressing threads
+        """
+        self.fileobj = fileobj
+        self.size = 0
+        self._buffer = []
+        self._buffered = 0
+        self._previous = b''
+        self._pending = deque()
+        # compressed blocks are kept in memory until they can be written
+        self._max_pending = 2 * threads
+        self._jobs = six.moves.queue.Queue()
+        self._threads = [threading.Thread(target=self._work) for _ in range(threads)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        self.fileobj.write(self._header())
+
+    def _header(self):
+        return b''
+
+    def _trailer(self):
+        return b''
+
+    def _compress_block(self, block, previous, last):
+        """
+        :param block: bytes, block of data to compress
+        :param previous: bytes, previous block of data
+        :param last: bool, whether this is the last block
+        :return: bytes, compressed block
+        """
+        raise NotImplementedError('Must override in subclasses!')
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            try:
+                job['result'] = self._compress_block(job['block'], job['previous'], job['last'])
+            except Exception as ex:
+                job['error'] = ex
+            job['done'].set()
+
+    def _write_job(self, job):
+        job['done'].wait()
+        if 'error' in job:
+            raise job['error']
+        self.fileobj.write(job['result'])
+
+    def _dispatch(self, block, last=False):
+        job = {'block': block, 'previous': self._previous, 'last': last,
+               'done': threading.Event()}
+        self._previous = block
+        self._jobs.put(job)
+        self._pending.append(job)
+        while len(self._pending) > self._max_pending:
+            self._write_job(self._pending.popleft())
+
+    def write(self, data):
+        self.size += len(data)
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered < self.block_size:
+            return
+
+        data = b''.join(self._buffer)
+        full = len(data) - len(data) % self.block_size
+        for start in range(0, full, self.block_size):
+            self._dispatch(data[start:start + self.block_size])
+        self._buffer = [data[full:]]
+        self._buffered = len(data) - full
+
+    def close(self):
+        try:
+            self._dispatch(b''.join(self._buffer), last=True)
+            self._buffer = []
+            while self._pending:
+                self._write_job(self._pending.popleft())
+            self.fileobj.write(self._trailer())
+        finally:
+            for _ in self._threads:
+                self._jobs.put(None)
+            for thread in self._threads:
+                thread.join()
+
+
+class ParallelGzipWriter(ParallelCompressWriter):
+    """
+    pigz-like gzip compressor producing a single gzip member
+
+    Blocks are compressed to raw deflate data, primed with the end of the
+    previous block, and sync-flushed, so they can be concatenated.
+    """
+
+    def __init__(self, fileobj, compresslevel=6, threads=COMPRESS_THREADS):
+        """
+        :param fileobj: file-like object opened for writing bytes
+        :param compresslevel: int, zlib compression level
+        :param threads: int, number of compressing threads
+        """
+        self.compresslevel = compresslevel
+        self._crc = 0
+        super(ParallelGzipWriter, self).__init__(fileobj, threads=threads)
+
+    def _header(self):
+        # magic, deflate, no flags, no mtime, no extra flags, unknown OS
+        return b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+    def _trailer(self):
+        return struct.pack('<II', self._crc & 0xffffffff, self.size & 0xffffffff)
+
+    def _compress_block(self, block, previous, last):
+        if previous and six.PY3:
+            compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                          zdict=previous[-32 * 1024:])
+        else:
+            compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(block) + compressor.flush(
+            zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    def write(self, data):
+        self._crc = zlib.crc32(data, self._crc)
+        super(ParallelGzipWriter, self).write(data)
+
+
+class ParallelXzWriter(ParallelCompressWriter):
+    """
+    xz compressor producing concatenated xz streams, one per block
+    """
+
+    # blocks need to be large compared to the dictionary to compress well
+    block_size = 24 * 1024 * 1024
+
+    def __init__(self, fileobj, preset=None, threads=COMPRESS_THREADS):
+        """
+        :param fileobj: file-like object opened for writing bytes
+        :param preset: int, lzma compression preset
+        :param threads: int, number of compressing threads
+        """
+        self.preset = preset
+        super(ParallelXzWriter, self).__init__(fileobj, threads=threads)
+
+    def _compress_block(self, block, previous, last):
+        return lzma.compress(block, preset=self.preset)
+
+
+def filter_tar(path, fileobj, exclude=()):
+    """
+    copy members of tar archive into another one, leaving out some of them
+
+    Source archive, which may be compressed by gzip, bzip2 or xz, is read
+    once as a stream; target archive is written uncompressed to fileobj.
+
+    :param path: str, path to source archive
+    :param fileobj: file-like object opened for writing bytes
+    :param exclude: collection of str, names of members to leave out
+    :return: list of str, names of members left out
+    """
+    excluded = []
+    with tarfile.open(path, mode='r|*') as src:
+        with tarfile.open(fileobj=fileobj, mode='w|', format=src.format) as dst:
+            for member in src:
+                if member.name in exclude:
+                    excluded.append(member.name)
+                    continue
+                dst.addfile(member, src.extractfile(member) if member.isreg() else None)
+    return excluded
+
+
+def zstd_decompress(path, fileobj):
+    """
+    decompress zstd compressed file
+
+    :param path: str, path to compressed file
+    :param fileobj: file-like object opened for writing bytes
+    :return: int, size of decompressed data
+    """
+    if zstandard is None:
+        raise RuntimeError("zstandard module is required to decompress '%s'" % path)
+    with open(path, 'rb') as f:
+        read, written = zstandard.ZstdDecompressor().copy_stream(
+            f, fileobj, read_size=CHECKSUM_BLOCK_SIZE, write_size=CHECKSUM_BLOCK_SIZE)
+    return written
+
+
+class BuildContextStream(object):
+    """
+    iterable producing tar archive of docker build context on the fly
+
+    Files are read in blocks while the archive is being sent, so the
+    context is neither kept in memory nor written to a temporary file.
+    Paths matching .dockerignore in the context directory are skipped.
+    """
+
+    def __init__(self, path, gzip=False, dockerfile=None, block_size=CHECKSUM_BLOCK_SIZE):
+        """
+        :param path: str, directory with build context
+        :param gzip: bool, compress the archive
+        :param dockerfile: str, path to Dockerfile relative to path, it's
+            never excluded by .dockerignore
+        :param block_size: int, size of blocks files are read in
+        """
+        self.path = os.path.abspath(path)
+        self.gzip = gzip
+        self.dockerfile = dockerfile
+        self.block_size = block_size
+        # bytes of (compressed) archive produced so far
+        self.size = 0
+        # bytes of files added to the archive so far
+        self.content_size = 0
+
+    def _exclude_patterns(self):
+        dockerignore = os.path.join(self.path, '.dockerignore')
+        if not os.path.exists(dockerignore):
+            return []
+        with open(dockerignore) as f:
+            return [line for line in f.read().splitlines() if line]
+
+    def _members(self):
+        # only used to create tar headers
+        tar = tarfile.open(fileobj=io.BytesIO(), mode='w', format=tarfile.GNU_FORMAT)
+        paths = exclude_paths(self.path, self._exclude_patterns(), dockerfile=self.dockerfile)
+        for path in sorted(paths):
+            full_path = os.path.join(self.path, path)
+            tarinfo = tar.gettarinfo(full_path, arcname=path)
+            if tarinfo is None:
+                # sockets and other unsupported file types
+                continue
+            yield tarinfo.tobuf(tarfile.GNU_FORMAT, tar.encoding, tar.errors)
+            if not tarinfo.isreg():
+                continue
+            remaining = tarinfo.size
+            with open(full_path, 'rb') as f:
+                while remaining:
+                    block = f.read(min(self.block_size, remaining))
+                    if not block:
+                        raise IOError("file '%s' changed while adding to build context" %
+                                      full_path)
+                    remaining -= len(block)
+                    self.content_size += len(block)
+                    yield block
+            padding = -tarinfo.size % tarfile.BLOCKSIZE
+            if padding:
+                yield tarfile.NUL * padding
+        # end of archive
+        yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+    def __iter__(self):
+        logger.info("streaming build context '%s'", self.path)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if self.gzip else None
+        for data in self._members():
+            if compressor:
+                data = compressor.compress(data)
+                if not data:
+                    continue
+            self.size += len(data)
+            yield data
+        if compressor:
+            data = compressor.flush()
+            self.size += len(data)
+            yield data
+        logger.info("build context sent: %d bytes of files, %d bytes of archive",
+                    self.content_size, self.size)
+
+
 def get_checksums(path, algorithms):
     """
     Compute a checksum(s) of given file using specified algorithms.
 
+    Checksums already computed for the file in its current state are reused,
+    others are computed in a single pass over the file.
+
     :param path: path to file
-    :param algorithms: list of cryptographic hash functions, currently supported: md5, sha256
-    :return: dictionary
+    :param algorithms: list of cryptographic hash functions, e.g. md5, sha256
+    :return: dictionary, '<algorithm>sum' -> hexdigest
     """
     if not algorithms:
         return {}
 
-    compute_md5 = 'md5' in algorithms
-    compute_sha256 = 'sha256' in algorithms
-
-    if compute_md5:
-        md5 = hashlib.md5()
-    if compute_sha256:
-        sha256 = hashlib.sha256()
-    blocksize = 65536
-    with open(path, mode='rb') as f:
-        buf = f.read(blocksize)
-        while len(buf) > 0:
-            if compute_md5:
-                md5.update(buf)
-            if compute_sha256:
-                sha256.update(buf)
-            buf = f.read(blocksize)
+    known = checksum_cache.get(path)
+    missing = [algorithm for algorithm in algorithms if algorithm not in known]
+    if missing:
+        computed = compute_checksums(path, missing)
+        checksum_cache.store(path, computed)
+        known.update(computed)
+    else:
+        logger.debug('reusing checksums of %s', path)
 
     checksums = {}
-    if compute_md5:
-        checksums['md5sum'] = md5.hexdigest()
-        logger.debug('md5sum: %s', checksums['md5sum'])
-    if compute_sha256:
-        checksums['sha256sum'] = sha256.hexdigest()
-        logger.debug('sha256sum: %s', checksums['sha256sum'])
+    for algorithm in algorithms:
+        key = '{}sum'.format(algorithm)
+        checksums[key] = known[algorithm]
+        logger.debug('%s: %s', key, checksums[key])
     return checksums
 
 
@@ -697,18 +1525,92 @@ class RegistrySession(object):
 
         self.session = get_retrying_requests_session()
 
+        # repository -> (token, expiration time)
+        self._tokens = {}
+        self._tokens_lock = threading.Lock()
+
+    @staticmethod
+    def _repository(relative_url):
+        match = re.match(r'/v2/(.+)/(manifests|blobs|tags)/', relative_url)
+        return match.group(1) if match else None
+
+    def _cached_token(self, repository):
+        with self._tokens_lock:
+            token, expires = self._tokens.get(repository, (None, 0))
+        if token and time.time() < expires:
+            return token
+        return None
+
+    def _fetch_token(self, challenge, repository):
+        """
+        get bearer token as requested by WWW-Authenticate header of 401 response
+
+        :param challenge: str, value of WWW-Authenticate header
+        :param repository: str, repository the token is cached for
+        :return: str, token or None when the challenge is not for bearer token
+        """
+        if not challenge.lower().startswith('bearer '):
+            return None
+
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        realm = params.pop('realm', None)
+        if not realm:
+            return None
+
+        logger.debug('requesting bearer token from %s for %s', realm, params.get('scope'))
+        response = self.session.get(realm, params=params, auth=self.auth,
+                                    verify=not self.insecure)
+        response.raise_for_status()
+        token_json = response.json()
+        token = token_json.get('token') or token_json.get('access_token')
+        if not token:
+            return None
+
+        # don't use token which may expire while the request is in flight
+        expires_in = int(token_json.get('expires_in', REGISTRY_TOKEN_DEFAULT_EXPIRATION))
+        expires = time.time() + expires_in - REGISTRY_TOKEN_EXPIRATION_MARGIN
+        if repository:
+            with self._tokens_lock:
+                self._tokens[repository] = (token, expires)
+        return token
+
+    def _request(self, f, url, token=None, **kwargs):
+        if token:
+            headers = dict(kwargs.get('headers') or {})
+            headers['Authorization'] = 'Bearer {}'.format(token)
+            kwargs['headers'] = headers
+            kwargs['auth'] = None
+        else:
+            kwargs['auth'] = self.auth
+        return f(url, **kwargs)
+
+    def _do_authenticated(self, f, url, relative_url, **kwargs):
+        repository = self._repository(relative_url)
+        token = self._cached_token(repository) if repository else None
+        res = self._request(f, url, token=token, **kwargs)
+        if res.status_code == requests.codes.unauthorized:
+            # registry uses token authentication, or cached token has
+            # insufficient scope
+            challenge = res.headers.get('WWW-Authenticate', '')
+            token = self._fetch_token(challenge, repository)
+            if token:
+                # release pooled connection of the rejected (maybe streamed) request
+                res.close()
+                res = self._request(f, url, token=token, **kwargs)
+        return res
+
     def _do(self, f, relative_url, *args, **kwargs):
-        kwargs['auth'] = self.auth
         kwargs['verify'] = not self.insecure
         if self._fallback:
             try:
-                res = f(self._base + relative_url, *args, **kwargs)
+                res = self._do_authenticated(f, self._base + relative_url, relative_url,
+                                             **kwargs)
                 self._fallback = None  # don't fallback after one success
                 return res
             except (SSLError, ConnectionError):
                 self._base = self._fallback
                 self._fallback = None
-        return f(self._base + relative_url, *args, **kwargs)
+        return self._do_authenticated(f, self._base + relative_url, relative_url, **kwargs)
 
     def get(self, relative_url, data=None, **kwargs):
         return self._do(self.session.get, relative_url, **kwargs)
@@ -726,6 +1628,230 @@ class RegistrySession(object):
         return self._do(self.session.delete, relative_url, **kwargs)
 
 
+class RegistrySessionPool(object):
+    """
+    RegistrySession objects shared in this process
+
+    Sessions are identified by registry, insecure flag and credentials, so
+    connections, resolved http/https fallback and bearer tokens are reused
+    by everything talking to the same registry.
+    """
+
+    def __init__(self):
+        # (registry, insecure, dockercfg path, dockercfg mtime) -> RegistrySession
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(registry, insecure, dockercfg_path):
+        dockercfg_mtime = None
+        if dockercfg_path:
+            try:
+                dockercfg_mtime = os.stat(os.path.join(dockercfg_path, '.dockercfg')).st_mtime
+            except OSError:
+                # let RegistrySession report the problem
+                pass
+        return (registry, insecure, dockercfg_path, dockercfg_mtime)
+
+    def get(self, registry, insecure=False, dockercfg_path=None):
+        """
+        :param registry: str, URI for registry
+        :param insecure: bool, when True registry's cert is not verified
+        :param dockercfg_path: str, dirname of .dockercfg location
+        :return: RegistrySession instance
+        """
+        key = self._key(registry, insecure, dockercfg_path)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = RegistrySession(registry, insecure=insecure,
+                                          dockercfg_path=dockercfg_path)
+                self._sessions[key] = session
+            return session
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+
+registry_session_pool = RegistrySessionPool()
+
+
+class ManifestCache(object):
+    """
+    manifests and blobs downloaded from registries, addressed by digest
+
+    Content addressed by digest never changes, so it is kept in memory (and
+    on disk, once a directory is set) to be reused by later requests. Both
+    stores drop least recently used content once they exceed their size limit.
+    """
+
+    def __init__(self, directory=None, max_memory=MANIFEST_CACHE_MEMORY_SIZE,
+                 max_disk=MANIFEST_CACHE_DISK_SIZE):
+        """
+        :param directory: str, directory for on-disk cache, not used when None
+        :param max_memory: int, max number of bytes kept in memory
+        :param max_disk: int, max number of bytes kept in directory
+        """
+        self.directory = directory
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        # key -> (content, content type)
+        self._entries = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(registry, repository, digest, media_type):
+        return (registry_hostname(registry), repository, digest, media_type)
+
+    def _disk_path(self, key):
+        name = hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def _remember(self, key, entry):
+        if key in self._entries:
+            self._memory_size -= len(self._entries.pop(key)[0])
+        self._entries[key] = entry
+        self._memory_size += len(entry[0])
+        while self._memory_size > self.max_memory and self._entries:
+            _, (content, _) = self._entries.popitem(last=False)
+            self._memory_size -= len(content)
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                content_type, content = f.read().split(b'\n', 1)
+            # mark as recently used
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return content, content_type.decode('utf-8')
+
+    def _write_disk(self, key, entry):
+        content, content_type = entry
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = self._disk_path(key)
+        # readers never see partially written file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content_type.encode('utf-8') + b'\n' + content)
+        os.rename(tmp_path, path)
+
+        files = []
+        for name in os.listdir(self.directory):
+            file_path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, file_path))
+        total = sum(size for _, size, _ in files)
+        for _, size, file_path in sorted(files):
+            if total <= self.max_disk:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+            total -= size
+
+    def get(self, registry, repository, digest, media_type):
+        """
+        :param registry: str, registry the content was downloaded from
+        :param repository: str, repository the content was downloaded from
+        :param digest: str, digest of the content
+        :param media_type: str, media type the content was requested as
+        :return: tuple, (content, content type) or None when not cached
+        """
+        key = self._key(registry, repository, digest, media_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                # mark as recently used
+                self._remember(key, entry)
+                return entry
+
+            if self.directory:
+                entry = self._read_disk(key)
+                if entry is not None:
+                    self._remember(key, entry)
+            return entry
+
+    def store(self, registry, repository, digest, media_type, content, content_type):
+        """
+        remember content addressed by digest
+
+        :param registry: str, registry the content was downloaded from
+        :param repository: str, repository the content was downloaded from
+        :param digest: str, digest of the content
+        :param media_type: str, media type the content was requested as
+        :param content: bytes, the content
+        :param content_type: str, media type of the content
+        """
+        key = self._key(registry, repository, digest, media_type)
+        entry = (content, content_type or '')
+        with self._lock:
+            self._remember(key, entry)
+            if self.directory:
+                try:
+                    self._write_disk(key, entry)
+                except (IOError, OSError):
+                    logger.warning('failed to store %s in manifest cache %s', digest,
+                                   self.directory, exc_info=True)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._memory_size = 0
+
+
+manifest_cache = ManifestCache()
+
+
+def is_digest(reference):
+    """
+    :param reference: str, tag or digest
+    :return: bool, whether reference is a digest
+    """
+    return bool(reference) and ':' in reference
+
+
+def cached_response(url, content, content_type, digest):
+    """
+    response to registry request answered from manifest_cache
+
+    :return: requests.Response
+    """
+    response = requests.Response()
+    response.status_code = requests.codes.ok
+    response.url = url
+    response._content = content
+    response.headers['Content-Type'] = content_type
+    response.headers['Content-Length'] = str(len(content))
+    response.headers['Docker-Content-Digest'] = digest
+    return response
+
+
+def cache_response(registry, repository, digest, media_type, response):
+    """
+    store content of successful response to registry request in manifest_cache
+
+    :param registry: str, registry the response came from
+    :param repository: str, repository the response came from
+    :param digest: str, digest the content was requested by
+    :param media_type: str, media type the content was requested as
+    :param response: requests.Response
+    """
+    content = response.content
+    if response.status_code != requests.codes.ok or not isinstance(content, bytes):
+        return
+    manifest_cache.store(registry, repository, digest, media_type, content,
+                         response.headers.get('Content-Type'))
+
+
 class ManifestDigest(dict):
     """Wrapper for digests for a docker manifest."""
 
@@ -785,7 +1911,8 @@ def get_digests_map_from_annotations(digests_str):
     return digests
 
 
-def query_registry(registry_session, image, digest=None, version='v1', is_blob=False):
+def query_registry(registry_session, image, digest=None, version='v1', is_blob=False,
+                   method='get'):
     """Return manifest digest for image.
 
     :param registry_session: RegistrySession
@@ -793,6 +1920,7 @@ def query_registry(registry_session, image, digest=None, version='v1', is_blob=F
     :param digest: str, digest of the image manifest
     :param version: str, which manifest schema version to fetch digest
     :param is_blob: bool, read blob config if set to True
+    :param method: str, 'get' or 'head'
 
     :return: requests.Response object
     """
@@ -807,12 +1935,54 @@ def query_registry(registry_session, image, digest=None, version='v1', is_blob=F
     url = '/v2/{}/{}/{}'.format(context, object_type, reference)
     logger.debug("query_registry: querying {}, headers: {}".format(url, headers))
 
+    if method == 'head':
+        response = registry_session.head(url, headers=headers, allow_redirects=True)
+        response.raise_for_status()
+        return response
+
+    # content addressed by digest never changes, tags are always looked up
+    if digest:
+        media_type = None if is_blob else headers['Accept']
+        cached = manifest_cache.get(registry_session.registry, context, digest, media_type)
+        if cached is not None:
+            logger.debug("query_registry: %s found in cache", url)
+            content, content_type = cached
+            return cached_response(url, content, content_type, digest)
+
     response = registry_session.get(url, headers=headers)
     response.raise_for_status()
 
+    if digest:
+        cache_response(registry_session.registry, context, digest, media_type, response)
+
     return response
 
 
+def _probe_manifest(registry_session, image, version):
+    """
+    query registry for manifest of image in given schema version
+
+    HEAD request is enough when the registry reports the media type in
+    Content-Type header, manifest body is only downloaded to guess it.
+
+    :return: tuple, (requests.Response, None) or (None, exception raised by the request)
+    """
+    try:
+        try:
+            response = query_registry(registry_session, image, version=version, method='head')
+        except HTTPError as ex:
+            if ex.response.status_code != requests.codes.method_not_allowed:
+                raise
+            response = None
+
+        if response is None or not response.headers.get('Content-Type'):
+            response = query_registry(registry_session, image, version=version)
+    except (HTTPError, RetryError, Timeout) as ex:
+        return None, ex
+
+    return response, None
+
+
 def get_manifest_digests(image, registry, insecure=False, dockercfg_path=None,
                          versions=('v1', 'v2', 'v2_list', 'oci', 'oci_index'), require_digest=True):
     """Return manifest digest for image.
@@ -829,7 +1999,8 @@ def get_manifest_digests(image, registry, insecure=False, dockercfg_path=None,
     :return: dict, versions mapped to their digest
     """
 
-    registry_session = RegistrySession(registry, insecure=insecure, dockercfg_path=dockercfg_path)
+    registry_session = registry_session_pool.get(registry, insecure=insecure,
+                                                 dockercfg_path=dockercfg_path)
 
     digests = {}
     # If all of the media types return a 404 NOT_FOUND status, then we rethrow
@@ -838,16 +2009,35 @@ def get_manifest_digests(image, registry, insecure=False, dockercfg_path=None,
     # This is interesting for the Pulp "retry until the manifest shows up" case.
     all_not_found = True
     saved_not_found = None
-    for version in versions:
+    # first request resolves http/https fallback and authentication for the
+    # others, which are then sent concurrently
+    probes = [None] * len(versions)
+    errors = []
+
+    def probe(index):
+        try:
+            probes[index] = _probe_manifest(registry_session, image, versions[index])
+        except Exception as ex:
+            errors.append(ex)
+
+    if versions:
+        probes[0] = _probe_manifest(registry_session, image, versions[0])
+    threads = [threading.Thread(target=trace.bind(probe), args=(index,))
+               for index in range(1, len(versions))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    for version, (response, ex) in zip(versions, probes):
         media_type = get_manifest_media_type(version)
         headers = {'Accept': media_type}
 
-        try:
-            response = query_registry(
-                registry_session, image, digest=None,
-                version=version)
+        if ex is None:
             all_not_found = False
-        except (HTTPError, RetryError, Timeout) as ex:
+        else:
             if ex.response.status_code == requests.codes.not_found:
                 saved_not_found = ex
             else:
@@ -869,7 +2059,7 @@ def get_manifest_digests(image, registry, insecure=False, dockercfg_path=None,
                   ex.response.status_code == requests.codes.not_acceptable):
                 continue
             else:
-                raise
+                raise ex
 
         received_media_type = None
         try:
@@ -937,7 +2127,8 @@ def get_config_from_registry(image, registry, digest, insecure=False,
 
     :return: dict, versions mapped to their digest
     """
-    registry_session = RegistrySession(registry, insecure=insecure, dockercfg_path=dockercfg_path)
+    registry_session = registry_session_pool.get(registry, insecure=insecure,
+                                                 dockercfg_path=dockercfg_path)
 
     response = query_registry(
         registry_session, image, digest=digest, version=version)
@@ -958,6 +2149,97 @@ def get_config_from_registry(image, registry, digest, insecure=False,
     return blob_config
 
 
+class SharedDockerfileParser(DockerfileParser):
+    """
+    DockerfileParser shared by all users of a Dockerfile in workflow
+
+    Content is cached and parsed only once after every change. Edits are
+    still written to the file straight away, so tools reading it directly
+    always see the current Dockerfile.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs['cache_content'] = True
+        super(SharedDockerfileParser, self).__init__(*args, **kwargs)
+        self._structure = None
+        self._structure_content = None
+
+    @property
+    def structure(self):
+        content = self.content
+        # content setters replace cached_content, a new object means a new parse
+        if self._structure is None or content is not self._structure_content:
+            self._structure = DockerfileParser.structure.fget(self)
+            self._structure_content = content
+        return [dict(instruction) for instruction in self._structure]
+
+
+class DockerfileParserCache(object):
+    """
+    parsed Dockerfiles of a workflow
+
+    Parser is created again once the file is written by anything else than
+    the parser itself, or once parent environment changes.
+    """
+
+    # file modified this many seconds before it was looked at may still be
+    # modified with no change in its timestamp
+    RACY_INTERVAL = 1
+
+    def __init__(self):
+        # (path, env_replace) -> (parser, parent env, file key, time of check)
+        self._parsers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _file_key(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+    def _is_current(self, parser, file_key, checked):
+        current_key = self._file_key(parser.dockerfile_path)
+        if current_key is not None and current_key == file_key:
+            if current_key[3] < checked - self.RACY_INTERVAL:
+                return True
+
+        # parser itself wrote the file or its timestamp can't be trusted
+        try:
+            with open(parser.dockerfile_path, 'rb') as f:
+                content = f.read().decode('utf-8')
+        except (IOError, OSError):
+            return False
+        return content == parser.content
+
+    def get(self, df_path, env_replace=True, parent_env=None):
+        """
+        :param df_path: str, path to Dockerfile or directory with it
+        :param env_replace: bool, replace ENV declarations when evaluating Dockerfile
+        :param parent_env: dict, ENV inherited from parent image
+        :return: SharedDockerfileParser instance
+        """
+        parent_env = dict(parent_env or {})
+        if not df_path.endswith(DOCKERFILE_FILENAME):
+            df_path = os.path.join(df_path, DOCKERFILE_FILENAME)
+        key = (os.path.abspath(df_path), env_replace)
+        with self._lock:
+            entry = self._parsers.get(key)
+            if entry is not None:
+                parser, env, file_key, checked = entry
+                if env == parent_env and self._is_current(parser, file_key, checked):
+                    self._parsers[key] = (parser, env, self._file_key(parser.dockerfile_path),
+                                          time.time())
+                    return parser
+
+            parser = SharedDockerfileParser(df_path, env_replace=env_replace,
+                                            parent_env=dict(parent_env))
+            self._parsers[key] = (parser, parent_env, self._file_key(parser.dockerfile_path),
+                                  time.time())
+            return parser
+
+
 def df_parser(df_path, workflow=None, cache_content=False, env_replace=True, parent_env=None):
     """
     Wrapper for dockerfile_parse's DockerfileParser that takes into account
@@ -969,6 +2251,9 @@ def df_parser(df_path, workflow=None, cache_content=False, env_replace=True, par
     :param env_replace: bool, replace ENV declarations as part of DockerfileParser evaluation
     :param parent_env: dict, parent ENV key:value pairs to be inherited
 
+    When workflow is given, parser shared by all its users is returned, see
+    DockerfileParserCache.
+
     :return: DockerfileParser object instance
     """
 
@@ -1006,6 +2291,10 @@ def df_parser(df_path, workflow=None, cache_content=False, env_replace=True, par
             except KeyError:
                 logger.debug("Parent Environment not found, not applied to Dockerfile")
 
+    parser_cache = getattr(workflow, 'df_parser_cache', None)
+    if isinstance(parser_cache, DockerfileParserCache):
+        return parser_cache.get(df_path, env_replace=env_replace, parent_env=p_env)
+
     try:
         dfparser = DockerfileParser(
             df_path,
@@ -1037,30 +2326,64 @@ def are_plugins_in_order(plugins_conf, *plugins_names):
     return True
 
 
-def read_yaml(yaml_file_path, schema):
-    with open(yaml_file_path) as f:
-        data = yaml.safe_load(f)
+# schema path -> validator of JSON schemas shipped with atomic_reactor
+_schema_validators = {}
+
+
+def get_schema_validator(schema):
+    """
+    load JSON schema and create validator for it
+
+    Validators are cached, so every schema is read and checked at most once
+    per process.
 
+    :param schema: str, path to schema, relative to atomic_reactor package
+    :return: jsonschema.Draft4Validator instance
+    """
     try:
-        resource = resource_stream('atomic_reactor', schema)
-        schema = codecs.getreader('utf-8')(resource)
+        return _schema_validators[schema]
+    except KeyError:
+        pass
+
+    # both are slow to import and only needed when validating
+    import jsonschema
+    import pkg_resources
+
+    try:
+        resource = pkg_resources.resource_stream('atomic_reactor', schema)
+        schema_reader = codecs.getreader('utf-8')(resource)
     except (IOError, TypeError):
         logger.error('unable to extract JSON schema, cannot validate')
         raise
 
     try:
-        schema = json.load(schema)
+        schema_json = json.load(schema_reader)
     except ValueError:
         logger.error('unable to decode JSON schema, cannot validate')
         raise
+    finally:
+        resource.close()
 
-    validator = jsonschema.Draft4Validator(schema=schema)
     try:
-        jsonschema.Draft4Validator.check_schema(schema)
-        validator.validate(data)
+        jsonschema.Draft4Validator.check_schema(schema_json)
     except jsonschema.SchemaError:
         logger.error('invalid schema, cannot validate')
         raise
+
+    validator = jsonschema.Draft4Validator(schema=schema_json)
+    _schema_validators[schema] = validator
+    return validator
+
+
+def read_yaml(yaml_file_path, schema):
+    import jsonschema
+
+    with open(yaml_file_path) as f:
+        data = yaml.safe_load(f)
+
+    validator = get_schema_validator(schema)
+    try:
+        validator.validate(data)
     except jsonschema.ValidationError:
         for error in validator.iter_errors(data):
             path = ''
@@ -1097,9 +2420,26 @@ class SessionWithTimeout(requests.Session):
     def __init__(self, *args, **kwargs):
         super(SessionWithTimeout, self).__init__(*args, **kwargs)
 
-    def request(self, *args, **kwargs):
+    def request(self, method, url, *args, **kwargs):
         kwargs.setdefault('timeout', HTTP_REQUEST_TIMEOUT)
-        return super(SessionWithTimeout, self).request(*args, **kwargs)
+        # don't record query, it may contain credentials
+        span_name = '{} {}'.format(method, url.split('?', 1)[0])
+        with trace.span(span_name, 'http') as http_span:
+            response = super(SessionWithTimeout, self).request(method, url, *args, **kwargs)
+            self._record_response(http_span, response)
+            return response
+
+    def _record_response(self, http_span, response):
+        http_span.args['status'] = getattr(response, 'status_code', None)
+
+        body = getattr(getattr(response, 'request', None), 'body', None)
+        if isinstance(body, (bytes, six.text_type)):
+            http_span.args['bytes_sent'] = len(body)
+
+        headers = getattr(response, 'headers', None) or {}
+        content_length = headers.get('Content-Length')
+        if content_length is not None and content_length.isdigit():
+            http_span.args['bytes_received'] = int(content_length)
 
 
 def get_retrying_requests_session(client_statuses=HTTP_CLIENT_STATUS_RETRY,
@@ -0,0 +1,26 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import pytest
+
+from atomic_reactor.util import registry_session_pool, manifest_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_registry_caches():
+    # sessions remember http/https fallback and tokens and mocked registries
+    # serve different content under the same digest, don't share them among tests
+    registry_session_pool.clear()
+    manifest_cache.clear()
+    manifest_cache.directory = None
+    yield
+    registry_session_pool.clear()
+    manifest_cache.clear()
+    manifest_cache.directory = None
@@ -105,6 +105,42 @@ def test_add_help_plugin(tmpdir, docker_tasker, filename):
         CMD blabla""" % (AddHelpPlugin.man_filename, AddHelpPlugin.man_filename))
 
 
+@pytest.mark.parametrize('filename', ['help.md', 'other_file.md'])  # noqa
+def test_add_help_hardlinked_files(tmpdir, docker_tasker, filename):
+    source_dir = tmpdir.mkdir('source')
+    build_dir = tmpdir.mkdir('build')
+    df = df_parser(str(build_dir))
+    df.content = "FROM fedora\nCMD blabla"
+
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image')
+    workflow.builder = X
+    workflow.builder.df_path = df.dockerfile_path
+    workflow.builder.df_dir = str(build_dir)
+
+    # build directory of path source with copy_method hardlink
+    for name, content in ((filename, "foo"), (AddHelpPlugin.man_filename, "bar")):
+        generate_a_file(str(source_dir.join(name)), content)
+        os.link(str(source_dir.join(name)), str(build_dir.join(name)))
+
+    flexmock(subprocess).should_receive("Popen").once().replace_with(MockedPopen)
+
+    runner = PreBuildPluginsRunner(
+        docker_tasker,
+        workflow,
+        [{
+            'name': AddHelpPlugin.key,
+            'args': {'help_file': filename}
+        }]
+    )
+    runner.run()
+
+    assert build_dir.join(filename).read().startswith('% ')
+    assert source_dir.join(filename).read() == "foo"
+    assert source_dir.join(AddHelpPlugin.man_filename).read() == "bar"
+    for name in (filename, AddHelpPlugin.man_filename):
+        assert not os.path.samefile(str(source_dir.join(name)), str(build_dir.join(name)))
+
+
 @pytest.mark.parametrize('filename', ['help.md', 'other_file.md'])  # noqa
 def test_add_help_no_help_file(request, tmpdir, docker_tasker, filename):
     df_content = "FROM fedora"
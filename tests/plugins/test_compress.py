@@ -1,3 +1,5 @@
+import gzip
+import io
 import os
 import tarfile
 
@@ -9,7 +11,7 @@ from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.plugin import PostBuildPluginsRunner
 from atomic_reactor.plugins.post_compress import CompressPlugin
-from atomic_reactor.util import ImageName
+from atomic_reactor.util import ImageName, lzma, zstandard
 
 from tests.constants import INPUT_IMAGE, MOCK
 
@@ -38,8 +40,13 @@ class TestCompress(object):
         ('gzip', False, 'gz'),
         ('lzma', False, 'xz'),
         ('gzip', True, 'gz'),
+        pytest.param('zstd', False, 'zst',
+                     marks=pytest.mark.skipif(zstandard is None, reason='zstandard not installed')),
+        pytest.param('zstd', True, 'zst',
+                     marks=pytest.mark.skipif(zstandard is None, reason='zstandard not installed')),
     ])
-    def test_compress(self, tmpdir, caplog, method, load_exported_image, extension):
+    @pytest.mark.parametrize('threads', [None, 4])
+    def test_compress(self, tmpdir, caplog, method, load_exported_image, extension, threads):
         if MOCK:
             mock_docker()
 
@@ -53,15 +60,18 @@ class TestCompress(object):
             workflow.exported_image_sequence.append({'path': exp_img,
                                                      'type': IMAGE_TYPE_DOCKER_ARCHIVE})
 
+        args = {
+            'method': method,
+            'load_exported_image': load_exported_image,
+        }
+        if threads:
+            args['threads'] = threads
         runner = PostBuildPluginsRunner(
             tasker,
             workflow,
             [{
                 'name': CompressPlugin.key,
-                'args': {
-                    'method': method,
-                    'load_exported_image': load_exported_image,
-                },
+                'args': args,
             }]
         )
 
@@ -77,3 +87,34 @@ class TestCompress(object):
         assert 'uncompressed_size' in metadata
         assert isinstance(metadata['uncompressed_size'], integer_types)
         assert ", ratio: " in caplog.text()
+
+        if method == 'zstd':
+            with open(compressed_img, 'rb') as f:
+                data = zstandard.ZstdDecompressor().stream_reader(f).read()
+        else:
+            open_compressed = gzip.open if method == 'gzip' else lzma.open
+            with open_compressed(compressed_img) as f:
+                data = f.read()
+        assert len(data) == metadata['uncompressed_size']
+
+    @pytest.mark.parametrize('threads', [1, 4])
+    def test_compress_level_zero(self, threads):
+        workflow = DockerBuildWorkflow({'provider': 'git', 'uri': 'asd'}, 'test-image')
+        workflow.builder = X()
+        plugin = CompressPlugin(None, workflow, threads=threads, level=0)
+        data = b'a' * 1024**2
+
+        outfile = plugin._compress_image_stream(io.BytesIO(data))
+
+        # stored, not compressed
+        assert os.path.getsize(outfile) > len(data)
+        with gzip.open(outfile) as f:
+            assert f.read() == data
+
+    def test_zstd_unavailable(self, monkeypatch):
+        monkeypatch.setattr('atomic_reactor.plugins.post_compress.zstandard', None)
+        workflow = DockerBuildWorkflow({'provider': 'git', 'uri': 'asd'}, 'test-image')
+        workflow.builder = X()
+        plugin = CompressPlugin(None, workflow, method='zstd')
+        with pytest.raises(RuntimeError):
+            plugin._compress_image_stream(None)
@@ -256,3 +256,47 @@ def test_delete_from_registry_failures(tmpdir, status_code):
             assert result[DeleteFromRegistryPlugin.key] == deleted_digests
         else:
             assert result[DeleteFromRegistryPlugin.key] == set([])
+
+
+def test_delete_from_registry_failure_in_one_registry(tmpdir):
+    if MOCK:
+        mock_docker()
+        mock_get_retry_session()
+
+    tasker = DockerTasker()
+    workflow = DockerBuildWorkflow({"provider": "git", "uri": "asd"}, TEST_IMAGE)
+    setattr(workflow, 'builder', X)
+
+    saved_digests = {
+        DOCKER0_REGISTRY: {'foo/bar:latest': DIGEST1, 'foo/bar:1.0': DIGEST2},
+        LOCALHOST_REGISTRY: {'foo/bar:latest': DIGEST1, 'foo/bar:1.0': DIGEST2},
+    }
+    for reg, digests in saved_digests.items():
+        r = DockerRegistry(reg)
+        for tag, dig in digests.items():
+            r.digests[tag] = ManifestDigest(v1='not-used', v2=dig)
+        workflow.push_conf._registries['docker'].append(r)
+
+    for reg, digests in saved_digests.items():
+        for tag, dig in digests.items():
+            url = "https://" + reg + "/v2/" + tag.split(":")[0] + "/manifests/" + dig
+            response = requests.Response()
+            expectation = (flexmock(requests.Session)
+                           .should_receive('delete')
+                           .with_args(url, verify=bool, auth=None)
+                           .and_return(response))
+            if reg == DOCKER0_REGISTRY:
+                response.status_code = 520
+            else:
+                # same digest is deleted from every registry
+                response.status_code = requests.codes.ACCEPTED
+                expectation.once()
+
+    plugin = DeleteFromRegistryPlugin(tasker, workflow,
+                                      {reg: {} for reg in saved_digests},
+                                      registry_workers=2, delete_workers=2)
+    with pytest.raises(PluginFailedException):
+        plugin.run()
+
+    # registry where deleting succeeded is done
+    assert [r.uri for r in workflow.push_conf.docker_registries] == [DOCKER0_REGISTRY]
@@ -31,7 +31,7 @@ except ImportError:
     import koji as koji
 
 from atomic_reactor.inner import DockerBuildWorkflow
-from atomic_reactor.plugin import PreBuildPluginsRunner, PluginFailedException
+from atomic_reactor.plugin import PreBuildPlugin, PreBuildPluginsRunner, PluginFailedException
 from atomic_reactor.plugins.pre_fetch_maven_artifacts import FetchMavenArtifactsPlugin
 from atomic_reactor.util import ImageName
 from tests.constants import MOCK_SOURCE, MOCK
@@ -767,3 +767,19 @@ def test_fetch_maven_artifacts_url_allowed_domains(tmpdir, docker_tasker, domain
         for download in plugin_result:
             dest = os.path.join(str(tmpdir), FetchMavenArtifactsPlugin.DOWNLOAD_DIR, download.dest)
             assert os.path.exists(dest)
+
+
+def test_fetch_maven_artifacts_conflicts_with_build_dir_writers(tmpdir, docker_tasker):  # noqa
+    class BuildDirWriterPlugin(PreBuildPlugin):
+        key = 'build_dir_writer'
+        reads = ()
+        writes = ('df_dir',)
+
+    class FilesWriterPlugin(PreBuildPlugin):
+        key = 'files_writer'
+        reads = ()
+        writes = ('files',)
+
+    runner = PreBuildPluginsRunner(docker_tasker, mock_workflow(tmpdir), [])
+    assert runner._plugins_conflict(FetchMavenArtifactsPlugin, BuildDirWriterPlugin)
+    assert not runner._plugins_conflict(FetchMavenArtifactsPlugin, FilesWriterPlugin)
@@ -15,6 +15,7 @@ import responses
 from tempfile import mkdtemp
 import os
 import requests
+from flexmock import flexmock
 from six import binary_type, text_type
 
 from tests.constants import SOURCE, INPUT_IMAGE, MOCK, DOCKER0_REGISTRY
@@ -563,3 +564,85 @@ def test_group_manifests(tmpdir, test_name,
         with pytest.raises(PluginFailedException) as ex:
             runner.run()
         assert expected_exception in str(ex)
+
+
+@pytest.mark.parametrize('group', [True, False])
+@responses.activate  # noqa
+def test_group_manifests_links_blobs_once(tmpdir, group):
+    if MOCK:
+        mock_docker()
+
+    test_images = ['namespace/httpd:2.4', 'namespace/httpd:latest', 'other/httpd:1']
+    registry_conf = {REGISTRY_V2: {'version': 'v2', 'insecure': True}}
+    workers = {
+        'ppc64le': {REGISTRY_V2: ['worker-build:worker-build-ppc64le-latest']},
+        'x86_64': {REGISTRY_V2: ['worker-build:worker-build-x86_64-latest']},
+    }
+    mocked_registries, annotations = mock_registries(registry_conf, workers)
+    tasker, workflow = mock_environment(tmpdir, primary_images=test_images,
+                                        annotations=annotations)
+
+    plugin = GroupManifestsPlugin(tasker, workflow, registry_conf, group=group,
+                                  goarch={'x86_64': 'amd64'}, blob_workers=4)
+    plugin.run()
+
+    def requests_of(method, path):
+        return [call.request.url for call in responses.calls
+                if call.request.method == method and path in call.request.url]
+
+    platforms = 2 if group else 1
+    target_repos = 2
+    # every blob is checked once and mounted once into every target repository
+    mounts = requests_of('POST', '/blobs/uploads/')
+    assert len(mounts) == len(set(mounts)) == platforms * 2 * target_repos
+    heads = requests_of('HEAD', '/blobs/')
+    assert len(heads) == len(set(heads)) == platforms * 2
+
+    puts = requests_of('PUT', '/manifests/')
+    if group:
+        # platform manifests are stored once per repository, list once per tag
+        assert len(puts) == platforms * target_repos + len(workflow.tag_conf.images)
+    else:
+        assert len(puts) == len(workflow.tag_conf.images)
+
+    for image in test_images:
+        name, tag = image.split(':')
+        assert tag in mocked_registries[REGISTRY_V2].get_repo(name)['tags']
+
+
+@pytest.mark.parametrize('group', [True, False])
+def test_group_manifests_registries_concurrently(tmpdir, group):
+    registry_conf = {
+        REGISTRY_V2: {'version': 'v2', 'insecure': True},
+        OTHER_V2: {'version': 'v2', 'insecure': False},
+    }
+    workers = {
+        'x86_64': {
+            REGISTRY_V2: ['namespace/httpd:worker-build-x86_64-latest'],
+            OTHER_V2: ['namespace/httpd:worker-build-x86_64-latest'],
+        }
+    }
+    _, annotations = mock_registries(registry_conf, workers)
+    tasker, workflow = mock_environment(tmpdir, primary_images=['namespace/httpd:2.4'],
+                                        annotations=annotations)
+
+    processed = []
+
+    def process(session, worker_digests, push_conf_registry):
+        assert push_conf_registry.uri == session.registry
+        processed.append(session.registry)
+        raise RuntimeError('failed ' + session.registry)
+
+    method = 'group_manifests_and_tag' if group else 'tag_manifest_into_registry'
+    flexmock(GroupManifestsPlugin).should_receive(method).replace_with(process)
+
+    plugin = GroupManifestsPlugin(tasker, workflow, registry_conf, group=group,
+                                  goarch={'x86_64': 'amd64'}, registry_workers=2)
+    # every registry is processed, all failures are reported
+    with pytest.raises(RuntimeError) as exc:
+        plugin.run()
+    assert sorted(processed) == sorted(registry_conf)
+    for registry in registry_conf:
+        assert 'failed ' + registry in str(exc.value)
+    assert ([r.uri for r in workflow.push_conf.docker_registries] ==
+            list(plugin.sort_annotations()))
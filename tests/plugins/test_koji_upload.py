@@ -1049,6 +1049,44 @@ class TestKojiUpload(object):
 
         assert images[0].endswith(platform + ".tar.xz")
 
+    @pytest.mark.parametrize('missing', [False, True])
+    def test_koji_upload_profile_outputs(self, tmpdir, monkeypatch, os_env,
+                                         missing):
+        MockedOSBS()
+        session = MockedClientSession('')
+        tasker, workflow = mock_environment(tmpdir,
+                                            session=session,
+                                            name='name',
+                                            version='1.0',
+                                            release='1')
+        profile = tmpdir.join('plugin.pstats')
+        profile.write('profile')
+        workflow.profile_outputs = [str(profile)]
+        if missing:
+            workflow.profile_outputs.append(str(tmpdir.join('missing.pstats')))
+
+        runner = create_runner(tasker, workflow)
+
+        # plugins are loaded from their files, track what the loaded module opens
+        opened = []
+
+        def tracking_open(*args, **kwargs):
+            opened.append(open(*args, **kwargs))
+            return opened[-1]
+
+        module = sys.modules[runner.plugin_classes[KojiUploadPlugin.key].__module__]
+        monkeypatch.setattr(module, 'open', tracking_open, raising=False)
+
+        if missing:
+            with pytest.raises(PluginFailedException):
+                runner.run()
+        else:
+            runner.run()
+            assert 'x86_64-plugin.pstats' in session.uploaded_files
+
+        assert opened
+        assert all(f.closed for f in opened)
+
     @pytest.mark.parametrize('multiple', [False, True])
     def test_koji_upload_multiple_digests(self, tmpdir, os_env,
                                           multiple):
@@ -8,6 +8,7 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
+import io
 import os
 import sys
 
@@ -21,12 +22,11 @@ try:
         raise ImportError
 
     import dockpulp
+    from atomic_reactor.plugins import post_push_to_pulp
     from atomic_reactor.plugins.post_push_to_pulp import PulpPushPlugin
 except (ImportError):
     dockpulp = None
 
-import subprocess
-
 import pytest
 from flexmock import flexmock
 from tests.constants import INPUT_IMAGE, SOURCE, MOCK
@@ -110,8 +110,8 @@ def prepare(check_repo_retval=0, existing_layers=[],
          .with_args(list)
          .and_return(existing_layers))
     if subprocess_exceptions:
-        (flexmock(subprocess)
-         .should_receive("check_call")
+        (flexmock(post_push_to_pulp)
+         .should_receive("filter_tar")
          .and_raise(Exception))
 
     mock_docker()
@@ -123,8 +123,8 @@ def prepare(check_repo_retval=0, existing_layers=[],
 @pytest.mark.parametrize(("existing_layers", "should_raise", "subprocess_exceptions"), [
     (None, True, False),               # mock dockpulp without getImageIdsExist method
     ([], True, False),                 # this will trigger remove dedup layers and pass
-    (['no-such-layer'], True, False),  # no such layer - tar command will fail
-    ([], True, True),                  # all subprocess.check_call will fail
+    (['no-such-layer'], True, False),  # no such layer - repacking will fail
+    ([], True, True),                  # repacking tar will fail
 ])
 def test_pulp_dedup_layers(
         tmpdir, existing_layers, should_raise, monkeypatch, subprocess_exceptions):
@@ -154,6 +154,43 @@ def test_pulp_dedup_layers(
     assert top_layer == 'foo'
 
 
+@pytest.mark.skipif(dockpulp is None,
+                    reason='dockpulp module not available')
+def test_pulp_streams_image_from_docker(tmpdir, monkeypatch):
+    tasker, workflow = prepare()
+    monkeypatch.setenv('SOURCE_SECRET_PATH', str(tmpdir))
+    content = os.urandom(1024) * 1024
+
+    class Image(object):
+        def __init__(self):
+            self.fp = io.BytesIO(content)
+
+        @property
+        def data(self):
+            raise AssertionError('whole image must not be read at once')
+
+        def __enter__(self):
+            return self.fp
+
+        def __exit__(self, tp, val, tb):
+            self.fp.close()
+
+    flexmock(tasker.d).should_receive('get_image').and_return(Image())
+
+    def push_tar(plugin, filename, image_names):
+        with open(filename, 'rb') as f:
+            assert f.read() == content
+        return 'foo', []
+
+    monkeypatch.setattr(PulpPushPlugin, 'push_tar', push_tar)
+    runner = PostBuildPluginsRunner(tasker, workflow, [{
+        'name': PulpPushPlugin.key,
+        'args': {
+            'pulp_registry_name': 'test'
+        }}])
+    runner.run()
+
+
 @pytest.mark.skipif(dockpulp is None,
                     reason='dockpulp module not available')
 @pytest.mark.parametrize(("check_repo_retval", "should_raise"), [
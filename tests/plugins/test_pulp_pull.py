@@ -6,6 +6,11 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
+from collections import Counter
+
+from atomic_reactor.constants import (MEDIA_TYPE_DOCKER_V2_SCHEMA1, MEDIA_TYPE_DOCKER_V2_SCHEMA2,
+                                      MEDIA_TYPE_DOCKER_V2_MANIFEST_LIST, MEDIA_TYPE_OCI_V1,
+                                      MEDIA_TYPE_OCI_V1_INDEX)
 from atomic_reactor.plugin import PostBuildPlugin, ExitPlugin
 from atomic_reactor.plugins.post_pulp_pull import PulpPullPlugin
 from atomic_reactor.inner import TagConf, PushConf
@@ -214,6 +219,9 @@ class TestPostPulpPull(object):
         (flexmock(requests.Session)
             .should_receive('get')
             .replace_with(getter))
+        (flexmock(requests.Session)
+            .should_receive('head')
+            .replace_with(getter))
 
         if schema_version in ['v1', 'list.v2'] or broken_response:
             (flexmock(tasker)
@@ -277,10 +285,16 @@ class TestPostPulpPull(object):
             (flexmock(requests.Session)
                 .should_receive('get')
                 .replace_with(getter))
+            (flexmock(requests.Session)
+                .should_receive('head')
+                .replace_with(getter))
         else:
             (flexmock(requests.Session)
                 .should_receive('get')
                 .never())
+            (flexmock(requests.Session)
+                .should_receive('head')
+                .never())
 
         (flexmock(tasker)
             .should_call('pull_image')
@@ -324,21 +338,31 @@ class TestPostPulpPull(object):
 
         not_found = requests.Response()
         flexmock(not_found, status_code=requests.codes.not_found)
-        expectation = flexmock(requests.Session).should_receive('get')
-        # If pulp is returning a 404 for a manifest URL, we will get 5 requests
-        # (for v1, v2, list.v2, oci, and oci.index media types) before get_manifest_digests
-        # gives up, so we need to return 5 404's to equal one "failure".
-        for _ in range(5 * failures):
-            expectation = expectation.and_return(not_found)
-
-        expectation.and_return(self.config_response_config_v1)
-        if v2:
-            expectation.and_return(self.config_response_config_v2)
-        else:
-            expectation.and_return(self.config_response_config_v1)
-        expectation.and_return(self.config_response_config_v2_list)
-        # No OCI support in Pulp at the moment, will return a v1 response
-        expectation.and_return(self.config_response_config_v1)
+        responses = {
+            MEDIA_TYPE_DOCKER_V2_SCHEMA1: self.config_response_config_v1,
+            MEDIA_TYPE_DOCKER_V2_SCHEMA2: (self.config_response_config_v2 if v2
+                                           else self.config_response_config_v1),
+            MEDIA_TYPE_DOCKER_V2_MANIFEST_LIST: self.config_response_config_v2_list,
+            # No OCI support in Pulp at the moment, will return a v1 response
+            MEDIA_TYPE_OCI_V1: self.config_response_config_v1,
+            MEDIA_TYPE_OCI_V1_INDEX: self.config_response_config_v1,
+        }
+        requested = Counter()
+
+        # If pulp is returning a 404 for a manifest URL, we will get requests
+        # for all of v1, v2, list.v2, oci, and oci.index media types before
+        # get_manifest_digests gives up, so each of them has to fail to equal
+        # one "failure". Requests for media types are sent concurrently.
+        def custom_head(url, headers, **kwargs):
+            media_type = headers['Accept']
+            requested[media_type] += 1
+            if requested[media_type] <= failures:
+                return not_found
+            return responses[media_type]
+
+        (flexmock(requests.Session)
+            .should_receive('head')
+            .replace_with(custom_head))
 
         # A special case for retries - schema 2 manifest digest is expected,
         # but its never being sent - the test should fail on timeout
@@ -392,6 +416,7 @@ class TestPostPulpPull(object):
         tasker = MockerTasker()
         workflow.postbuild_plugins_conf = []
         flexmock(requests.Session).should_receive('get').never()
+        flexmock(requests.Session).should_receive('head').never()
         flexmock(tasker).should_receive('pull_image').never()
         flexmock(tasker).should_receive('inspect_image').never()
         plugin = PulpPullPlugin(tasker, workflow)
@@ -403,7 +428,7 @@ class TestPostPulpPull(object):
         tasker = MockerTasker()
         unauthorized = requests.Response()
         flexmock(unauthorized, status_code=requests.codes.unauthorized)
-        flexmock(requests.Session).should_receive('get').and_return(unauthorized)
+        flexmock(requests.Session).should_receive('head').and_return(unauthorized)
         workflow.postbuild_plugins_conf = []
         plugin = PulpPullPlugin(tasker, workflow)
         with pytest.raises(requests.exceptions.HTTPError):
@@ -416,14 +441,26 @@ class TestPostPulpPull(object):
         flexmock(forbidden,
                  status_code=requests.codes.forbidden,
                  request=requests.Request(url='https://crane.example.com'))
-        expectation = flexmock(requests.Session).should_receive('get')
-        expectation.and_return(forbidden)
-        expectation.and_return(self.config_response_config_v1)
-        expectation.and_return(self.config_response_config_v2)
-        expectation.and_return(self.config_response_config_v2_list)
-        # No OCI support in Pulp at the moment, will return a v1 response
-        expectation.and_return(self.config_response_config_v1)
-        expectation.and_return(self.config_response_config_v1)
+        responses = {
+            MEDIA_TYPE_DOCKER_V2_SCHEMA1: self.config_response_config_v1,
+            MEDIA_TYPE_DOCKER_V2_SCHEMA2: self.config_response_config_v2,
+            MEDIA_TYPE_DOCKER_V2_MANIFEST_LIST: self.config_response_config_v2_list,
+            # No OCI support in Pulp at the moment, will return a v1 response
+            MEDIA_TYPE_OCI_V1: self.config_response_config_v1,
+            MEDIA_TYPE_OCI_V1_INDEX: self.config_response_config_v1,
+        }
+        requests_sent = []
+
+        # the very first request is forbidden
+        def custom_head(url, headers, **kwargs):
+            requests_sent.append(headers['Accept'])
+            if len(requests_sent) == 1:
+                return forbidden
+            return responses[headers['Accept']]
+
+        (flexmock(requests.Session)
+            .should_receive('head')
+            .replace_with(custom_head))
         workflow.postbuild_plugins_conf = []
         plugin = PulpPullPlugin(tasker, workflow, timeout=0.1,
                                 retry_delay=0.06,
@@ -17,6 +17,7 @@ from textwrap import dedent
 import re
 import yaml
 
+from atomic_reactor import util
 from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.plugins.pre_reactor_config import (ReactorConfig,
@@ -61,11 +62,14 @@ class TestReactorConfigPlugin(object):
         with pytest.raises(Exception):
             plugin.run()
 
-    def test_no_schema_resource(self, tmpdir, caplog):
+    def test_no_schema_resource(self, tmpdir, caplog, monkeypatch):
         class FakeProvider(object):
             def get_resource_stream(self, pkg, rsc):
                 raise IOError
 
+        # schema must not be taken from cache of already loaded ones
+        monkeypatch.setattr(util, '_schema_validators', {})
+
         # pkg_resources.resource_stream() cannot be mocked directly
         # Instead mock the module-level function it calls.
         (flexmock(pkg_resources)
@@ -91,11 +95,14 @@ class TestReactorConfigPlugin(object):
         # Invalid schema
         '{"properties": {"any": null}}',
     ])
-    def test_invalid_schema_resource(self, tmpdir, caplog, schema):
+    def test_invalid_schema_resource(self, tmpdir, caplog, schema, monkeypatch):
         class FakeProvider(object):
             def get_resource_stream(self, pkg, rsc):
                 return io.BufferedReader(io.BytesIO(schema))
 
+        # schema must not be taken from cache of already loaded ones
+        monkeypatch.setattr(util, '_schema_validators', {})
+
         # pkg_resources.resource_stream() cannot be mocked directly
         # Instead mock the module-level function it calls.
         (flexmock(pkg_resources)
@@ -9,7 +9,8 @@ of the BSD license. See the LICENSE file for details.
 from __future__ import print_function, unicode_literals
 
 import pytest
-from atomic_reactor.constants import IMAGE_TYPE_OCI, IMAGE_TYPE_OCI_TAR
+from atomic_reactor.constants import (IMAGE_TYPE_DOCKER_ARCHIVE, IMAGE_TYPE_OCI,
+                                      IMAGE_TYPE_OCI_TAR)
 from atomic_reactor.core import DockerTasker
 from atomic_reactor.inner import DockerBuildWorkflow
 from atomic_reactor.plugin import PostBuildPluginsRunner, PluginFailedException
@@ -227,7 +228,16 @@ def test_tag_and_push_plugin(
     config_blob_response = requests.Response()
     (flexmock(config_blob_response, status_code=200, json=config_json))
 
+    manifest_put_response = requests.Response()
+    (flexmock(manifest_put_response, status_code=201))
+
     def custom_get(method, url, headers, **kwargs):
+        if method == 'PUT':
+            # other tags of pushed image
+            assert url == manifest_latest_url
+            assert headers['Content-Type'] == media_type
+            return manifest_put_response
+
         if url == manifest_latest_url:
             # For a manifest stored as v2 or v1, the docker registry defaults to
             # returning a v1 manifest if a v2 manifest is not explicitly requested
@@ -504,3 +514,98 @@ def test_tag_and_push_plugin_oci(
         assert workflow.push_conf.docker_registries[0].digests[TEST_IMAGE].oci == DIGEST_OCI
 
         assert workflow.push_conf.docker_registries[0].config is config_json
+
+
+@pytest.mark.parametrize(('image_type', 'oci_compression', 'expected_args'), [
+    (IMAGE_TYPE_OCI, None, []),
+    (IMAGE_TYPE_OCI, 'zstd', ['--dest-compress', '--dest-compress-format=zstd']),
+    # docker images can't have zstd layers
+    (IMAGE_TYPE_DOCKER_ARCHIVE, 'zstd', []),
+])
+def test_push_with_skopeo_compression(tmpdir, image_type, oci_compression, expected_args):
+    workflow = DockerBuildWorkflow({"provider": "git", "uri": "asd"}, TEST_IMAGE)
+    workflow.exported_image_sequence.append({'path': str(tmpdir), 'type': image_type,
+                                             'ref_name': 'latest'})
+    plugin = TagAndPushPlugin(None, workflow, {LOCALHOST_REGISTRY: {}},
+                              oci_compression=oci_compression)
+
+    def check_check_output(args, **kwargs):
+        assert args[:2] == ['skopeo', 'copy']
+        assert args[2:-2] == expected_args
+        return ''
+
+    (flexmock(subprocess)
+        .should_receive("check_output")
+        .once()
+        .replace_with(check_check_output))
+    plugin.push_with_skopeo(ImageName.parse(LOCALHOST_REGISTRY + '/' + TEST_IMAGE), False, None)
+
+
+@pytest.mark.parametrize('registry_workers', [1, 2])
+def test_tag_and_push_multiple_registries(registry_workers):
+    registries = ['registry1.example.com', 'registry2.example.com', 'registry3.example.com']
+    manifest = b'{"schemaVersion": 2, "config": {"digest": "sha256:config"}}'
+    media_type = 'application/vnd.docker.distribution.manifest.v2+json'
+
+    workflow = DockerBuildWorkflow({"provider": "git", "uri": "asd"}, TEST_IMAGE)
+    setattr(workflow, 'builder', X)
+    for image in ('foo:1', 'foo:2', 'foo:3', 'ns/bar:1'):
+        workflow.tag_conf.add_primary_image(image)
+    workflow.tag_conf.add_unique_image('ns/bar:2')
+
+    pushed = []
+    tasker = flexmock()
+    (tasker.should_receive('tag_and_push_image')
+     .replace_with(lambda image_id, image, **kwargs: pushed.append(image.to_str())))
+    puts = []
+
+    class Response(object):
+        status_code = 200
+        content = manifest
+
+        def __init__(self, url):
+            self.url = url
+            self.headers = {'Content-Type': media_type,
+                            'Docker-Content-Digest': 'sha256:' + url.split('/')[-3]}
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return json.loads(self.content.decode('utf-8'))
+
+    def custom_request(method, url, headers=None, data=None, **kwargs):
+        if method == 'PUT':
+            assert data == manifest
+            assert headers['Content-Type'] == media_type
+            puts.append(url)
+        elif headers and headers.get('Accept') != media_type:
+            response = requests.Response()
+            response.status_code = 404
+            return response
+        return Response(url)
+
+    mock_get_retry_session()
+    (flexmock(requests.Session)
+        .should_receive('request')
+        .replace_with(custom_request))
+
+    plugin = TagAndPushPlugin(tasker, workflow, {registry: {} for registry in registries},
+                              registry_workers=registry_workers)
+    output = plugin.run()
+
+    expected = [registry + '/' + image for registry in registries
+                for image in ('foo:1', 'foo:2', 'foo:3', 'ns/bar:1', 'ns/bar:2')]
+    assert [image.to_str() for image in output] == expected
+    # image is pushed once to every repository, other tags are set by manifest
+    assert sorted(pushed) == sorted(registry + '/' + image for registry in registries
+                                    for image in ('foo:1', 'ns/bar:1'))
+    assert sorted(puts) == sorted('https://{}/v2/{}/manifests/{}'.format(registry, repo, tag)
+                                  for registry in registries
+                                  for repo, tag in (('foo', '2'), ('foo', '3'), ('ns/bar', '2')))
+
+    assert [r.uri for r in workflow.push_conf.docker_registries] == registries
+    for registry in workflow.push_conf.docker_registries:
+        assert sorted(registry.digests) == ['foo:1', 'foo:2', 'foo:3', 'ns/bar:1', 'ns/bar:2']
+        assert registry.digests['foo:2'].v2 == 'sha256:foo'
+        assert registry.config == json.loads(manifest.decode('utf-8'))
@@ -0,0 +1,211 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import os
+
+import pytest
+from flexmock import flexmock
+
+from atomic_reactor.build import BuildResult
+from atomic_reactor.checkpoint import Checkpoint, PHASES
+from atomic_reactor.inner import PushConf, TagConf
+from atomic_reactor.util import ImageName
+
+
+class FakeSource(object):
+    provider = 'git'
+    uri = 'https://example.com/repo.git'
+    dockerfile_path = None
+    provider_params = {}
+    commit_id = 'abcdef'
+
+    def __init__(self, path):
+        self.path = path
+
+
+class FakeBuilder(object):
+    def __init__(self, df_path, image_exists=True):
+        self.tasker = flexmock(image_exists=lambda image_id: image_exists)
+        self.image_id = None
+        self.is_built = False
+        self.base_image = ImageName.parse('fedora:27')
+        self.df_path = df_path
+
+    def set_df_path(self, path):
+        self.df_path = path
+
+
+class FakeWorkflow(object):
+    def __init__(self, tmpdir, image_exists=True):
+        source_dir = tmpdir.join('source')
+        source_dir.ensure(dir=True)
+        df = source_dir.join('Dockerfile')
+        df.write('FROM fedora:27\n')
+
+        self.source = FakeSource(str(source_dir))
+        self.image = 'test-image'
+        self.builder = FakeBuilder(str(df), image_exists=image_exists)
+        for _, conf_attr in PHASES:
+            setattr(self, conf_attr, [{'name': 'plugin', 'args': {'arg': conf_attr}}])
+        self.prebuild_results = {}
+        self.buildstep_result = {}
+        self.prepub_results = {}
+        self.postbuild_results = {}
+        self.build_result = BuildResult(fail_reason="not built")
+        self.plugin_workspace = {}
+        self.plugins_timestamps = {}
+        self.plugins_durations = {}
+        self.plugins_errors = {}
+        self.exported_image_sequence = []
+        self.tag_conf = TagConf()
+        self.push_conf = PushConf()
+        self.files = {}
+        self.image_components = None
+        self.pulled_base_images = set()
+        self.built_image_inspect = None
+        self.layer_sizes = []
+
+
+def build(workflow, tmpdir, checkpoint):
+    """
+    simulate build which completes pre-build, build-step and pre-publish phases
+    """
+    workflow.prebuild_results['plugin'] = 'prebuild result'
+    with open(workflow.builder.df_path, 'a') as df:
+        df.write('LABEL a=b\n')
+    workflow.builder.set_df_path(workflow.builder.df_path)
+    checkpoint.record(workflow, 'prebuild')
+
+    workflow.build_result = BuildResult(image_id='sha256:1234')
+    workflow.builder.image_id = 'sha256:1234'
+    workflow.builder.is_built = True
+    checkpoint.record(workflow, 'buildstep')
+
+    exported = tmpdir.join('image.tar')
+    exported.write('image')
+    workflow.exported_image_sequence.append({'path': str(exported), 'size': 5})
+    workflow.tag_conf.add_primary_image('test-image:1.0')
+    checkpoint.record(workflow, 'prepublish')
+
+
+def test_restore(tmpdir):
+    checkpoint_dir = str(tmpdir.join('checkpoint'))
+    workflow = FakeWorkflow(tmpdir.mkdir('first'))
+    build(workflow, tmpdir, Checkpoint(checkpoint_dir))
+    # build tmpdir is removed
+    tmpdir.join('image.tar').remove()
+
+    workflow = FakeWorkflow(tmpdir.mkdir('second'))
+    checkpoint = Checkpoint(checkpoint_dir)
+    checkpoint.load()
+    assert checkpoint.restore(workflow) == set(['prebuild', 'buildstep', 'prepublish'])
+
+    assert workflow.prebuild_results == {'plugin': 'prebuild result'}
+    assert workflow.build_result.image_id == 'sha256:1234'
+    assert workflow.builder.image_id == 'sha256:1234'
+    assert workflow.builder.is_built
+    assert workflow.tag_conf.primary_images == [ImageName.parse('test-image:1.0')]
+    with open(workflow.builder.df_path) as df:
+        assert df.read() == 'FROM fedora:27\nLABEL a=b\n'
+
+    exported, = workflow.exported_image_sequence
+    assert exported['path'].startswith(checkpoint.files_dir)
+    with open(exported['path']) as f:
+        assert f.read() == 'image'
+
+
+@pytest.mark.parametrize(('change', 'skipped'), [
+    ('prebuild_plugins_conf', set()),
+    # pre-build runs again along with build-step
+    ('buildstep_plugins_conf', set()),
+    ('prepublish_plugins_conf', set(['prebuild', 'buildstep'])),
+    ('postbuild_plugins_conf', set(['prebuild', 'buildstep', 'prepublish'])),
+    ('image', set()),
+    ('commit_id', set()),
+])
+def test_changed_inputs(tmpdir, change, skipped):
+    checkpoint_dir = str(tmpdir.join('checkpoint'))
+    build(FakeWorkflow(tmpdir.mkdir('first')), tmpdir, Checkpoint(checkpoint_dir))
+
+    workflow = FakeWorkflow(tmpdir.mkdir('second'))
+    if change == 'image':
+        workflow.image = 'other-image'
+    elif change == 'commit_id':
+        workflow.source.commit_id = '012345'
+    else:
+        setattr(workflow, change, [])
+    checkpoint = Checkpoint(checkpoint_dir)
+    checkpoint.load()
+
+    assert checkpoint.restore(workflow) == skipped
+    assert [phase['name'] for phase in checkpoint.phases] == \
+        [name for name, _ in PHASES if name in skipped]
+
+
+def test_built_image_removed(tmpdir):
+    checkpoint_dir = str(tmpdir.join('checkpoint'))
+    build(FakeWorkflow(tmpdir.mkdir('first')), tmpdir, Checkpoint(checkpoint_dir))
+
+    workflow = FakeWorkflow(tmpdir.mkdir('second'), image_exists=False)
+    checkpoint = Checkpoint(checkpoint_dir)
+    checkpoint.load()
+
+    # files created by pre-build plugins are not stored, build needs them
+    assert checkpoint.restore(workflow) == set()
+    assert checkpoint.phases == []
+    assert workflow.prebuild_results == {}
+    assert not workflow.builder.is_built
+    with open(workflow.builder.df_path) as df:
+        assert df.read() == 'FROM fedora:27\n'
+
+
+def test_remote_build_result(tmpdir):
+    checkpoint_dir = str(tmpdir.join('checkpoint'))
+    workflow = FakeWorkflow(tmpdir.mkdir('first'))
+    checkpoint = Checkpoint(checkpoint_dir)
+    checkpoint.record(workflow, 'prebuild')
+    workflow.build_result = BuildResult.make_remote_image_result(annotations={'a': 'b'})
+    checkpoint.record(workflow, 'buildstep')
+
+    workflow = FakeWorkflow(tmpdir.mkdir('second'))
+    checkpoint = Checkpoint(checkpoint_dir)
+    checkpoint.load()
+    assert checkpoint.restore(workflow) == set(['prebuild', 'buildstep'])
+
+    assert not workflow.build_result.is_failed()
+    assert workflow.build_result.image_id is BuildResult.REMOTE_IMAGE
+    assert not workflow.build_result.is_image_available()
+    assert workflow.build_result.annotations == {'a': 'b'}
+
+
+def test_unpicklable_state(tmpdir):
+    checkpoint = Checkpoint(str(tmpdir))
+    workflow = FakeWorkflow(tmpdir)
+    workflow.prebuild_results['plugin'] = lambda: None
+
+    checkpoint.record(workflow, 'prebuild')
+    workflow.prebuild_results['plugin'] = None
+    # phases have to be restored in order
+    checkpoint.record(workflow, 'buildstep')
+
+    assert checkpoint.phases == []
+    assert not os.path.exists(checkpoint.path)
+
+
+def test_clear(tmpdir):
+    checkpoint_dir = str(tmpdir.join('checkpoint'))
+    checkpoint = Checkpoint(checkpoint_dir)
+    build(FakeWorkflow(tmpdir.mkdir('first')), tmpdir, checkpoint)
+
+    checkpoint.clear()
+
+    assert os.listdir(checkpoint_dir) == []
+    checkpoint.load()
+    assert checkpoint.phases == []
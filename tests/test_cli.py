@@ -8,6 +8,7 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import print_function, unicode_literals
 
+import json
 import logging
 import os
 import sys
@@ -21,6 +22,8 @@ from atomic_reactor.buildimage import BuildImageBuilder
 from atomic_reactor.core import DockerTasker
 from atomic_reactor.plugin import InputPluginsRunner
 import atomic_reactor.cli.main
+import atomic_reactor.daemon
+import atomic_reactor.inner
 
 from tests.fixtures import is_registry_running, temp_image_name, get_uuid  # noqa
 from tests.constants import LOCALHOST_REGISTRY, DOCKERFILE_GIT, DOCKERFILE_OK_PATH, FILES, MOCK
@@ -203,3 +206,37 @@ class TestCLISuite(object):
 
         encoding = codecs.getreader(match[1])
         assert encoding == encodings.utf_8.StreamReader
+
+    @pytest.mark.parametrize(('args', 'profile_plugins'), [
+        ([], None),
+        (['--profile-plugins'], ['*']),
+        (['--profile-plugins', 'koji_import', 'squash'], ['koji_import', 'squash']),
+    ])
+    def test_inside_build_profile_plugins(self, args, profile_plugins):
+        (flexmock.flexmock(atomic_reactor.inner)
+            .should_receive('build_inside')
+            .with_args(input_method='auto', input_args=None, substitutions=None,
+                       profile_plugins=profile_plugins)
+            .once())
+
+        self.exec_cli(["main.py", "--verbose", "inside-build"] + args)
+
+    @pytest.mark.parametrize('success', [True, False])
+    def test_submit_build(self, tmpdir, success):
+        json_path = str(tmpdir.join('build.json'))
+        with open(json_path, 'w') as f:
+            json.dump({'image': 'test'}, f)
+        (flexmock.flexmock(atomic_reactor.daemon)
+            .should_receive('submit_build')
+            .with_args('/run/reactor.sock', {'image': 'test'})
+            .and_return({'exit_code': 0 if success else 1, 'success': success})
+            .once())
+
+        command = ["main.py", "--verbose", "submit-build", "--socket", "/run/reactor.sock",
+                   json_path]
+        if success:
+            self.exec_cli(command)
+        else:
+            with pytest.raises(SystemExit) as exc:
+                self.exec_cli(command)
+            assert exc.value.code == 1
@@ -0,0 +1,126 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import imp
+import os
+import socket
+import threading
+
+import pytest
+from flexmock import flexmock
+
+from atomic_reactor import daemon, util
+from atomic_reactor.daemon import ReactorDaemon, submit_build
+from atomic_reactor.plugin import plugin_registry, PreBuildPlugin
+
+
+@pytest.fixture
+def running_daemon(tmpdir):
+    socket_path = str(tmpdir.join('reactor.sock'))
+    reactor_daemon = ReactorDaemon(socket_path, max_builds=2)
+    reactor_daemon.bind()
+    thread = threading.Thread(target=reactor_daemon.serve_forever, name='dispatcher')
+    thread.start()
+    yield reactor_daemon
+    reactor_daemon.shutdown()
+    thread.join()
+    assert not os.path.exists(socket_path)
+
+
+def test_warm_up(monkeypatch):
+    monkeypatch.setattr(util, '_schema_validators', {})
+    plugin_registry.clear()
+
+    daemon.warm_up()
+
+    assert set(util._schema_validators) == set(daemon.WARM_SCHEMAS)
+    plugins_dir = os.path.join(os.path.dirname(daemon.__file__), 'plugins')
+    files = [os.path.join(plugins_dir, f) for f in os.listdir(plugins_dir) if f.endswith('.py')]
+    assert all(f in plugin_registry._modules for f in files)
+
+    # builds don't import plugins again
+    flexmock(imp).should_receive('load_source').never()
+    assert plugin_registry.get_plugin_classes(files, PreBuildPlugin)
+
+
+@pytest.mark.parametrize('exit_code', [0, 3])
+def test_submit_build(running_daemon, exit_code):
+    (flexmock(daemon)
+        .should_receive('_build_in_worker')
+        .with_args({'image': 'test', 'plugin_files': []})
+        .and_return(exit_code))
+
+    result = submit_build(running_daemon.socket_path, {'image': 'test'})
+
+    assert result['exit_code'] == exit_code
+    assert result['success'] == (exit_code == 0)
+    assert result['pid'] != os.getpid()
+
+
+def test_submit_builds_concurrently(running_daemon):
+    flexmock(daemon).should_receive('_build_in_worker').and_return(0)
+    results = []
+
+    def submit():
+        results.append(submit_build(running_daemon.socket_path, {'image': 'test'}))
+
+    threads = [threading.Thread(target=submit) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 3
+    assert all(result['success'] for result in results)
+    assert len(set(result['pid'] for result in results)) == 3
+
+
+def test_worker_forked_by_dispatcher(running_daemon):
+    # forked worker continues in thread which called fork()
+    (flexmock(daemon)
+        .should_receive('_build_in_worker')
+        .replace_with(lambda build_json: 0 if threading.current_thread().name == 'dispatcher'
+                      else 5))
+
+    result = submit_build(running_daemon.socket_path, {'image': 'test'})
+
+    assert result['exit_code'] == 0
+
+
+def test_invalid_build_json(running_daemon):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(running_daemon.socket_path)
+    sock.sendall(b'{\n')
+    result = daemon._read_message(sock)
+    sock.close()
+
+    assert not result['success']
+    assert 'invalid build json' in result['error']
+
+
+@pytest.mark.parametrize(('failed', 'exit_code'), [
+    (None, 1),
+    (True, 1),
+    (False, 0),
+])
+def test_build_in_worker(failed, exit_code):
+    workflow = flexmock()
+    if failed is None:
+        workflow.should_receive('build_docker_image').and_raise(RuntimeError)
+    else:
+        result = flexmock(is_failed=lambda: failed)
+        workflow.should_receive('build_docker_image').and_return(result)
+    (flexmock(daemon)
+        .should_receive('DockerBuildWorkflow')
+        .with_args(source={'provider': 'path'}, image='test')
+        .and_return(workflow))
+
+    build_json = {'source': {'provider': 'path'}, 'image': 'test'}
+    assert daemon._build_in_worker(build_json) == exit_code
@@ -0,0 +1,79 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+
+Startup cost of atomic-reactor command
+
+Heavy dependencies have to be imported only by commands (and plugins) which
+use them, otherwise every run of atomic-reactor pays for them.
+"""
+
+from __future__ import unicode_literals
+
+import subprocess
+import sys
+
+import pytest
+
+
+# importing the CLI must not import any of these
+HEAVY_MODULES = (
+    'docker',
+    'docker_squash',
+    'dockpulp',
+    'jsonschema',
+    'koji',
+    'osbs.api',
+    'pkg_resources',
+    'requests',
+    'atomic_reactor.inner',
+    'atomic_reactor.plugin',
+)
+# cumulative import time of the CLI module, in microseconds
+IMPORT_TIME_BUDGET = 100000
+# import time is measured several times and the best one is used
+IMPORT_TIME_RUNS = 3
+CLI_MODULE = 'atomic_reactor.cli.main'
+
+
+def get_imported_modules(module):
+    code = 'import sys, {0}; print("\\n".join(sys.modules))'.format(module)
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return set(output.decode('utf-8').split())
+
+
+def get_import_time(module):
+    """
+    :return: int, cumulative import time of module in microseconds as
+        reported by python -X importtime
+    """
+    output = subprocess.check_output([sys.executable, '-X', 'importtime', '-c',
+                                      'import {0}'.format(module)],
+                                     stderr=subprocess.STDOUT)
+    for line in output.decode('utf-8').splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line.split('|')
+        if name.strip() == module:
+            return int(cumulative)
+    raise AssertionError('import time of {0} not found in:\n{1}'.format(module, output))
+
+
+def test_cli_does_not_import_heavy_modules():
+    imported = get_imported_modules(CLI_MODULE)
+    assert CLI_MODULE in imported
+    assert sorted(imported.intersection(HEAVY_MODULES)) == []
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7),
+                    reason='python -X importtime is available since python 3.7')
+def test_cli_import_time():
+    import_time = min(get_import_time(CLI_MODULE) for _ in range(IMPORT_TIME_RUNS))
+    assert import_time <= IMPORT_TIME_BUDGET, \
+        'importing {0} took {1} us, budget is {2} us'.format(CLI_MODULE, import_time,
+                                                             IMPORT_TIME_BUDGET)
@@ -22,6 +22,7 @@ from atomic_reactor.plugin import (PreBuildPlugin, PrePublishPlugin, PostBuildPl
 import atomic_reactor.plugin
 from atomic_reactor.plugins.build_docker_api import DockerApiPlugin
 import atomic_reactor.inner
+import atomic_reactor.trace
 from flexmock import flexmock
 import pytest
 from tests.constants import MOCK_SOURCE, SOURCE
@@ -87,6 +88,9 @@ class MockDockerTasker(object):
     def build_image_from_path(self):
         return True
 
+    def image_exists(self, image_id):
+        return True
+
 
 class MockDockerTaskerBaseImage(MockDockerTasker):
     def inspect_image(self, name):
@@ -354,6 +358,101 @@ def test_workflow():
     assert workflow.base_image_inspect == {}
 
 
+def test_workflow_trace(tmpdir):
+    """
+    Test trace of plugins is written when requested
+    """
+
+    flexmock(DockerfileParser, content='df_content')
+    this_file = inspect.getfile(PreWatched)
+    mock_docker()
+    fake_builder = MockInsideBuilder()
+    flexmock(InsideBuilder).new_instances(fake_builder)
+    trace_path = os.path.join(str(tmpdir), 'trace.json')
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image',
+                                   prebuild_plugins=[{'name': 'pre_watched',
+                                                      'args': {
+                                                          'watcher': Watcher()
+                                                      }}],
+                                   buildstep_plugins=[{'name': 'buildstep_watched',
+                                                       'args': {
+                                                           'watcher': Watcher()
+                                                       }}],
+                                   exit_plugins=[{'name': 'exit_watched',
+                                                  'args': {
+                                                      'watcher': Watcher()
+                                                  }}],
+                                   plugin_files=[this_file],
+                                   trace_path=trace_path)
+
+    workflow.build_docker_image()
+
+    with open(trace_path) as f:
+        events = json.load(f)['traceEvents']
+
+    spans = dict((event['args']['span_id'], event) for event in events)
+    plugins = dict((event['name'], event) for event in events if event['cat'] == 'plugin')
+    assert set(plugins) == set(['pre_watched', 'buildstep_watched', 'exit_watched'])
+    assert spans[plugins['pre_watched']['args']['parent_id']]['name'] == 'PreBuildPluginsRunner'
+    assert spans[plugins['exit_watched']['args']['parent_id']]['name'] == 'ExitPluginsRunner'
+    assert atomic_reactor.trace.get_recorder() is None
+
+
+@pytest.mark.parametrize('change_prepublish', [False, True])
+def test_workflow_checkpoint(tmpdir, change_prepublish):
+    """
+    Test phases completed by failed build are skipped when it runs again
+    """
+
+    flexmock(DockerfileParser, content='df_content')
+    this_file = inspect.getfile(PreWatched)
+    mock_docker()
+    fake_builder = MockInsideBuilder()
+    flexmock(InsideBuilder).new_instances(fake_builder)
+    checkpoint_dir = str(tmpdir.join('checkpoint'))
+    watchers = dict((phase, Watcher()) for phase in ('pre', 'buildstep', 'prepub', 'post'))
+    plugins = {
+        'prebuild_plugins': [{'name': 'pre_watched',
+                              'args': {'watcher': watchers['pre']}}],
+        'buildstep_plugins': [{'name': 'buildstep_watched',
+                               'args': {'watcher': watchers['buildstep']}}],
+        'prepublish_plugins': [{'name': 'prepub_watched',
+                                'args': {'watcher': watchers['prepub']}}],
+    }
+
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image',
+                                   postbuild_plugins=[{'name': 'post_raises'}],
+                                   plugin_files=[this_file],
+                                   checkpoint_dir=checkpoint_dir,
+                                   **plugins)
+    with pytest.raises(PluginFailedException):
+        workflow.build_docker_image()
+    assert all(watcher.was_called() for phase, watcher in watchers.items() if phase != 'post')
+    assert os.path.exists(os.path.join(checkpoint_dir, 'checkpoint.pickle'))
+
+    for watcher in watchers.values():
+        watcher.called = False
+    if change_prepublish:
+        plugins['prepublish_plugins'][0]['args']['watcher'] = Watcher()
+        watchers['prepub'] = plugins['prepublish_plugins'][0]['args']['watcher']
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image',
+                                   postbuild_plugins=[{'name': 'post_watched',
+                                                       'args': {'watcher': watchers['post']}}],
+                                   plugin_files=[this_file],
+                                   checkpoint_dir=checkpoint_dir,
+                                   **plugins)
+    workflow.build_docker_image()
+
+    assert not watchers['pre'].was_called()
+    assert not watchers['buildstep'].was_called()
+    assert watchers['prepub'].was_called() == change_prepublish
+    assert watchers['post'].was_called()
+    assert workflow.build_result.image_id == DUMMY_BUILD_RESULT.image_id
+    assert workflow.builder.is_built
+    # build succeeded, there's nothing to resume
+    assert not os.path.exists(os.path.join(checkpoint_dir, 'checkpoint.pickle'))
+
+
 def test_workflow_base_images():
     """
     Test workflow for base images
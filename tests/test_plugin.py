@@ -8,8 +8,11 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
+import imp
 import json
 import os
+import pstats
+import threading
 import time
 
 from dockerfile_parse import DockerfileParser
@@ -24,8 +27,10 @@ from atomic_reactor.plugin import (BuildPluginsRunner, PreBuildPluginsRunner,
                                    ExitPluginsRunner, BuildStepPluginsRunner,
                                    PluginsRunner, InappropriateBuildStepError,
                                    BuildStepPlugin, PreBuildPlugin,
-                                   PreBuildSleepPlugin)
+                                   PreBuildSleepPlugin, PostBuildPlugin,
+                                   PluginRegistry)
 from atomic_reactor.plugins.pre_add_yum_repo_by_url import AddYumRepoByUrlPlugin
+from atomic_reactor.profiling import tracemalloc
 from atomic_reactor.util import ImageName
 
 from tests.fixtures import docker_tasker  # noqa
@@ -59,6 +64,49 @@ class MyPreBuildPlugin(PreBuildPlugin):
         raise InappropriateBuildStepError
 
 
+EVENTS = {}
+
+
+class MyConcurrentPlugin1(PreBuildPlugin):
+    key = 'MyConcurrentPlugin1'
+    reads = ()
+    writes = ()
+
+    def run(self):
+        EVENTS[self.key].set()
+        return EVENTS[MyConcurrentPlugin2.key].wait(5)
+
+
+class MyConcurrentPlugin2(PreBuildPlugin):
+    key = 'MyConcurrentPlugin2'
+    reads = ()
+    writes = ()
+
+    def run(self):
+        EVENTS[self.key].set()
+        return EVENTS[MyConcurrentPlugin1.key].wait(5)
+
+
+class MyWriterPlugin(PreBuildPlugin):
+    key = 'MyWriterPlugin'
+    is_allowed_to_fail = False
+    reads = ()
+    writes = ('files',)
+
+    def run(self):
+        time.sleep(0.1)
+        self.workflow.files['written'] = 'content'
+
+
+class MyReaderPlugin(PreBuildPlugin):
+    key = 'MyReaderPlugin'
+    reads = ('files',)
+    writes = ()
+
+    def run(self):
+        return self.workflow.files.get('written')
+
+
 def mock_workflow(tmpdir):
     if MOCK:
         mock_docker()
@@ -99,6 +147,44 @@ def test_load_plugins(docker_tasker, runner_type):
     assert len(runner.plugin_classes) > 0
 
 
+def test_plugin_registry_caches_modules(tmpdir):
+    plugin_file = tmpdir.join('pre_cached_plugin.py')
+    plugin_file.write("\n".join([
+        "from atomic_reactor.plugin import PreBuildPlugin",
+        "class CachedPlugin(PreBuildPlugin):",
+        "    key = 'cached'",
+    ]))
+    path = str(plugin_file)
+
+    registry = PluginRegistry()
+    classes = registry.get_plugin_classes([path], PreBuildPlugin)
+    assert list(classes.keys()) == ['cached']
+
+    # unchanged file is not imported again
+    (flexmock(imp)
+        .should_receive('load_source')
+        .never())
+    assert registry.get_plugin_classes([path], PreBuildPlugin) == classes
+    assert registry.get_plugin_classes([path], PostBuildPlugin) == {}
+
+    flexmock(imp).should_call('load_source').once()
+    plugin_file.write(plugin_file.read().replace("'cached'", "'changed'"))
+    mtime = os.path.getmtime(path) + 10
+    os.utime(path, (mtime, mtime))
+    assert list(registry.get_plugin_classes([path], PreBuildPlugin).keys()) == ['changed']
+
+
+def test_plugin_registry_shared_by_runners(docker_tasker):  # noqa
+    workflow = DockerBuildWorkflow(SOURCE, "")
+    PreBuildPluginsRunner(docker_tasker, workflow, None)
+
+    (flexmock(imp)
+        .should_receive('load_source')
+        .never())
+    runner = PostBuildPluginsRunner(docker_tasker, workflow, None)
+    assert len(runner.plugin_classes) > 0
+
+
 class X(object):
     pass
 
@@ -255,6 +341,110 @@ def test_no_appropriate_buildstep_build_plugin(caplog, tmpdir, docker_tasker):
         runner.run()
 
 
+def test_concurrent_plugins(tmpdir, docker_tasker):  # noqa
+    workflow = mock_workflow(tmpdir)
+    EVENTS.clear()
+    EVENTS[MyConcurrentPlugin1.key] = threading.Event()
+    EVENTS[MyConcurrentPlugin2.key] = threading.Event()
+    flexmock(PluginsRunner, load_plugins=lambda x: {
+                                        MyConcurrentPlugin1.key: MyConcurrentPlugin1,
+                                        MyConcurrentPlugin2.key: MyConcurrentPlugin2, })
+    runner = PreBuildPluginsRunner(docker_tasker, workflow,
+                                   [{"name": MyConcurrentPlugin1.key},
+                                    {"name": MyConcurrentPlugin2.key}],
+                                   max_workers=2)
+    results = runner.run()
+
+    assert results == {MyConcurrentPlugin1.key: True, MyConcurrentPlugin2.key: True}
+    assert set(workflow.plugins_timestamps) == set(results)
+    assert set(workflow.plugins_durations) == set(results)
+
+
+@pytest.mark.parametrize('reader_declared', [True, False])  # noqa
+def test_concurrent_plugins_dependencies(tmpdir, docker_tasker, reader_declared):
+    workflow = mock_workflow(tmpdir)
+    reads = ('files',) if reader_declared else None
+    flexmock(MyReaderPlugin, reads=reads)
+    flexmock(PluginsRunner, load_plugins=lambda x: {
+                                        MyWriterPlugin.key: MyWriterPlugin,
+                                        MyReaderPlugin.key: MyReaderPlugin, })
+    runner = PreBuildPluginsRunner(docker_tasker, workflow,
+                                   [{"name": MyWriterPlugin.key},
+                                    {"name": MyReaderPlugin.key}],
+                                   max_workers=2)
+    results = runner.run()
+
+    assert results[MyReaderPlugin.key] == 'content'
+
+
+def test_concurrent_plugins_fatal_failure(tmpdir, docker_tasker):  # noqa
+    workflow = mock_workflow(tmpdir)
+    flexmock(MyWriterPlugin).should_receive('run').and_raise(RuntimeError)
+    flexmock(MyReaderPlugin).should_receive('run').never()
+    flexmock(PluginsRunner, load_plugins=lambda x: {
+                                        MyWriterPlugin.key: MyWriterPlugin,
+                                        MyReaderPlugin.key: MyReaderPlugin, })
+    runner = PreBuildPluginsRunner(docker_tasker, workflow,
+                                   [{"name": MyWriterPlugin.key},
+                                    {"name": MyReaderPlugin.key}],
+                                   max_workers=2)
+    with pytest.raises(PluginFailedException):
+        runner.run()
+
+    assert workflow.plugin_failed is True
+    assert MyWriterPlugin.key in workflow.plugins_errors
+    assert MyReaderPlugin.key not in workflow.prebuild_results
+
+
+@pytest.mark.parametrize('exc', [SystemExit, KeyboardInterrupt])  # noqa
+def test_concurrent_plugins_base_exception(tmpdir, docker_tasker, exc):
+    workflow = mock_workflow(tmpdir)
+    flexmock(MyWriterPlugin).should_receive('run').and_raise(exc)
+    flexmock(MyReaderPlugin).should_receive('run').never()
+    flexmock(PluginsRunner, load_plugins=lambda x: {
+                                        MyWriterPlugin.key: MyWriterPlugin,
+                                        MyReaderPlugin.key: MyReaderPlugin, })
+    runner = PreBuildPluginsRunner(docker_tasker, workflow,
+                                   [{"name": MyWriterPlugin.key},
+                                    {"name": MyReaderPlugin.key}],
+                                   max_workers=2)
+    # propagated from plugin thread as from serially running plugin
+    with pytest.raises(exc):
+        runner.run()
+
+
+@pytest.mark.parametrize(('request_profile', 'profile_plugins', 'profiled'), [  # noqa
+    (True, None, True),
+    (False, ['*'], True),
+    (False, [MyWriterPlugin.key], True),
+    (False, ['other'], False),
+    (False, None, False),
+])
+def test_profile_plugin(tmpdir, docker_tasker, request_profile, profile_plugins, profiled):
+    workflow = mock_workflow(tmpdir)
+    workflow.profile_dir = str(tmpdir.join('profile'))
+    workflow.profile_plugins = profile_plugins
+    flexmock(PluginsRunner, load_plugins=lambda x: {MyWriterPlugin.key: MyWriterPlugin})
+    runner = PreBuildPluginsRunner(docker_tasker, workflow,
+                                   [{"name": MyWriterPlugin.key,
+                                     "profile": request_profile}])
+    runner.run()
+
+    if not profiled:
+        assert workflow.profile_outputs == []
+        return
+
+    pstats_path = os.path.join(workflow.profile_dir, MyWriterPlugin.key + '.pstats')
+    assert pstats_path in workflow.profile_outputs
+    stats = pstats.Stats(pstats_path)
+    assert any(func[2] == 'run' for func in stats.stats)
+    if tracemalloc is not None:
+        allocations_path = os.path.join(workflow.profile_dir,
+                                        MyWriterPlugin.key + '-allocations.txt')
+        assert workflow.profile_outputs == [pstats_path, allocations_path]
+        assert os.path.exists(allocations_path)
+
+
 def test_fallback_to_docker_build(docker_tasker):  # noqa
     """
     test fallback to docker build
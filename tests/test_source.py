@@ -22,6 +22,29 @@ class TestGitSource(object):
         assert os.path.basename(gs.path) == 'docker-hello-world'
 
 
+def test_git_source_clone_params(tmpdir):
+    gs = GitSource('git', 'foo', provider_params={'git_commit': 'abcdef',
+                                                  'git_cache_dir': str(tmpdir),
+                                                  'git_depth': 1})
+    assert gs.lg.commit == 'abcdef'
+    assert gs.lg.cache_dir == str(tmpdir)
+    assert gs.lg.depth == 1
+    assert gs.lg.sparse_paths is None
+
+
+@pytest.mark.parametrize(('dockerfile_path', 'sparse_paths'), [
+    (None, None),
+    ('./', None),
+    ('spam/spam/', ['spam/spam']),
+    ('spam/Dockerfile', ['spam']),
+    ('./spam/flatpak.json', ['spam']),
+])
+def test_git_source_sparse_checkout(dockerfile_path, sparse_paths):
+    gs = GitSource('git', 'foo', dockerfile_path=dockerfile_path,
+                   provider_params={'git_sparse_checkout': True})
+    assert gs.lg.sparse_paths == sparse_paths
+
+
 class TestPathSource(object):
     def test_copies_target_dir(self, tmpdir):
         tmpdir.ensure('foo', 'bar', 'Dockerfile')
@@ -32,6 +55,32 @@ class TestPathSource(object):
         #  since second (and any subsequent) access does a bit different thing than the first one
         assert ps.get() == path
 
+    @pytest.mark.parametrize('copy_method', [None, 'copy', 'hardlink', 'reflink'])
+    def test_copy_method(self, tmpdir, copy_method):
+        tmpdir.join('foo', 'bar', 'Dockerfile').write('FROM fedora', ensure=True)
+        tmpdir.join('foo', 'bar', 'artifact').write('data', ensure=True)
+        provider_params = {'copy_method': copy_method} if copy_method else None
+        ps = PathSource('path', 'file://' + os.path.join(str(tmpdir), 'foo'),
+                        provider_params=provider_params)
+        path = ps.path
+        with open(os.path.join(path, 'bar', 'Dockerfile')) as f:
+            assert f.read() == 'FROM fedora'
+        with open(os.path.join(path, 'bar', 'artifact')) as f:
+            assert f.read() == 'data'
+        assert ps.get() == path
+
+        # Dockerfile is modified by plugins, it must never be shared with source
+        with open(os.path.join(path, 'bar', 'Dockerfile'), 'w') as f:
+            f.write('FROM centos')
+        assert tmpdir.join('foo', 'bar', 'Dockerfile').read() == 'FROM fedora'
+        linked = os.path.samefile(os.path.join(path, 'bar', 'artifact'),
+                                  str(tmpdir.join('foo', 'bar', 'artifact')))
+        assert linked == (copy_method == 'hardlink')
+
+    def test_invalid_copy_method(self, tmpdir):
+        with pytest.raises(ValueError):
+            PathSource('path', 'file://' + str(tmpdir), provider_params={'copy_method': 'move'})
+
 
 class TestGetSourceInstanceFor(object):
     @pytest.mark.parametrize('source, expected', [
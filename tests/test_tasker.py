@@ -280,6 +280,29 @@ def test_get_image_info_by_name_tag_in_name_nonexisten(temp_image_name):  # noqa
     assert len(response) == 0
 
 
+@pytest.mark.parametrize('gzip', [True, False])
+def test_build_image_from_path_streams_context(tmpdir, gzip):
+    if MOCK:
+        mock_docker()
+
+    tmpdir.join('Dockerfile').write('FROM fedora')
+    t = DockerTasker()
+    build_kwargs = {}
+
+    def build(**kwargs):
+        build_kwargs.update(kwargs)
+        # daemon reads the whole context
+        list(kwargs['fileobj'])
+        return iter([])
+
+    flexmock(docker.APIClient, build=build)
+    t.build_image_from_path(str(tmpdir), ImageName.parse('test-image'), stream=True, gzip=gzip)
+    assert build_kwargs['custom_context'] is True
+    assert build_kwargs['encoding'] == ('gzip' if gzip else None)
+    assert 'path' not in build_kwargs
+    assert build_kwargs['fileobj'].size > 0
+
+
 @requires_internet  # noqa
 def test_build_image_from_path(tmpdir, temp_image_name):
     if MOCK:
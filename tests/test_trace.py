@@ -0,0 +1,207 @@
+"""
+Copyright (c) 2018 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import json
+import threading
+
+import pytest
+import responses
+from flexmock import flexmock
+
+from atomic_reactor import trace
+from atomic_reactor.core import DockerTasker
+from atomic_reactor.trace import TraceRecorder
+from atomic_reactor.util import get_retrying_requests_session
+
+
+@pytest.fixture
+def recorder():
+    recorder = TraceRecorder()
+    trace.set_recorder(recorder)
+    yield recorder
+    trace.set_recorder(None)
+
+
+def test_nested_spans(recorder):
+    with trace.span('phase', 'phase') as phase:
+        with trace.span('plugin', 'plugin', answer=42) as plugin:
+            assert trace.current_span() is plugin
+
+    assert trace.current_span() is None
+    assert phase.parent_id is None
+    assert plugin.parent_id == phase.span_id
+    assert plugin.args['answer'] == 42
+    assert plugin.args['peak_rss_kb'] > 0
+    assert phase.duration >= plugin.duration >= 0
+
+
+def test_span_error(recorder):
+    with pytest.raises(ValueError):
+        with trace.span('failing', 'plugin'):
+            raise ValueError('oops')
+
+    span, = recorder.spans
+    assert span.args['error'] == repr(ValueError('oops'))
+    assert span.end is not None
+
+
+def test_span_explicit_parent(recorder):
+    with trace.span('phase', 'phase') as phase:
+        children = []
+
+        def run():
+            with trace.span('plugin', 'plugin', parent=phase) as child:
+                children.append(child)
+
+        thread = threading.Thread(target=trace.bind(run))
+        thread.start()
+        thread.join()
+
+    assert children[0].parent_id == phase.span_id
+    assert children[0].thread_id != phase.thread_id
+
+
+def test_recorder_bound_to_thread(recorder):
+    other = TraceRecorder()
+    spans = []
+
+    def other_build():
+        trace.set_recorder(other)
+        with trace.span('other', 'plugin'):
+            pass
+        spans.append(trace.get_recorder())
+
+    thread = threading.Thread(target=other_build)
+    thread.start()
+    thread.join()
+
+    # builds in other threads don't replace recorder of this one
+    assert trace.get_recorder() is recorder
+    assert spans == [other]
+    assert [span.name for span in other.spans] == ['other']
+    assert recorder.spans == []
+
+
+def test_bind(recorder):
+    with trace.span('phase', 'phase') as phase:
+        def run():
+            with trace.span('http', 'http') as child:
+                return child
+
+        results = []
+        bound = trace.bind(run)
+        thread = threading.Thread(target=lambda: results.append(bound()))
+        thread.start()
+        thread.join()
+
+    child, = results
+    assert child.parent_id == phase.span_id
+    assert recorder.spans == [phase, child]
+
+
+def test_trace_stream_generator(recorder):
+    def stream():
+        yield b'a'
+        yield b'b'
+
+    span = trace.start_span('build', 'docker')
+    traced = trace.trace_stream(stream(), span)
+    assert span.end is None
+    assert list(traced) == [b'a', b'b']
+    assert span.end is not None
+    assert trace.current_span() is None
+
+
+def test_trace_stream_file(recorder):
+    span = trace.start_span('get_image', 'docker')
+    with trace.trace_stream(io.BytesIO(b'data'), span) as stream:
+        assert stream.read(2) == b'da'
+        assert stream.read() == b'ta'
+        assert span.end is None
+    assert span.end is not None
+    assert span.args['bytes_received'] == 4
+
+    span = trace.start_span('inspect_image', 'docker')
+    assert trace.trace_stream({'Id': 'x'}, span) == {'Id': 'x'}
+    assert span.end is not None
+
+
+def test_docker_stream_span(recorder):
+    def build(**kwargs):
+        yield b'step 1'
+        yield b'step 2'
+
+    tasker = DockerTasker(retry_times=0)
+    flexmock(tasker.d.wrapped, build=build)
+    stream = tasker.d.build(path='.')
+    span, = recorder.spans
+    assert span.name == 'build'
+    assert span.end is None
+
+    assert list(stream) == [b'step 1', b'step 2']
+    assert span.end is not None
+
+
+def test_no_recorder():
+    assert trace.get_recorder() is None
+    with trace.span('nothing', 'plugin') as span:
+        span.args['bytes_received'] = 1
+    assert trace.current_span() is None
+
+
+def test_chrome_trace(recorder, tmpdir):
+    with trace.span('phase', 'phase'):
+        with trace.span('plugin', 'plugin'):
+            pass
+
+    path = str(tmpdir.join('trace.json'))
+    recorder.save(path)
+    with open(path) as f:
+        data = json.load(f)
+
+    phase, plugin = data['traceEvents']
+    assert phase['ph'] == plugin['ph'] == 'X'
+    assert phase['cat'] == 'phase'
+    assert plugin['args']['parent_id'] == phase['args']['span_id']
+    assert phase['dur'] >= plugin['dur']
+
+
+def test_summary(recorder):
+    for name in ('fast', 'slow'):
+        with trace.span(name, 'plugin') as span:
+            pass
+        span.end = span.start + (10 if name == 'slow' else 1)
+    with trace.span('GET /v2/', 'http', bytes_sent=10, bytes_received=100):
+        pass
+
+    summary = recorder.summary(slowest=1)
+    assert summary['categories']['plugin']['count'] == 2
+    assert summary['categories']['plugin']['duration'] == pytest.approx(11)
+    assert summary['categories']['http']['bytes'] == 110
+    assert summary['slowest_plugins'] == [{'name': 'slow', 'duration': pytest.approx(10)}]
+    assert summary['peak_rss_kb'] > 0
+
+
+@responses.activate
+def test_http_request_span(recorder):
+    url = 'https://registry.example.com/v2/'
+    responses.add(responses.POST, url, body='{}', status=200,
+                  adding_headers={'Content-Length': '2'})
+
+    session = get_retrying_requests_session()
+    session.post(url + '?token=secret', data='data')
+
+    span, = recorder.spans
+    assert span.category == 'http'
+    assert span.name == 'POST ' + url
+    assert span.args['status'] == 200
+    assert span.args['bytes_sent'] == 4
+    assert span.args['bytes_received'] == 2
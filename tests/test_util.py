@@ -8,8 +8,13 @@ of the BSD license. See the LICENSE file for details.
 
 from __future__ import unicode_literals
 
+import errno
+import gzip
+import hashlib
+import io
 import json
 import os
+import pickle
 import tempfile
 import pytest
 import requests
@@ -17,7 +22,9 @@ import responses
 from requests.exceptions import ConnectionError
 import six
 import subprocess
+import tarfile
 import time
+import zlib
 
 from tempfile import mkdtemp
 from textwrap import dedent
@@ -45,7 +52,7 @@ from atomic_reactor.util import (ImageName, wait_for_command, clone_git_repo,
 from atomic_reactor import util
 from tests.constants import (DOCKERFILE_GIT, FLATPAK_GIT,
                              INPUT_IMAGE, MOCK, DOCKERFILE_SHA1, MOCK_SOURCE)
-from atomic_reactor.constants import INSPECT_CONFIG
+from atomic_reactor.constants import INSPECT_CONFIG, CHECKSUM_BLOCK_SIZE, LOG_TAIL_LINES
 
 from tests.util import requires_internet
 
@@ -133,6 +140,167 @@ def test_clone_git_repo(tmpdir):
     assert os.path.isdir(os.path.join(tmpdir_path, '.git'))
 
 
+def commit_to_local_git_repo(path, n):
+    with open(os.path.join(path, 'Dockerfile'), 'w') as f:
+        f.write('FROM fedora\nLABEL n={}\n'.format(n))
+    subprocess.check_call(['git', 'add', 'Dockerfile'], cwd=path)
+    subprocess.check_call(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                           'commit', '-q', '-m', str(n)], cwd=path)
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=path).strip()
+
+
+def make_local_git_repo(path, commits=3):
+    """create git repo with the given number of commits, return list of their IDs"""
+    os.makedirs(path)
+    subprocess.check_call(['git', 'init', '-q'], cwd=path)
+    commit_ids = [commit_to_local_git_repo(path, n) for n in range(commits)]
+    subprocess.check_call(['git', 'branch', '-M', 'master'], cwd=path)
+    return commit_ids
+
+
+def test_clone_git_repo_cache_dir(tmpdir):
+    repo_path = str(tmpdir.join('repo'))
+    commit_ids = make_local_git_repo(repo_path)
+    git_url = 'file://' + repo_path
+    cache_dir = str(tmpdir.join('cache'))
+
+    target = str(tmpdir.join('clone1'))
+    assert clone_git_repo(git_url, target, commit=commit_ids[0],
+                          cache_dir=cache_dir) == commit_ids[0]
+    mirrors = [m for m in os.listdir(cache_dir) if m.endswith('.git')]
+    assert len(mirrors) == 1
+    with open(os.path.join(target, '.git', 'objects', 'info', 'alternates')) as f:
+        assert os.path.join(cache_dir, mirrors[0]) in f.read()
+
+    # new commits are fetched into the existing mirror
+    new_commit_id = commit_to_local_git_repo(repo_path, 'new')
+    target = str(tmpdir.join('clone2'))
+    lazy_git = LazyGit(git_url, commit=new_commit_id, tmpdir=target, cache_dir=cache_dir)
+    assert lazy_git.git_path == target
+    assert lazy_git.commit_id == new_commit_id
+    assert [m for m in os.listdir(cache_dir) if m.endswith('.git')] == mirrors
+    subprocess.check_call(['git', 'cat-file', '-e', new_commit_id],
+                          cwd=os.path.join(cache_dir, mirrors[0]))
+
+
+@pytest.mark.parametrize('method', ['copy', 'hardlink', 'reflink'])
+def test_copy_tree(tmpdir, method):
+    src = tmpdir.join('src')
+    for n in range(20):
+        src.join('dir{}'.format(n % 3), 'file{}'.format(n)).write(str(n), ensure=True)
+    src.join('Dockerfile').write('FROM fedora')
+    os.symlink(str(src.join('dir0')), str(src.join('link')))
+    dst = str(tmpdir.join('dst'))
+
+    util.copy_tree(str(src), dst, method=method, no_hardlink=['Dockerfile'], workers=4)
+    for n in range(20):
+        path = os.path.join('dir{}'.format(n % 3), 'file{}'.format(n))
+        with open(os.path.join(dst, path)) as f:
+            assert f.read() == str(n)
+        assert (os.path.samefile(os.path.join(dst, path), str(src.join(path))) ==
+                (method == 'hardlink'))
+    assert not os.path.samefile(os.path.join(dst, 'Dockerfile'), str(src.join('Dockerfile')))
+    assert not os.path.islink(os.path.join(dst, 'link'))
+    assert os.path.isfile(os.path.join(dst, 'link', 'file0'))
+
+
+def test_break_hardlink(tmpdir):
+    tmpdir.join('src', 'file').write('data', ensure=True)
+    src = str(tmpdir.join('src', 'file'))
+    dst = str(tmpdir.join('dst'))
+    os.link(src, dst)
+    os.chmod(dst, 0o750)
+
+    util.break_hardlink(dst)
+    with open(dst, 'w') as f:
+        f.write('changed')
+    assert tmpdir.join('src', 'file').read() == 'data'
+    assert os.stat(dst).st_mode & 0o777 == 0o750
+    assert sorted(os.listdir(str(tmpdir))) == ['dst', 'src']
+
+    # private files and missing ones are left alone
+    inode = os.stat(dst).st_ino
+    util.break_hardlink(dst)
+    assert os.stat(dst).st_ino == inode
+    util.break_hardlink(str(tmpdir.join('missing')))
+
+
+def test_copy_tree_hardlink_fallback(tmpdir):
+    tmpdir.join('src', 'file').write('data', ensure=True)
+    flexmock(os).should_receive('link').and_raise(OSError(errno.EXDEV, 'cross-device link'))
+    util.copy_tree(str(tmpdir.join('src')), str(tmpdir.join('dst')), method='hardlink')
+    assert tmpdir.join('dst', 'file').read() == 'data'
+
+
+def test_map_in_threads():
+    assert util.map_in_threads(lambda x: x * 2, list(range(10)), 3) == list(range(0, 20, 2))
+    assert util.map_in_threads(lambda x: x, [], 3) == []
+
+    def fail(x):
+        raise CustomTestException(x)
+
+    with pytest.raises(CustomTestException):
+        util.map_in_threads(fail, [1, 2], 2)
+
+
+def test_map_registries():
+    assert util.map_registries(lambda x: x * 2, ['a', 'b', 'c'], 2) == ['aa', 'bb', 'cc']
+
+    processed = []
+
+    def fail(registry):
+        processed.append(registry)
+        if registry in failing:
+            raise CustomTestException(registry)
+        return registry
+
+    # other registries are processed even when one fails
+    failing = ['b']
+    with pytest.raises(CustomTestException):
+        util.map_registries(fail, ['a', 'b', 'c'], 1)
+    assert processed == ['a', 'b', 'c']
+
+    failing = ['b', 'c']
+    with pytest.raises(RuntimeError) as exc:
+        util.map_registries(fail, ['a', 'b', 'c'], 3)
+    assert 'b: CustomTestException' in str(exc.value)
+    assert 'c: CustomTestException' in str(exc.value)
+
+
+def test_clone_git_repo_sparse(tmpdir):
+    repo_path = str(tmpdir.join('repo'))
+    commit_ids = make_local_git_repo(repo_path)
+    for path in ('image/Dockerfile', 'other/Dockerfile', 'top'):
+        tmpdir.join('repo', path).write(path, ensure=True)
+    subprocess.check_call(['git', 'add', '.'], cwd=repo_path)
+    commit_ids.append(commit_to_local_git_repo(repo_path, 'sparse'))
+    target = str(tmpdir.join('clone'))
+
+    assert clone_git_repo('file://' + repo_path, target,
+                          sparse_paths=['image']) == commit_ids[-1]
+    assert os.path.isfile(os.path.join(target, 'Dockerfile'))
+    assert os.path.isfile(os.path.join(target, 'top'))
+    assert os.path.isfile(os.path.join(target, 'image', 'Dockerfile'))
+    assert not os.path.exists(os.path.join(target, 'other'))
+    assert subprocess.check_output(['git', 'status', '--porcelain'], cwd=target) == b''
+
+
+@pytest.mark.parametrize('commit_index, unshallow', [
+    (-1, False),
+    (0, True),
+])
+def test_clone_git_repo_depth(tmpdir, commit_index, unshallow):
+    repo_path = str(tmpdir.join('repo'))
+    commit_ids = make_local_git_repo(repo_path)
+    target = str(tmpdir.join('clone'))
+
+    commit_id = clone_git_repo('file://' + repo_path, target, commit=commit_ids[commit_index],
+                               depth=1)
+    assert commit_id == commit_ids[commit_index]
+    shallow = os.path.exists(os.path.join(target, '.git', 'shallow'))
+    assert shallow != unshallow
+
+
 class TestCommandResult(object):
     @pytest.mark.parametrize(('item', 'expected'), [
         ({"stream": "Step 0 : FROM ebbc51b7dfa5bcd993a[...]"},
@@ -144,7 +312,58 @@ class TestCommandResult(object):
     def test_parse_item(self, item, expected):
         cr = CommandResult()
         cr.parse_item(item)
-        assert cr.logs == [expected]
+        assert list(cr.logs) == [expected]
+        assert cr.parsed_logs == [item]
+
+    def test_parsed_logs_bounded(self):
+        cr = CommandResult()
+        for n in range(LOG_TAIL_LINES + 10):
+            cr.parse_item({'stream': str(n)})
+        assert len(cr.parsed_logs) == LOG_TAIL_LINES
+        assert cr.parsed_logs[-1] == {'stream': str(LOG_TAIL_LINES + 9)}
+        assert len(cr.logs) == LOG_TAIL_LINES + 10
+
+
+@pytest.mark.parametrize('count', [0, 5, 6, 1000])
+def test_log_buffer(count):
+    logs = util.LogBuffer(memory_lines=5, tail_lines=3)
+    lines = ['line {} \u2018'.format(n) for n in range(count)]
+    for line in lines:
+        logs.append(line)
+    assert len(logs) == count
+    assert list(logs) == lines
+    assert logs.tail == lines[-3:]
+    assert (logs._lines is None) == (count > 5)
+
+    # more lines can be added after reading
+    logs.append('last')
+    assert list(logs) == lines + ['last']
+
+
+@pytest.mark.parametrize('count', [5, 1000])
+def test_log_buffer_pickle(count):
+    logs = util.LogBuffer(memory_lines=5, tail_lines=3)
+    lines = ['line {} \u2018'.format(n) for n in range(count)]
+    for line in lines:
+        logs.append(line)
+
+    restored = pickle.loads(pickle.dumps(BuildResult(logs=logs, image_id='sha256:1234'), 2)).logs
+
+    # spilled buffer keeps only its tail
+    expected = lines if count <= 5 else lines[-3:]
+    assert list(restored) == expected
+    assert len(restored) == len(expected)
+    assert restored.tail == lines[-3:]
+    restored.append('last')
+    assert list(restored) == expected + ['last']
+    # original buffer is still usable
+    assert list(logs) == lines
+
+
+def test_write_log_lines():
+    f = io.BytesIO()
+    util.write_log_lines(f, ['a', '\u2018', 'b'])
+    assert f.getvalue() == 'a\n\u2018\nb'.encode('utf-8')
 
 
 @requires_internet
@@ -247,10 +466,200 @@ def test_get_hexdigests(tmpdir, content, algorithms, expected):
         assert checksums == expected
 
 
+def test_get_checksums_multiple_blocks(tmpdir):
+    content = os.urandom(3 * CHECKSUM_BLOCK_SIZE + 10)
+    path = str(tmpdir.join('image.tar'))
+    with open(path, 'wb') as f:
+        f.write(content)
+
+    checksums = get_checksums(path, ['md5', 'sha1', 'sha256'])
+
+    assert checksums == {
+        'md5sum': hashlib.md5(content).hexdigest(),
+        'sha1sum': hashlib.sha1(content).hexdigest(),
+        'sha256sum': hashlib.sha256(content).hexdigest(),
+    }
+
+
+def test_get_checksums_cached(tmpdir):
+    path = str(tmpdir.join('image.tar'))
+    with open(path, 'wb') as f:
+        f.write(b'abc')
+
+    (flexmock(util)
+        .should_call('compute_checksums')
+        .with_args(path, ['md5', 'sha256'])
+        .once())
+    get_checksums(path, ['md5', 'sha256'])
+    # computed already
+    assert get_checksums(path, ['md5']) == {'md5sum': '900150983cd24fb0d6963f7d28e17f72'}
+
+    (flexmock(util)
+        .should_call('compute_checksums')
+        .with_args(path, ['sha1'])
+        .once())
+    get_checksums(path, ['md5', 'sha1'])
+
+    # file changes
+    os.remove(path)
+    with open(path, 'wb') as f:
+        f.write(b'abcd')
+    (flexmock(util)
+        .should_call('compute_checksums')
+        .with_args(path, ['md5'])
+        .once())
+    assert get_checksums(path, ['md5']) == {'md5sum': hashlib.md5(b'abcd').hexdigest()}
+
+
+def test_get_checksums_cached_hardlink(tmpdir):
+    path = str(tmpdir.join('image.tar'))
+    with open(path, 'wb') as f:
+        f.write(b'abc')
+    get_checksums(path, ['md5'])
+
+    # hardlinking (e.g. into checkpoint directory) changes ctime only
+    link = str(tmpdir.join('preserved.tar'))
+    os.link(path, link)
+    flexmock(util).should_receive('compute_checksums').never()
+    assert get_checksums(path, ['md5']) == {'md5sum': '900150983cd24fb0d6963f7d28e17f72'}
+    assert get_checksums(link, ['md5']) == {'md5sum': '900150983cd24fb0d6963f7d28e17f72'}
+
+
+def test_hashing_writer(tmpdir):
+    path = str(tmpdir.join('image.tar.gz'))
+    with util.hashing_writer(path) as writer:
+        writer.write(b'ab')
+        writer.write(b'c')
+        assert writer.tell() == 3
+
+    with open(path, 'rb') as f:
+        assert f.read() == b'abc'
+
+    (flexmock(util)
+        .should_receive('compute_checksums')
+        .never())
+    assert get_checksums(path, ['md5', 'sha256']) == {
+        'md5sum': hashlib.md5(b'abc').hexdigest(),
+        'sha256sum': hashlib.sha256(b'abc').hexdigest(),
+    }
+
+
+@pytest.mark.parametrize('size', [0, 1000, 128 * 1024, 1000 * 1000])
+@pytest.mark.parametrize('threads', [1, 4])
+def test_parallel_gzip_writer(size, threads):
+    # compressible, but not trivially
+    data = b''.join(hashlib.md5(str(n % 5000).encode()).digest() for n in range(size // 16))
+    data += b'x' * (size % 16)
+    f = io.BytesIO()
+    writer = util.ParallelGzipWriter(f, threads=threads)
+    for start in range(0, len(data), 7777):
+        writer.write(data[start:start + 7777])
+    writer.close()
+    assert writer.size == len(data)
+
+    with gzip.GzipFile(fileobj=io.BytesIO(f.getvalue())) as g:
+        assert g.read() == data
+    if size == 1000 * 1000:
+        # priming blocks with previous data keeps repeated content small
+        assert len(f.getvalue()) < len(zlib.compress(data, 6)) * 1.1
+
+
+@pytest.mark.parametrize('size', [0, 1000, 3 * 1024 * 1024 + 5])
+def test_parallel_xz_writer(monkeypatch, size):
+    data = os.urandom(1024) * (size // 1024) + b'x' * (size % 1024)
+    f = io.BytesIO()
+    monkeypatch.setattr(util.ParallelXzWriter, 'block_size', 1024 * 1024)
+    writer = util.ParallelXzWriter(f, threads=3)
+    writer.write(data)
+    writer.close()
+    assert util.lzma.decompress(f.getvalue()) == data
+
+
+def test_parallel_compress_writer_error():
+    class FailingWriter(util.ParallelCompressWriter):
+        block_size = 10
+
+        def _compress_block(self, block, previous, last):
+            raise CustomTestException()
+
+    writer = FailingWriter(io.BytesIO(), threads=2)
+    with pytest.raises(CustomTestException):
+        try:
+            writer.write(b'x' * 100)
+        finally:
+            writer.close()
+    assert not any(thread.is_alive() for thread in writer._threads)
+
+
+@pytest.mark.parametrize('mode', ['w', 'w:gz', 'w:xz'])
+def test_filter_tar(tmpdir, mode):
+    path = str(tmpdir.join('image.tar'))
+    with tarfile.open(path, mode=mode) as tar:
+        for name in ('manifest.json', 'a/layer.tar', 'a/json', 'b/layer.tar', 'b/json'):
+            info = tarfile.TarInfo(name)
+            info.size = len(name)
+            tar.addfile(info, io.BytesIO(name.encode('utf-8')))
+        tar.addfile(tarfile.TarInfo('link'))
+
+    f = io.BytesIO()
+    assert util.filter_tar(path, f, exclude=['a/layer.tar', 'c/layer.tar']) == ['a/layer.tar']
+    f.seek(0)
+    with tarfile.open(fileobj=f) as tar:
+        assert tar.getnames() == ['manifest.json', 'a/json', 'b/layer.tar', 'b/json', 'link']
+        assert tar.extractfile('b/layer.tar').read() == b'b/layer.tar'
+
+
+@pytest.mark.skipif(util.zstandard is None, reason='zstandard not installed')
+def test_zstd_decompress(tmpdir):
+    data = os.urandom(1000) * 100
+    path = str(tmpdir.join('image.tar.zst'))
+    with open(path, 'wb') as f:
+        f.write(util.zstandard.ZstdCompressor().compress(data))
+    f = io.BytesIO()
+    assert util.zstd_decompress(path, f) == len(data)
+    assert f.getvalue() == data
+
+
+def test_zstd_decompress_unavailable(tmpdir, monkeypatch):
+    monkeypatch.setattr(util, 'zstandard', None)
+    with pytest.raises(RuntimeError):
+        util.zstd_decompress(str(tmpdir.join('image.tar.zst')), io.BytesIO())
+
+
+@pytest.mark.parametrize('gzip', [True, False])
+def test_build_context_stream(tmpdir, gzip):
+    context = tmpdir.join('context')
+    context.join('Dockerfile').write('FROM fedora\nCOPY . /src\n', ensure=True)
+    context.join('.dockerignore').write('*.log\nartifacts/skip\n')
+    context.join('build.log').write('ignored')
+    context.join('artifacts', 'skip').write('ignored', ensure=True)
+    content = os.urandom(5000)
+    context.join('artifacts', 'big.jar').write(content, mode='wb')
+    context.join('empty').write('')
+
+    stream = util.BuildContextStream(str(context), gzip=gzip, block_size=1024)
+    blocks = list(stream)
+    if not gzip:
+        # files are streamed in blocks, not read whole
+        assert max(len(block) for block in blocks) <= 1024
+    data = b''.join(blocks)
+    assert stream.size == len(data)
+    assert stream.content_size == 5000 + len('FROM fedora\nCOPY . /src\n') + len(
+        '*.log\nartifacts/skip\n')
+
+    tar = tarfile.open(fileobj=io.BytesIO(data), mode='r:gz' if gzip else 'r:')
+    assert sorted(tar.getnames()) == ['.dockerignore', 'Dockerfile', 'artifacts',
+                                      'artifacts/big.jar', 'empty']
+    assert tar.extractfile('artifacts/big.jar').read() == content
+    assert tar.extractfile('empty').read() == b''
+    assert tar.getmember('artifacts').isdir()
+
+
 @pytest.mark.parametrize('path, image_type, expected', [
     ('foo.tar', IMAGE_TYPE_DOCKER_ARCHIVE, 'docker-image-XXX.x86_64.tar'),
     ('foo.tar.gz', IMAGE_TYPE_DOCKER_ARCHIVE, 'docker-image-XXX.x86_64.tar.gz'),
     ('foo.tar.gz', IMAGE_TYPE_OCI_TAR, 'oci-image-XXX.x86_64.tar.gz'),
+    ('foo.tar.zst', IMAGE_TYPE_DOCKER_ARCHIVE, 'docker-image-XXX.x86_64.tar.zst'),
     ('foo', IMAGE_TYPE_OCI, None),
 ])
 def test_get_image_upload_filename(path, image_type, expected):
@@ -385,6 +794,68 @@ def test_registry_session(tmpdir, registry, insecure, method, responses_method):
     assert res.text == 'A-OK'
 
 
+def test_registry_session_pool(tmpdir):
+    temp_dir = mkdtemp(dir=str(tmpdir))
+    dockercfg = os.path.join(temp_dir, '.dockercfg')
+    with open(dockercfg, 'w') as f:
+        f.write(json.dumps({'example.com': {'username': 'john.doe', 'password': 'letmein'}}))
+
+    session = util.registry_session_pool.get('example.com', dockercfg_path=temp_dir)
+    assert util.registry_session_pool.get('example.com', dockercfg_path=temp_dir) is session
+    assert util.registry_session_pool.get('example.com', insecure=True,
+                                          dockercfg_path=temp_dir) is not session
+    assert util.registry_session_pool.get('example.com') is not session
+
+    # credentials changed
+    os.utime(dockercfg, (0, 0))
+    assert util.registry_session_pool.get('example.com', dockercfg_path=temp_dir) is not session
+
+
+@responses.activate
+def test_registry_session_bearer_token(tmpdir, monkeypatch):
+    temp_dir = mkdtemp(dir=str(tmpdir))
+    with open(os.path.join(temp_dir, '.dockercfg'), 'w') as f:
+        f.write(json.dumps({'example.com': {'username': 'john.doe', 'password': 'letmein'}}))
+    session = RegistrySession('example.com', dockercfg_path=temp_dir)
+
+    def token_callback(request):
+        assert request.headers['Authorization'].startswith('Basic ')
+        assert 'scope=repository%3Atest%2Fimage%3Apull' in request.url
+        return (200, {}, json.dumps({'token': 'abc', 'expires_in': 300}))
+
+    def manifest_callback(request):
+        if request.headers.get('Authorization') != 'Bearer abc':
+            challenge = ('Bearer realm="https://auth.example.com/token",'
+                         'service="example.com",scope="repository:test/image:pull"')
+            return (401, {'WWW-Authenticate': challenge}, '')
+        return (200, {}, 'A-OK')
+
+    responses.add_callback(responses.GET, 'https://auth.example.com/token', token_callback)
+    responses.add_callback(responses.GET, 'https://example.com/v2/test/image/manifests/latest',
+                           manifest_callback)
+    closed = []
+    response_close = requests.Response.close
+
+    def close(response):
+        closed.append(response.status_code)
+        response_close(response)
+
+    monkeypatch.setattr(requests.Response, 'close', close)
+
+    for _ in range(2):
+        res = session.get('/v2/test/image/manifests/latest', stream=True)
+        assert res.text == 'A-OK'
+
+    # rejected response was closed before the request was retried with token
+    assert 401 in closed
+
+    # token was reused for the second request
+    token_calls = [call for call in responses.calls
+                   if call.request.url.startswith('https://auth.example.com')]
+    assert len(token_calls) == 1
+    assert len(responses.calls) == 4
+
+
 @pytest.mark.parametrize(('version', 'expected'), [
     ('v1', 'application/vnd.docker.distribution.manifest.v1+json'),
     ('v2', 'application/vnd.docker.distribution.manifest.v2+json'),
@@ -493,10 +964,12 @@ def test_get_manifest_digests(tmpdir, image, registry, insecure, creds,
         # an error, fall back to http
         if insecure:
             https_url = 'https://' + registry + path
+            responses.add(responses.HEAD, https_url, body=ConnectionError())
             responses.add(responses.GET, https_url, body=ConnectionError())
             url = 'http://' + registry + path
         else:
             url = 'https://' + registry + path
+    responses.add_callback(responses.HEAD, url, callback=request_callback)
     responses.add_callback(responses.GET, url, callback=request_callback)
 
     expected_versions = versions
@@ -631,6 +1104,9 @@ def test_get_manifest_digests_missing(tmpdir, has_content_type_header, has_conte
     (flexmock(requests.Session)
         .should_receive('get')
         .replace_with(custom_get))
+    (flexmock(requests.Session)
+        .should_receive('head')
+        .replace_with(custom_get))
 
     if manifest_type == 'v1' and not has_content_type_header:
         # v1 manifests don't have a mediaType field, so we can't fall back
@@ -694,12 +1170,97 @@ def test_get_manifest_digests_connection_error(tmpdir):
     kwargs['registry'] = 'https://example.com'
 
     url = 'https://example.com/v2/spam/manifests/latest'
+    responses.add(responses.HEAD, url, body=ConnectionError())
     responses.add(responses.GET, url, body=ConnectionError())
 
     with pytest.raises(ConnectionError):
         get_manifest_digests(**kwargs)
 
 
+@pytest.mark.parametrize('has_content_type_header', [True, False])
+def test_get_manifest_digests_head(has_content_type_header):
+    image = ImageName.parse('example.com/spam:latest')
+    url = 'https://example.com/v2/spam/manifests/latest'
+
+    def request_callback(request):
+        media_type = request.headers['Accept']
+        headers = {'Docker-Content-Digest': media_type + '-digest'}
+        if has_content_type_header:
+            headers['Content-Type'] = media_type
+        return (200, headers, json.dumps({'schemaVersion': 2, 'mediaType': media_type}))
+
+    with responses.RequestsMock() as rsps:
+        rsps.add_callback(responses.HEAD, url, callback=request_callback, content_type=None)
+        if not has_content_type_header:
+            rsps.add_callback(responses.GET, url, callback=request_callback, content_type=None)
+
+        digests = get_manifest_digests(image, 'https://example.com', versions=('v2', 'oci'))
+
+        methods = [call.request.method for call in rsps.calls]
+        if has_content_type_header:
+            # manifest bodies are not downloaded
+            assert methods == ['HEAD', 'HEAD']
+        else:
+            assert sorted(methods) == ['GET', 'GET', 'HEAD', 'HEAD']
+
+    assert digests.v2 == get_manifest_media_type('v2') + '-digest'
+    assert digests.oci == get_manifest_media_type('oci') + '-digest'
+
+
+def test_manifest_cache_memory_lru():
+    cache = util.ManifestCache(max_memory=10)
+    cache.store('example.com', 'spam', 'sha256:1', 'type', b'12345', 'type')
+    cache.store('example.com', 'spam', 'sha256:2', 'type', b'12345', 'type')
+    # mark as recently used
+    assert cache.get('https://example.com', 'spam', 'sha256:1', 'type') == (b'12345', 'type')
+    cache.store('example.com', 'spam', 'sha256:3', 'type', b'12345', 'type')
+
+    assert cache.get('example.com', 'spam', 'sha256:1', 'type') == (b'12345', 'type')
+    assert cache.get('example.com', 'spam', 'sha256:2', 'type') is None
+    assert cache.get('example.com', 'spam', 'sha256:3', 'type') == (b'12345', 'type')
+    assert cache.get('example.com', 'spam', 'sha256:3', 'other-type') is None
+    assert cache.get('example.com', 'eggs', 'sha256:3', 'type') is None
+
+
+def test_manifest_cache_disk(tmpdir):
+    cache = util.ManifestCache(directory=str(tmpdir), max_disk=30)
+    cache.store('example.com', 'spam', 'sha256:1', 'type', b'12345', 'type')
+    cache.store('example.com', 'spam', 'sha256:2', None, b'{"a": 1}', 'json')
+
+    # another process using the same directory
+    cache = util.ManifestCache(directory=str(tmpdir), max_disk=30)
+    assert cache.get('example.com', 'spam', 'sha256:1', 'type') == (b'12345', 'type')
+    assert cache.get('example.com', 'spam', 'sha256:2', None) == (b'{"a": 1}', 'json')
+
+    cache.store('example.com', 'spam', 'sha256:3', 'type', b'12345', 'type')
+    assert len(os.listdir(str(tmpdir))) == 2
+
+
+@responses.activate
+def test_query_registry_cached():
+    image = ImageName.parse('example.com/spam:latest')
+    manifest = json.dumps({'schemaVersion': 2})
+    url = 'https://example.com/v2/spam/manifests/{}'
+    responses.add(responses.GET, url.format('sha256:123'), body=manifest,
+                  content_type=get_manifest_media_type('v2'),
+                  headers={'Docker-Content-Digest': 'sha256:123'})
+    responses.add(responses.GET, url.format('latest'), body=manifest,
+                  content_type=get_manifest_media_type('v2'))
+    session = RegistrySession('https://example.com')
+
+    for _ in range(2):
+        response = util.query_registry(session, image, digest='sha256:123', version='v2')
+        assert response.json() == {'schemaVersion': 2}
+        assert response.headers['Content-Type'] == get_manifest_media_type('v2')
+        assert response.headers['Docker-Content-Digest'] == 'sha256:123'
+    assert len(responses.calls) == 1
+
+    # tags are always looked up
+    for _ in range(2):
+        util.query_registry(session, image, version='v2')
+    assert len(responses.calls) == 3
+
+
 @pytest.mark.parametrize('namespace,repo,explicit,expected', [
     ('foo', 'bar', False, 'foo/bar'),
     ('foo', 'bar', True, 'foo/bar'),
@@ -830,6 +1391,60 @@ def test_df_parser_parent_env_wf(tmpdir, caplog, env_arg):
         assert df.labels.get('label') == 'foobar ' + env_arg[0].split('=', 1)[1]
 
 
+def test_df_parser_shared_by_workflow(tmpdir):
+    df_path = str(tmpdir.join('Dockerfile'))
+    with open(df_path, 'w') as f:
+        f.write('FROM fedora\nLABEL a=1\n')
+    workflow = DockerBuildWorkflow(MOCK_SOURCE, 'test-image')
+    flexmock(workflow, base_image_inspect={INSPECT_CONFIG: {'Env': ['test_env=first']}})
+
+    df = df_parser(df_path, workflow=workflow)
+    assert df_parser(str(tmpdir), workflow=workflow) is df
+    assert df.labels == {'a': '1'}
+
+    # edits through the parser are written to the file
+    df.labels = {'a': '2'}
+    assert df_parser(df_path, workflow=workflow) is df
+    with open(df_path) as f:
+        assert 'a=2' in f.read()
+
+    # file changed by someone else
+    with open(df_path, 'w') as f:
+        f.write('FROM fedora\nLABEL a=3\n')
+    df = df_parser(df_path, workflow=workflow)
+    assert df.labels == {'a': '3'}
+    assert df_parser(df_path, workflow=workflow) is df
+
+    # parent environment changed
+    flexmock(workflow, base_image_inspect={INSPECT_CONFIG: {'Env': ['test_env=second']}})
+    assert df_parser(df_path, workflow=workflow) is not df
+
+
+def test_df_parser_structure_parsed_once(tmpdir, monkeypatch):
+    df_path = str(tmpdir.join('Dockerfile'))
+    with open(df_path, 'w') as f:
+        f.write('FROM fedora\nLABEL a=1\n')
+    df = util.SharedDockerfileParser(df_path)
+
+    parse = util.DockerfileParser.structure.fget
+    parsed = []
+
+    def counting_parse(parser):
+        parsed.append(parser)
+        return parse(parser)
+
+    monkeypatch.setattr(util.DockerfileParser, 'structure', property(counting_parse))
+    assert df.baseimage == 'fedora'
+    assert df.labels == {'a': '1'}
+    df.structure[0]['instruction'] = 'RUN'
+    assert df.structure[0]['instruction'] == 'FROM'
+    assert len(parsed) == 1
+
+    df.labels = {'a': '2'}
+    assert df.labels == {'a': '2'}
+    assert len(parsed) == 2
+
+
 @pytest.mark.parametrize(('available', 'requested', 'result'), (
     (['spam', 'bacon', 'eggs'], ['spam'], True),
     (['spam', 'bacon', 'eggs'], ['spam', 'bacon'], True),